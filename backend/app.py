@@ -1,8 +1,9 @@
 #!/export/ollama/bin/python3
 from flask import Flask, request, jsonify, send_from_directory, Response
 import ollama
-from queue import Queue
-from threading import Thread, Event, Lock
+from queue import Queue, Empty
+from threading import Thread, Event, Lock, Condition
+import socket
 import uuid
 import os
 import requests
@@ -10,12 +11,198 @@ import requests
 import json
 import time
 import sys
+from collections import deque
 
 app = Flask(__name__)
-task_queue = Queue()
-active_task = None
 task_results = {}
-stop_requested = False
+
+# Scheduling: tasks are served by priority class first (interactive chat before
+# codegen before analyze/test batches), then by weighted fair queuing across
+# clients (API key name, else client IP) within a class, so one client's big
+# ,analyze run cannot starve everyone else. A waiting task moves up one class
+# every SHELLAMA_PRIORITY_AGING seconds so batches still make progress.
+PRIORITY_CLASSES = ('interactive', 'codegen', 'batch')
+TASK_PRIORITY = {'chat': 'interactive', 'analyze': 'batch'}  # everything else is 'codegen'
+PRIORITY_AGING = int(os.environ.get('SHELLAMA_PRIORITY_AGING', '120'))
+# Fair-share weights, e.g. SHELLAMA_CLIENT_WEIGHTS="ci=0.5,alice=2" (default 1)
+CLIENT_WEIGHTS = {k.strip(): float(v) for k, v in
+                  (kv.split('=', 1) for kv in os.environ.get('SHELLAMA_CLIENT_WEIGHTS', '').split(',') if '=' in kv)}
+
+
+class FairQueue(Queue):
+    """Queue ordered by priority class, then start-time fair queuing per client.
+
+    Each (class, client) pair has a FIFO. A task's virtual start is the later of
+    its class's virtual clock and its client's previous virtual finish; the next
+    task served is the head with the best (aged class, virtual start)."""
+
+    def _init(self, maxsize):
+        self.queue = []  # all waiting tasks, in arrival order
+        self._flows = {}  # (class, client) -> deque of tasks
+        self._finish = {}  # (class, client) -> virtual finish of last task
+        self._vclock = dict.fromkeys(PRIORITY_CLASSES, 0.0)
+        self._seq = 0
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, task):
+        cls = task.get('priority') if task.get('priority') in PRIORITY_CLASSES else 'codegen'
+        key = (cls, task.get('client') or '')
+        vstart = max(self._vclock[cls], self._finish.get(key, 0.0))
+        self._finish[key] = vstart + 1.0 / CLIENT_WEIGHTS.get(key[1], 1.0)
+        self._seq += 1
+        task['_sched'] = (PRIORITY_CLASSES.index(cls), vstart, self._seq)
+        task.setdefault('enqueued', time.time())
+        self._flows.setdefault(key, deque()).append(task)
+        self.queue.append(task)
+
+    def _rank(self, task, now):
+        rank, vstart, seq = task['_sched']
+        if PRIORITY_AGING > 0:
+            rank = max(0, rank - int((now - task['enqueued']) / PRIORITY_AGING))
+        return (rank, vstart, seq)
+
+    def _get(self):
+        now = time.time()
+        key = min((k for k, f in self._flows.items() if f), key=lambda k: self._rank(self._flows[k][0], now))
+        task = self._flows[key].popleft()
+        if not self._flows[key]:
+            del self._flows[key]
+        self.queue.remove(task)
+        cls = key[0]
+        self._vclock[cls] = max(self._vclock[cls], task['_sched'][1])
+        if not any(k[0] == cls for k in self._flows):
+            # Class drained: forget finish tags so returning clients start fresh
+            self._finish = {k: v for k, v in self._finish.items() if k[0] != cls}
+        return task
+
+    def remove(self, task_id):
+        """Remove a waiting task by id. Returns it, or None if not queued."""
+        with self.mutex:
+            task = next((t for t in self.queue if t['id'] == task_id), None)
+            if task is None:
+                return None
+            self.queue.remove(task)
+            for key, flow in list(self._flows.items()):
+                if task in flow:
+                    flow.remove(task)
+                    if not flow:
+                        del self._flows[key]
+                    break
+            self.not_full.notify()
+        self.task_done()
+        return task
+
+    def ahead_of(self, task_id):
+        """Number of waiting tasks that would be served before task_id."""
+        with self.mutex:
+            now = time.time()
+            mine = next((t for t in self.queue if t['id'] == task_id), None)
+            if mine is None:
+                return 0  # already picked up by a worker
+            rank = self._rank(mine, now)
+            return sum(1 for t in self.queue if t is not mine and self._rank(t, now) < rank)
+
+    def snapshot(self):
+        """Waiting task counts per priority class and per client."""
+        with self.mutex:
+            classes = dict.fromkeys(PRIORITY_CLASSES, 0)
+            clients = {}
+            for (cls, client), flow in self._flows.items():
+                classes[cls] += len(flow)
+                clients[client or 'unknown'] = clients.get(client or 'unknown', 0) + len(flow)
+        return {'queued': classes, 'clients': clients}
+
+
+task_queue = FairQueue()
+
+# Wait time (enqueue -> start) of recently started tasks, per priority class
+_wait_samples = {cls: deque(maxlen=500) for cls in PRIORITY_CLASSES}
+_wait_served = dict.fromkeys(PRIORITY_CLASSES, 0)
+_wait_lock = Lock()
+
+
+def _classify(task):
+    """Set a task's priority class and fair-share client from the request.
+
+    Callers may only demote a task (e.g. the frontend marks /test runs 'batch')."""
+    data = request.get_json(silent=True) or {}
+    cls = TASK_PRIORITY.get(task.get('type'), 'codegen')
+    asked = data.get('priority')
+    if asked in PRIORITY_CLASSES and PRIORITY_CLASSES.index(asked) > PRIORITY_CLASSES.index(cls):
+        cls = asked
+    task['priority'] = cls
+    task['client'] = data.get('client_user') or task.get('client_ip') or request.remote_addr
+
+
+def _record_wait(task):
+    cls = task.get('priority', 'codegen')
+    with _wait_lock:
+        _wait_samples[cls].append(task['started'] - task.get('enqueued', task['started']))
+        _wait_served[cls] += 1
+
+
+def _scheduler_status():
+    """Queue depth per class/client and wait-time percentiles per class."""
+    status = task_queue.snapshot()
+    waits = {}
+    with _wait_lock:
+        for cls in PRIORITY_CLASSES:
+            samples = sorted(_wait_samples[cls])
+            waits[cls] = {
+                'served': _wait_served[cls],
+                'p50': round(samples[len(samples) // 2], 2) if samples else None,
+                'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else None,
+                'max': round(samples[-1], 2) if samples else None,
+            }
+    status['wait'] = waits
+    return status
+
+# Worker pool: SHELLAMA_WORKER_SLOTS workers drain task_queue concurrently.
+# Default scales with cores (1 slot per 8 logical CPUs, max 8). A model runs
+# at most OLLAMA_NUM_PARALLEL tasks at once (match the ollama server setting),
+# and a model that is not already running is only started alongside other
+# work if psutil reports enough free RAM to load it.
+def _default_worker_slots():
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=True) or 1
+    except Exception:
+        cores = 1
+    return max(1, min(cores // 8, 8))
+
+WORKER_SLOTS = int(os.environ.get('SHELLAMA_WORKER_SLOTS', '0') or 0) or _default_worker_slots()
+MODEL_PARALLEL = int(os.environ.get('OLLAMA_NUM_PARALLEL', '0') or 0) or WORKER_SLOTS
+RAM_HEADROOM = 1.2  # model file size * headroom must fit in available RAM
+# Ollama API base for streamed chats, from the same OLLAMA_HOST the ollama client reads
+OLLAMA_URL = os.environ.get('OLLAMA_HOST', '127.0.0.1:11434').replace('0.0.0.0', '127.0.0.1')
+OLLAMA_URL = (OLLAMA_URL if '://' in OLLAMA_URL else f'http://{OLLAMA_URL}').rstrip('/')
+
+# Per-slot state: 'task' is the running task, 'pending' a task waiting for
+# admission. Each task carries its own 'cancel' Event.
+worker_slots = [{'id': i, 'task': None, 'pending': None} for i in range(WORKER_SLOTS)]
+_slot_cond = Condition()
+
+
+def _active_tasks():
+    """Return the tasks currently running in worker slots."""
+    return [s['task'] for s in worker_slots if s['task'] is not None]
+
+
+def _queue_ahead(task_id):
+    """Number of tasks that must start before a queued task can run."""
+    busy = len(_active_tasks())
+    return max(0, task_queue.ahead_of(task_id) + busy - WORKER_SLOTS + 1)
+
+
+def _find_slot(task_id):
+    """Return the worker slot running (or admitting) task_id, or None."""
+    for s in worker_slots:
+        for t in (s['task'], s['pending']):
+            if t is not None and t['id'] == task_id:
+                return s
+    return None
 
 # Task timeout: cancel tasks if client disconnects or max time exceeded
 TASK_TIMEOUT = int(os.environ.get('SHELLAMA_TASK_TIMEOUT', '1800'))  # 30 min default
@@ -57,66 +244,175 @@ def periodic_save_stats():
 load_stats()
 Thread(target=periodic_save_stats, daemon=True).start()
 
-def stale_task_reaper():
-    """Kill active task if the requesting client has disconnected (no heartbeat)."""
-    global active_task, stop_requested
+# Host load: a background sampler keeps the latest CPU/RAM snapshot and a rolling
+# history, so /queue-status never blocks on psutil.cpu_percent(interval=...).
+SAMPLE_INTERVAL = float(os.environ.get('SHELLAMA_SAMPLE_INTERVAL', '2'))
+HOST_HISTORY_MAX = int(3600 / SAMPLE_INTERVAL) if SAMPLE_INTERVAL > 0 else 1800  # ~1 hour
+_host_sample = {}
+_host_history = deque(maxlen=HOST_HISTORY_MAX)
+_host_lock = Lock()
+
+
+def _host_info():
+    """Static host facts reported alongside every sample."""
+    import platform
+    try:
+        import psutil
+        freq = psutil.cpu_freq()
+        return {
+            'cpu_arch': platform.machine(),
+            'cpu_count': psutil.cpu_count(logical=True),
+            'cpu_freq_mhz': round((freq.max or freq.current) if freq else 0),
+            'ram_total_gb': round(psutil.virtual_memory().total / (1024**3), 2),
+        }
+    except Exception:
+        return {'cpu_arch': platform.machine(), 'cpu_count': os.cpu_count() or 0, 'cpu_freq_mhz': 0, 'ram_total_gb': 0}
+
+HOST_INFO = _host_info()
+
+
+def _sample_host():
+    """Take one host load sample. cpu_percent() measures since the previous call."""
+    import psutil
+    vm = psutil.virtual_memory()
+    freq = psutil.cpu_freq()
+    ollama_rss = 0
+    for p in psutil.process_iter(['name', 'memory_info']):
+        try:
+            if (p.info['name'] or '').startswith('ollama') and p.info['memory_info']:
+                ollama_rss += p.info['memory_info'].rss
+        except Exception:
+            pass
+    try:
+        load = [round(x, 2) for x in os.getloadavg()]
+    except (AttributeError, OSError):
+        load = []
+    return {
+        'timestamp': time.time(),
+        'cpu_percent': psutil.cpu_percent(interval=None),
+        'per_core': psutil.cpu_percent(interval=None, percpu=True),
+        'ram_available_gb': round(vm.available / (1024**3), 2),
+        'ram_percent': vm.percent,
+        'cpu_freq_current_mhz': round(freq.current) if freq else 0,
+        'load_avg': load,
+        'ollama_rss_gb': round(ollama_rss / (1024**3), 2),
+    }
+
+
+def host_sampler():
+    """Background thread: refresh the host load snapshot every SAMPLE_INTERVAL seconds."""
+    global _host_sample
+    try:
+        import psutil
+        psutil.cpu_percent(interval=None)  # prime the counters
+        psutil.cpu_percent(interval=None, percpu=True)
+    except ImportError:
+        return
     while True:
-        time.sleep(10)
-        if active_task is None:
+        time.sleep(max(SAMPLE_INTERVAL, 0.5))
+        try:
+            sample = _sample_host()
+        except Exception:
             continue
-        task_id = active_task.get('id')
-        task_type = active_task.get('type', '')
-        started = active_task.get('started', 0)
-        now = time.time()
+        with _host_lock:
+            _host_sample = sample
+            _host_history.append(sample)
 
-        should_kill = False
-        # Check max timeout
-        if TASK_TIMEOUT and started and (now - started) > TASK_TIMEOUT:
-            should_kill = True
-        # Check if waiter is gone (client disconnected)
-        if not should_kill:
-            with _waiter_lock:
-                waiter = task_waiters.get(task_id)
-            if waiter is None:
-                if started and (now - started) > 15:
-                    should_kill = True
-            elif (now - waiter['last_heartbeat']) > 30:
+Thread(target=host_sampler, daemon=True).start()
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task when its cancel Event is set."""
+
+
+def _cancel_task(task):
+    """Cancel a running task without touching the Ollama runner.
+
+    LLM tasks notice the cancel Event between stream chunks and drop their HTTP
+    stream to Ollama, which stops generation but keeps the model loaded."""
+    if task['cancel'].is_set():
+        return False
+    task['cancel'].set()
+    if task.get('type') == 'generate_image':
+        # Image generation runs in a subprocess that cannot be interrupted mid-step
+        if _image_proc is not None:
+            try:
+                _image_proc.kill()
+            except Exception:
+                pass
+    return True
+
+
+def _remove_queued(task_id):
+    """Remove a not-yet-started task from task_queue. Returns the task or None."""
+    return task_queue.remove(task_id)
+
+
+def cancel_task_id(task_id):
+    """Cancel a queued or running task. Returns 'queued', 'running' or None if unknown."""
+    task = _remove_queued(task_id)
+    if task is not None:
+        task['cancel'].set()
+        task_results[task_id] = {'error': 'Task cancelled'}
+        _finish_task(task)
+        return 'queued'
+    slot = _find_slot(task_id)
+    if slot is not None:
+        task = slot['task'] or slot['pending']
+        if task is not None:
+            _cancel_task(task)
+            return 'running'
+    return None
+
+
+def stale_task_reaper():
+    """Kill active tasks whose requesting client has disconnected (no heartbeat)."""
+    while True:
+        time.sleep(10)
+        for slot in worker_slots:
+            task = slot['task']
+            if task is None or task['cancel'].is_set():
+                continue
+            task_id = task.get('id')
+            started = task.get('started', 0)
+            now = time.time()
+
+            should_kill = False
+            # Check max timeout
+            if TASK_TIMEOUT and started and (now - started) > TASK_TIMEOUT:
                 should_kill = True
+            # Check if waiter is gone (client disconnected)
+            if not should_kill:
+                with _waiter_lock:
+                    waiter = task_waiters.get(task_id)
+                if waiter is None:
+                    if started and (now - started) > 15:
+                        should_kill = True
+                elif (now - waiter['last_heartbeat']) > 30:
+                    should_kill = True
 
-        if should_kill:
-            stop_requested = True
-            if task_type == 'generate_image':
-                # Kill image generation subprocess
-                if _image_proc is not None:
-                    try:
-                        _image_proc.kill()
-                    except Exception:
-                        pass
-            else:
-                # For LLM tasks, kill the ollama runner process
-                try:
-                    import subprocess
-                    subprocess.run(['pkill', '-f', 'ollama.*runner'], timeout=5, capture_output=True)
-                except Exception:
-                    pass
+            if should_kill:
+                _cancel_task(task)
 
 Thread(target=stale_task_reaper, daemon=True).start()
 
 
 def submit_and_wait(task, timeout=3600):
     """Submit task to queue, send heartbeats while waiting, clean up on disconnect."""
-    global stop_requested
     task_id = task['id']
     event = task['event']
+    task.setdefault('cancel', Event())
+    _classify(task)
     deadline = time.time() + timeout
     with _waiter_lock:
         task_waiters[task_id] = {'last_heartbeat': time.time()}
     task_queue.put(task)
+    queue_size = _queue_ahead(task_id)
     try:
         while not event.wait(timeout=10):
             if time.time() > deadline:
                 # Overall timeout — cancel the task
-                stop_requested = True
+                cancel_task_id(task_id)
                 return task_results.pop(task_id, {'error': f'Task timed out after {timeout}s'})
             # Update heartbeat while we're still connected
             with _waiter_lock:
@@ -125,7 +421,80 @@ def submit_and_wait(task, timeout=3600):
     finally:
         with _waiter_lock:
             task_waiters.pop(task_id, None)
-    return task_results.pop(task_id, None)
+    result = task_results.pop(task_id, None)
+    if result is not None and queue_size > 0:
+        result['queue_position'] = queue_size + 1
+    return result
+
+
+def _sse(event):
+    """Format one server-sent event."""
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def stream_task(task, timeout=3600):
+    """Submit task to queue and stream its tokens back as server-sent events.
+
+    Emits {'task_id'} first, then {'token': ...} per chunk (and {'reset': true}
+    if a task restarts its output), and finally the full result with done=true.
+    Heartbeats are refreshed while the client is connected; if it disconnects
+    the generator is closed and the reaper cancels the task."""
+    task_id = task['id']
+    events = task['stream']
+    task.setdefault('cancel', Event())
+    _classify(task)
+    deadline = time.time() + timeout
+    with _waiter_lock:
+        task_waiters[task_id] = {'last_heartbeat': time.time()}
+    task_queue.put(task)
+    queue_size = _queue_ahead(task_id)
+
+    def generate():
+        try:
+            first = {'task_id': task_id}
+            if queue_size > 0:
+                first['queue_position'] = queue_size + 1
+            yield _sse(first)
+            while True:
+                try:
+                    ev = events.get(timeout=10)
+                except Empty:
+                    if time.time() > deadline:
+                        cancel_task_id(task_id)
+                        yield _sse({'error': f'Task timed out after {timeout}s', 'task_id': task_id, 'done': True})
+                        return
+                    yield ': keepalive\n\n'
+                    ev = ''
+                with _waiter_lock:
+                    if task_id in task_waiters:
+                        task_waiters[task_id]['last_heartbeat'] = time.time()
+                if ev is None:
+                    break
+                if isinstance(ev, dict):
+                    yield _sse(ev)
+                elif ev:
+                    yield _sse({'token': ev})
+            result = task_results.pop(task_id, None)
+            if result is None:
+                result = {'error': f'Task {task_id} completed but result was lost'}
+            if queue_size > 0:
+                result['queue_position'] = queue_size + 1
+            result['task_id'] = task_id
+            result['done'] = True
+            yield _sse(result)
+        finally:
+            with _waiter_lock:
+                task_waiters.pop(task_id, None)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _finish_task(task):
+    """Wake the waiter of a finished or cancelled task."""
+    task['event'].set()
+    if task.get('stream') is not None:
+        task['stream'].put(None)
 
 # Cloud fallback configuration (OpenRouter or LiteLLM)
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
@@ -133,39 +502,291 @@ OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', 'anthropic/claude-3.5-sonn
 OPENROUTER_URL = os.environ.get('OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
 USE_CLOUD_FALLBACK = os.environ.get('USE_CLOUD_FALLBACK', 'false').lower() == 'true'
 
-def worker():
-    global active_task, total_requests, total_tokens, stop_requested
+def _slot_model_key(task):
+    """Admission key: image tasks share one subprocess, LLM tasks go by model."""
+    if task.get('type') == 'generate_image':
+        return 'image'
+    return task.get('model', 'codellama:13b')
+
+
+# Model registry: ollama.list()/show() metadata kept in memory so tasks don't
+# query Ollama before every request. Refreshed every SHELLAMA_REGISTRY_INTERVAL
+# seconds, on POST /models/refresh, and when a task names a model the registry
+# doesn't know yet (at most every REGISTRY_MISS_REFRESH seconds), so a freshly
+# pulled model is picked up on its first request.
+REGISTRY_INTERVAL = int(os.environ.get('SHELLAMA_REGISTRY_INTERVAL', '300'))
+REGISTRY_MISS_REFRESH = 10
+_registry = {}  # model -> metadata, see refresh_registry()
+_registry_lock = Lock()
+_registry_refresh_lock = Lock()
+_registry_refreshed = 0
+
+
+def refresh_registry():
+    """Reload the registry from ollama.list(); show() is only called for new or changed models."""
+    global _registry_refreshed
+    with _registry_refresh_lock:
+        models = ollama.list().models
+        with _registry_lock:
+            old = dict(_registry)
+        new = {}
+        for m in models:
+            prev = old.get(m.model)
+            if prev is not None and prev['digest'] == m.digest:
+                new[m.model] = prev
+                continue
+            details = m.details
+            info = {
+                'name': m.model,
+                'size': m.size,
+                'digest': m.digest,
+                'family': details.family if details else None,
+                'parameter_size': details.parameter_size if details else None,
+                'quantization': details.quantization_level if details else None,
+                'context_length': None,
+                'capabilities': None,
+            }
+            try:
+                shown = ollama.show(m.model)
+                info['context_length'] = next((v for k, v in (shown.modelinfo or {}).items()
+                                               if k.endswith('.context_length')), None)
+                info['capabilities'] = getattr(shown, 'capabilities', None)
+            except Exception:
+                pass
+            new[m.model] = info
+        with _registry_lock:
+            _registry.clear()
+            _registry.update(new)
+            _registry_refreshed = time.time()
+
+
+def model_info(model):
+    """Registry metadata for a model, or None if Ollama doesn't have it."""
+    name = model if ':' in model else f'{model}:latest'
+    with _registry_lock:
+        info = _registry.get(name)
+        stale = time.time() - _registry_refreshed >= REGISTRY_MISS_REFRESH
+    if info is None and stale:
+        try:
+            refresh_registry()
+        except Exception as e:
+            print(f"[registry] refresh failed: {e}")
+        with _registry_lock:
+            info = _registry.get(name)
+    return info
+
+
+def _registry_loop():
+    while True:
+        try:
+            refresh_registry()
+        except Exception as e:
+            print(f"[registry] refresh failed: {e}")
+        time.sleep(REGISTRY_INTERVAL)
+
+Thread(target=_registry_loop, daemon=True).start()
+
+
+def _ram_snapshot(model):
+    """(loaded, model bytes, available bytes) for a model, or None if unknown.
+    Calls ollama.ps() and may refresh the registry: never call it holding _slot_cond."""
+    try:
+        import psutil
+        ps = ollama.ps()
+        if model in [m.model for m in (ps.models or [])]:
+            return True, 0, 0
+        size = (model_info(model) or {}).get('size') or 0
+        return False, size, psutil.virtual_memory().available
+    except Exception:
+        return None
+
+
+def _fits_in_ram(snapshot):
+    """Whether a _ram_snapshot() says the model is loaded or fits in available RAM."""
+    if snapshot is None:
+        return True
+    loaded, size, available = snapshot
+    return loaded or size * RAM_HEADROOM < available
+
+
+def _model_fits_in_ram(model):
+    """Check whether a model that is not loaded yet fits in available RAM."""
+    return _fits_in_ram(_ram_snapshot(model))
+
+
+# Model lifecycle: per-model keep_alive (how long Ollama keeps a model loaded
+# after its last request), pinning (keep_alive=-1), explicit preload/unload via
+# /model-lifecycle, and per-model load times and memory footprints.
+KEEP_ALIVE = os.environ.get('SHELLAMA_KEEP_ALIVE', '')  # Ollama duration, e.g. '30m'; empty = Ollama's default
+COLD_LOAD_MIN = 0.5  # seconds of load_duration that count as a cold load
+_lifecycle = {}  # model -> state, see _model_state()
+_lifecycle_lock = Lock()
+
+
+def _duration(value):
+    """keep_alive as Ollama takes it: seconds for plain numbers, else a duration string."""
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _model_state(model):
+    """Lifecycle entry for a model (caller holds _lifecycle_lock)."""
+    st = _lifecycle.get(model)
+    if st is None:
+        st = _lifecycle[model] = {'keep_alive': None, 'pinned': False, 'loading': False, 'loaded': False,
+                                  'loads': 0, 'load_times': deque(maxlen=20), 'preloads': 0,
+                                  'memory': None, 'vram': None, 'last_loaded': None, 'last_used': None}
+    return st
+
+
+def _keep_alive(model):
+    """keep_alive to send with a request for this model: pinned, per-model, then default."""
+    with _lifecycle_lock:
+        st = _lifecycle.get(model)
+        if st is not None and st['pinned']:
+            return -1
+        if st is not None and st['keep_alive'] is not None:
+            return st['keep_alive']
+    return _duration(KEEP_ALIVE)
+
+
+def _record_load(model, seconds):
+    with _lifecycle_lock:
+        st = _model_state(model)
+        st['loads'] += 1
+        st['load_times'].append(round(seconds, 2))
+        st['last_loaded'] = time.time()
+
+
+def _note_loaded(models):
+    """Update loaded flags and memory footprints from an ollama.ps() listing."""
+    with _lifecycle_lock:
+        names = set()
+        for m in models:
+            st = _model_state(m.model)
+            st['loaded'] = True
+            st['memory'] = m.size
+            st['vram'] = getattr(m, 'size_vram', None)
+            names.add(m.model)
+        for model, st in _lifecycle.items():
+            if model not in names:
+                st['loaded'] = False
+
+
+def _preload(model, keep_alive=None):
+    """Load a model with an empty prompt, which Ollama treats as load-only."""
+    keep_alive = keep_alive if keep_alive is not None else _keep_alive(model)
+    try:
+        t0 = time.time()
+        r = ollama.generate(model=model, prompt='', keep_alive=keep_alive)
+        seconds = (r.get('load_duration') or 0) / 1e9 or time.time() - t0
+        if seconds >= COLD_LOAD_MIN:
+            _record_load(model, seconds)
+    except Exception as e:
+        print(f"[lifecycle] preload of {model} failed: {e}")
+    finally:
+        with _lifecycle_lock:
+            _model_state(model)['loading'] = False
+
+
+def _lifecycle_summary():
+    with _lifecycle_lock:
+        out = {}
+        for model, st in _lifecycle.items():
+            times = list(st['load_times'])
+            out[model] = {
+                'keep_alive': -1 if st['pinned'] else st['keep_alive'],
+                **{k: st[k] for k in ('pinned', 'loading', 'loaded', 'loads', 'preloads',
+                                      'memory', 'vram', 'last_loaded', 'last_used')},
+                'load_time_avg': round(sum(times) / len(times), 2) if times else None,
+                'load_time_last': times[-1] if times else None,
+            }
+    return {'default_keep_alive': _duration(KEEP_ALIVE), 'models': out}
+
+
+def _admit(slot, task):
+    """Block until the task's model has spare parallel capacity, then claim the slot.
+
+    Starting a new model alongside other work depends on free RAM; that is
+    measured with _slot_cond released (ollama.ps() is an HTTP call), once per
+    wake-up, and only the numbers are compared under the lock."""
+    key = _slot_model_key(task)
+    cap = 1 if key == 'image' else MODEL_PARALLEL
+    ram = False  # _ram_snapshot() for this wake-up; False = not taken yet
+    with _slot_cond:
+        slot['pending'] = task
+        while not task['cancel'].is_set():
+            running = [s['task'] for s in worker_slots if s['task'] is not None]
+            same = sum(1 for t in running if _slot_model_key(t) == key)
+            if same < cap and (not running or same > 0 or key == 'image'):
+                break
+            if same < cap and ram is False:
+                _slot_cond.release()
+                try:
+                    ram = _ram_snapshot(key)
+                finally:
+                    _slot_cond.acquire()
+                continue
+            if same < cap and _fits_in_ram(ram):
+                break
+            ram = False
+            _slot_cond.wait(timeout=5)
+        slot['pending'] = None
+        slot['task'] = task
+
+
+def _release_slot(slot):
+    with _slot_cond:
+        slot['task'] = None
+        _slot_cond.notify_all()
+
+
+def worker(slot):
+    global total_requests, total_tokens
     while True:
         task = task_queue.get()
         if task is None:
             break
-        active_task = task
-        stop_requested = False
+        _admit(slot, task)
         task_id = task['id']
         task['started'] = time.time()
+        task['slot'] = slot['id']
+        _record_wait(task)
         task_type = task.get('type')
         model = task.get('model', 'codellama:13b')
-        
+
+        if task['cancel'].is_set():
+            task_results[task_id] = {'error': 'Task cancelled'}
+            _release_slot(slot)
+            _finish_task(task)
+            task_queue.task_done()
+            continue
+
         # Increment request counter
         with stats_lock:
             total_requests += 1
         
         try:
             if task_type == 'explain':
-                result = explain_playbook(task['playbook'], model)
+                result = explain_playbook(task['playbook'], model, task=task)
             elif task_type == 'generate_code':
-                result = generate_code(task['description'], model)
+                result = generate_code(task['description'], model, task=task)
             elif task_type == 'explain_code':
-                result = explain_code(task['code'], model)
+                result = explain_code(task['code'], model, task=task)
             elif task_type == 'chat':
-                result = chat(task['message'], model, messages=task.get('messages'))
+                result = chat(task['message'], model, messages=task.get('messages'), task=task)
             elif task_type == 'analyze':
-                result = analyze_files(task['files'], model)
+                result = analyze_files(task['files'], model, task=task)
             elif task_type == 'generate_image':
                 result = generate_image(task['prompt'], task.get('image_model', 'sd-turbo'),
-                                       task.get('steps', 20), task.get('width', 512), task.get('height', 512))
+                                       task.get('steps', 20), task.get('width', 512), task.get('height', 512),
+                                       cancel=task['cancel'])
             else:
-                result = generate_playbook(task['commands'], model)
+                result = generate_playbook(task['commands'], model, task=task)
             
             # Update token counter
             with stats_lock:
@@ -183,14 +804,13 @@ def worker():
             
             task_results[task_id] = result
         except Exception as e:
-            if stop_requested:
-                task_results[task_id] = {'error': 'Task cancelled by admin'}
+            if task['cancel'].is_set():
+                task_results[task_id] = {'error': 'Task cancelled'}
             else:
                 task_results[task_id] = {'error': f'Task processing failed: {str(e)}'}
         
-        stop_requested = False
-        task['event'].set()
-        active_task = None
+        _release_slot(slot)
+        _finish_task(task)
         task_queue.task_done()
         save_stats()
 
@@ -302,15 +922,105 @@ def fallback_to_openrouter(task, ollama_result):
 
     return ollama_result
 
-def generate_playbook(commands, model='codellama:13b'):
+def _abort_response(resp):
+    """Drop a streamed response's connection from another thread. Closing the
+    response itself would wait for the reader's lock; a socket shutdown makes
+    its blocked read return at once, and the reader then closes it."""
+    conn = getattr(resp.raw, 'connection', None)
+    sock = getattr(conn, 'sock', None)
+    try:
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def _ollama_chat(model, messages, task=None):
+    """Run a chat completion against Ollama, streaming tokens as they arrive.
+
+    Tokens are forwarded to task['stream'] when the client asked for streaming.
+    The HTTP stream is read on a helper thread; as soon as task['cancel'] is set
+    this thread drops the response's connection, so Ollama stops
+    generating at once without unloading the model. Returns a dict shaped like
+    ollama's chat response plus 'ttft' (seconds from call to first token) and
+    'gen_time' (seconds spent generating: Ollama's eval_duration, else first
+    token to done)."""
+    start = time.time()
+    ttft = None
+    parts = []
+    final = {}
+    events = task.get('stream') if task else None
+    cancel = task['cancel'] if task else Event()
+    chunks = Queue()
+    response = []  # the reader's HTTP response, once it has one
+
+    def reader():
+        try:
+            resp = requests.post(f"{OLLAMA_URL}/api/chat", stream=True, timeout=(10, None), json={
+                'model': model, 'messages': messages, 'stream': True, 'keep_alive': _keep_alive(model)})
+            response.append(resp)
+            if cancel.is_set():
+                resp.close()
+                return
+            with resp:
+                for line in resp.iter_lines():
+                    if cancel.is_set():
+                        break
+                    if line:
+                        chunk = json.loads(line)
+                        if chunk.get('error'):
+                            raise Exception(chunk['error'])
+                        chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(None)
+
+    Thread(target=reader, daemon=True).start()
+    while True:
+        try:
+            chunk = chunks.get(timeout=0.5)
+        except Empty:
+            chunk = ''
+        if cancel.is_set():
+            for resp in response:
+                _abort_response(resp)
+            raise TaskCancelled()
+        if chunk is None:
+            break
+        if chunk == '':
+            continue
+        if isinstance(chunk, Exception):
+            raise chunk
+        token = chunk['message']['content']
+        if token:
+            if ttft is None:
+                ttft = time.time() - start
+            parts.append(token)
+            if events is not None:
+                events.put(token)
+        if chunk.get('done'):
+            final = chunk
+    gen_time = (final.get('eval_duration') or 0) / 1e9 or (time.time() - start - ttft if ttft is not None else None)
+    load = (final.get('load_duration') or 0) / 1e9
+    if load >= COLD_LOAD_MIN:
+        _record_load(model, load)
+    with _lifecycle_lock:
+        _model_state(model)['last_used'] = time.time()
+    return {
+        'message': {'role': 'assistant', 'content': ''.join(parts)},
+        'prompt_eval_count': final.get('prompt_eval_count', 0) or 0,
+        'eval_count': final.get('eval_count', 0) or 0,
+        'ttft': round(ttft, 2) if ttft is not None else None,
+        'gen_time': round(gen_time, 3) if gen_time is not None else None,
+    }
+
+def generate_playbook(commands, model='codellama:13b', task=None):
     import time
     import yaml
     import re
     
     # Check if model exists
-    try:
-        ollama.show(model)
-    except:
+    if model_info(model) is None:
         return {
             'playbook': '',
             'elapsed': 0,
@@ -331,9 +1041,11 @@ Generate a complete Ansible playbook with proper tasks."""
 
     max_retries = 3
     for attempt in range(max_retries):
-        response = ollama.chat(model=model, messages=[
+        if attempt and task and task.get('stream') is not None:
+            task['stream'].put({'reset': True, 'attempt': attempt + 1})
+        response = _ollama_chat(model, [
             {'role': 'user', 'content': prompt}
-        ])
+        ], task=task)
         
         playbook_text = response['message']['content']
         
@@ -358,7 +1070,9 @@ Generate a complete Ansible playbook with proper tasks."""
                     'error': f'Invalid YAML after {max_retries} attempts: {str(e)}',
                     'prompt_tokens': response.get('prompt_eval_count', 0),
                     'response_tokens': response.get('eval_count', 0),
-                    'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0)
+                    'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0),
+                    'ttft': response.get('ttft'),
+                    'gen_time': response.get('gen_time')
                 }
     
     elapsed = time.time() - start_time
@@ -368,16 +1082,16 @@ Generate a complete Ansible playbook with proper tasks."""
         'elapsed': round(elapsed, 2),
         'prompt_tokens': response.get('prompt_eval_count', 0),
         'response_tokens': response.get('eval_count', 0),
-        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0)
+        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0),
+        'ttft': response.get('ttft'),
+        'gen_time': response.get('gen_time')
     }
 
-def explain_playbook(playbook, model='codellama:13b'):
+def explain_playbook(playbook, model='codellama:13b', task=None):
     import time
     
     # Check if model exists
-    try:
-        ollama.show(model)
-    except:
+    if model_info(model) is None:
         return {
             'explanation': '',
             'elapsed': 0,
@@ -393,9 +1107,9 @@ def explain_playbook(playbook, model='codellama:13b'):
 
 {playbook}"""
 
-    response = ollama.chat(model=model, messages=[
+    response = _ollama_chat(model, [
         {'role': 'user', 'content': prompt}
-    ])
+    ], task=task)
     
     elapsed = time.time() - start_time
     
@@ -404,16 +1118,16 @@ def explain_playbook(playbook, model='codellama:13b'):
         'elapsed': round(elapsed, 2),
         'prompt_tokens': response.get('prompt_eval_count', 0),
         'response_tokens': response.get('eval_count', 0),
-        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0)
+        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0),
+        'ttft': response.get('ttft'),
+        'gen_time': response.get('gen_time')
     }
 
-def generate_code(description, model='codellama:13b'):
+def generate_code(description, model='codellama:13b', task=None):
     import time
     
     # Check if model exists
-    try:
-        ollama.show(model)
-    except:
+    if model_info(model) is None:
         return {
             'code': '',
             'elapsed': 0,
@@ -429,9 +1143,9 @@ def generate_code(description, model='codellama:13b'):
 
 {description}"""
 
-    response = ollama.chat(model=model, messages=[
+    response = _ollama_chat(model, [
         {'role': 'user', 'content': prompt}
-    ])
+    ], task=task)
     
     elapsed = time.time() - start_time
     
@@ -440,16 +1154,16 @@ def generate_code(description, model='codellama:13b'):
         'elapsed': round(elapsed, 2),
         'prompt_tokens': response.get('prompt_eval_count', 0),
         'response_tokens': response.get('eval_count', 0),
-        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0)
+        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0),
+        'ttft': response.get('ttft'),
+        'gen_time': response.get('gen_time')
     }
 
-def explain_code(code, model='codellama:13b'):
+def explain_code(code, model='codellama:13b', task=None):
     import time
     
     # Check if model exists
-    try:
-        ollama.show(model)
-    except:
+    if model_info(model) is None:
         return {
             'explanation': '',
             'elapsed': 0,
@@ -465,9 +1179,9 @@ def explain_code(code, model='codellama:13b'):
 
 {code}"""
 
-    response = ollama.chat(model=model, messages=[
+    response = _ollama_chat(model, [
         {'role': 'user', 'content': prompt}
-    ])
+    ], task=task)
     
     elapsed = time.time() - start_time
     
@@ -476,16 +1190,16 @@ def explain_code(code, model='codellama:13b'):
         'elapsed': round(elapsed, 2),
         'prompt_tokens': response.get('prompt_eval_count', 0),
         'response_tokens': response.get('eval_count', 0),
-        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0)
+        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0),
+        'ttft': response.get('ttft'),
+        'gen_time': response.get('gen_time')
     }
 
-def chat(message, model='codellama:13b', messages=None):
+def chat(message, model='codellama:13b', messages=None, task=None):
     import time
     
     # Check if model exists
-    try:
-        ollama.show(model)
-    except:
+    if model_info(model) is None:
         return {
             'response': '',
             'elapsed': 0,
@@ -500,7 +1214,7 @@ def chat(message, model='codellama:13b', messages=None):
     if messages is None:
         messages = [{'role': 'user', 'content': message}]
     
-    response = ollama.chat(model=model, messages=messages)
+    response = _ollama_chat(model, messages, task=task)
     
     elapsed = time.time() - start_time
     
@@ -509,7 +1223,9 @@ def chat(message, model='codellama:13b', messages=None):
         'elapsed': round(elapsed, 2),
         'prompt_tokens': response.get('prompt_eval_count', 0),
         'response_tokens': response.get('eval_count', 0),
-        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0)
+        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0),
+        'ttft': response.get('ttft'),
+        'gen_time': response.get('gen_time')
     }
 
 _image_proc = None  # persistent image worker subprocess
@@ -571,7 +1287,7 @@ def _get_image_worker():
     )
     return _image_proc
 
-def generate_image(prompt, model='sd-turbo', steps=20, width=512, height=512):
+def generate_image(prompt, model='sd-turbo', steps=20, width=512, height=512, cancel=None):
     import time
     import json as _json
 
@@ -598,9 +1314,9 @@ def generate_image(prompt, model='sd-turbo', steps=20, width=512, height=512):
         proc.stdin.write(req.encode())
         proc.stdin.flush()
 
-        # Poll for response, checking stop_requested
+        # Poll for response, checking the task's cancel flag
         while True:
-            if stop_requested:
+            if cancel is not None and cancel.is_set():
                 proc.kill()
                 proc.wait()
                 global _image_proc
@@ -624,12 +1340,10 @@ def generate_image(prompt, model='sd-turbo', steps=20, width=512, height=512):
         return {'image': '', 'elapsed': round(time.time() - start_time, 2),
                 'error': str(e)}
 
-def analyze_files(files, model='codellama:13b'):
+def analyze_files(files, model='codellama:13b', task=None):
     import time
     
-    try:
-        ollama.show(model)
-    except:
+    if model_info(model) is None:
         return {
             'analysis': '',
             'elapsed': 0,
@@ -652,9 +1366,9 @@ def analyze_files(files, model='codellama:13b'):
 
 {files_content}"""
 
-    response = ollama.chat(model=model, messages=[
+    response = _ollama_chat(model, [
         {'role': 'user', 'content': prompt}
-    ])
+    ], task=task)
     
     elapsed = time.time() - start_time
     
@@ -663,53 +1377,99 @@ def analyze_files(files, model='codellama:13b'):
         'elapsed': round(elapsed, 2),
         'prompt_tokens': response.get('prompt_eval_count', 0),
         'response_tokens': response.get('eval_count', 0),
-        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0)
+        'total_tokens': response.get('prompt_eval_count', 0) + response.get('eval_count', 0),
+        'ttft': response.get('ttft'),
+        'gen_time': response.get('gen_time')
     }
 
-Thread(target=worker, daemon=True).start()
+for _slot in worker_slots:
+    Thread(target=worker, args=(_slot,), daemon=True).start()
 
 @app.route('/')
 def index():
     return send_from_directory('/export/html', 'index.html')
 
+def _new_task_id():
+    """New random task id. A caller's task_id is kept only if it is a UUID not in use,
+    so the frontend can cancel a call before it returns but nobody can pick guessable ids."""
+    data = request.get_json(silent=True) or {}
+    try:
+        task_id = str(uuid.UUID(str(data.get('task_id') or request.form.get('task_id') or '')))
+    except ValueError:
+        task_id = ''
+    if task_id:
+        with _waiter_lock:
+            in_use = task_id in task_waiters
+        if not in_use and _find_slot(task_id) is None:
+            return task_id
+    return str(uuid.uuid4())
+
+def _task_info(task):
+    """Summary of a running task for /queue-status."""
+    started = task.get('started', 0)
+    return {
+        'task_id': task['id'],
+        'slot': task.get('slot'),
+        'type': task.get('type', 'generate'),
+        'model': task.get('model', 'unknown'),
+        'client': task.get('client_ip', ''),
+        'agent': task.get('client_agent', ''),
+        'summary': task.get('summary', ''),
+        'priority': task.get('priority', 'codegen'),
+        'elapsed': round(time.time() - started, 1) if started else 0,
+    }
+
 @app.route('/queue-status')
 def queue_status():
     global total_requests, total_tokens
-    import psutil
-    import platform
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
+    active = _active_tasks()
+    with _host_lock:
+        host = dict(_host_sample)
+    queue_size = task_queue.qsize() + len(active)
     
     status = {
         'queue_size': queue_size,
-        'active': active_task is not None,
+        'active': bool(active),
+        'slots': WORKER_SLOTS,
+        'slots_busy': len(active),
+        'model_parallel': MODEL_PARALLEL,
+        'active_tasks': [_task_info(t) for t in active],
+        'scheduler': _scheduler_status(),
         'total_requests': total_requests,
         'total_tokens': total_tokens,
-        'cpu_percent': psutil.cpu_percent(interval=0.5),
-        'ram_available_gb': round(psutil.virtual_memory().available / (1024**3), 2),
-        'ram_total_gb': round(psutil.virtual_memory().total / (1024**3), 2),
-        'cpu_arch': platform.machine(),
-        'cpu_count': psutil.cpu_count(logical=True),
-        'cpu_freq_mhz': round((psutil.cpu_freq().max or psutil.cpu_freq().current) if psutil.cpu_freq() else 0),
+        'cpu_percent': host.get('cpu_percent', 0),
+        'ram_available_gb': host.get('ram_available_gb', 0),
+        **HOST_INFO,
+        'host': host,
     }
     
-    if active_task:
-        status['active_type'] = active_task.get('type', 'generate')
-        status['active_model'] = active_task.get('model', 'unknown')
-        status['active_client'] = active_task.get('client_ip', '')
-        status['active_agent'] = active_task.get('client_agent', '')
-        status['active_summary'] = active_task.get('summary', '')
+    if active:
+        # Oldest running task, for clients that only show one
+        first = min(active, key=lambda t: t.get('started', 0))
+        status['active_type'] = first.get('type', 'generate')
+        status['active_model'] = first.get('model', 'unknown')
+        status['active_client'] = first.get('client_ip', '')
+        status['active_agent'] = first.get('client_agent', '')
+        status['active_summary'] = first.get('summary', '')
 
     # Report models currently loaded in Ollama memory
     try:
         ps = ollama.ps()
         status['loaded_models'] = [m.model for m in ps.models] if ps.models else []
+        _note_loaded(ps.models or [])
     except:
         status['loaded_models'] = []
     
     return jsonify(status)
 
+@app.route('/host-stats')
+def host_stats():
+    """Host load history from the background sampler: ?since=TIMESTAMP for new samples only."""
+    since = float(request.args.get('since', 0) or 0)
+    with _host_lock:
+        samples = [h for h in _host_history if h['timestamp'] > since]
+    return jsonify({'interval': SAMPLE_INTERVAL, **HOST_INFO, 'samples': samples})
+
 @app.route('/heartbeat', methods=['POST'])
 def heartbeat():
     """Client sends heartbeat to keep its task alive."""
@@ -720,77 +1480,139 @@ def heartbeat():
             return jsonify({'ok': True})
     return jsonify({'ok': False, 'error': 'unknown task_id'}), 404
 
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    """Cancel one queued or running task. The loaded model stays warm."""
+    state = cancel_task_id(task_id)
+    if state is None:
+        return jsonify({'error': f'Unknown task_id {task_id}'}), 404
+    return jsonify({'task_id': task_id, 'cancelled': state})
+
 @app.route('/stop', methods=['POST'])
 def stop_processing():
-    """Stop active task and clear queue"""
-    global active_task, stop_requested
-    stopped = {'active_cancelled': False, 'queue_cleared': 0}
+    """Cancel all active tasks and clear the queue."""
+    stopped = {'active_cancelled': 0, 'queue_cleared': 0}
 
     # Clear queued tasks
     cleared = 0
     while not task_queue.empty():
         try:
             task = task_queue.get_nowait()
+            task.setdefault('cancel', Event()).set()
             task_results[task['id']] = {'error': 'Task cancelled by admin'}
-            task['event'].set()
+            _finish_task(task)
             task_queue.task_done()
             cleared += 1
         except:
             break
     stopped['queue_cleared'] = cleared
 
-    # Signal active task to stop (ollama will be killed)
-    if active_task is not None:
-        stop_requested = True
-        stopped['active_cancelled'] = True
-        if active_task.get('type') == 'generate_image':
-            # Kill image generation subprocess
-            if _image_proc is not None:
-                try:
-                    _image_proc.kill()
-                except:
-                    pass
-        else:
-            # Kill any running ollama process to interrupt inference
-            import subprocess
-            try:
-                subprocess.run(['pkill', '-f', 'ollama.*runner'], timeout=5)
-            except:
-                pass
+    # Signal every running or admitting task to stop
+    for slot in worker_slots:
+        task = slot['task'] or slot['pending']
+        if task is not None and _cancel_task(task):
+            stopped['active_cancelled'] += 1
 
     return jsonify(stopped)
 
 @app.route('/models')
 def list_models():
+    """Models from the registry with their metadata (size, family, quantization, context length)."""
+    with _registry_lock:
+        models = sorted(_registry.values(), key=lambda m: m['name'])
+        refreshed = _registry_refreshed
+    if not refreshed:
+        try:
+            refresh_registry()
+        except Exception as e:
+            return jsonify({'models': [], 'error': str(e)})
+        return list_models()
+    return jsonify({'models': models, 'refreshed': refreshed})
+
+@app.route('/models/refresh', methods=['POST'])
+def refresh_models():
+    """Reload the model registry now, e.g. after `ollama pull` or `ollama rm`."""
+    try:
+        refresh_registry()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return list_models()
+
+@app.route('/model-lifecycle', methods=['GET'])
+def model_lifecycle():
+    """Per-model keep_alive, pin state, load times and memory footprint."""
     try:
-        models = ollama.list()
-        return jsonify({'models': [{'name': m.model, 'size': m.size} for m in models.models]})
+        _note_loaded(ollama.ps().models or [])
+    except Exception:
+        pass
+    return jsonify(_lifecycle_summary())
+
+@app.route('/model-lifecycle', methods=['POST'])
+def model_lifecycle_action():
+    """Preload, pin, unpin or unload a model, or set its keep_alive.
+
+    {"model": "...", "action": "preload|pin|unpin|unload|keep_alive", "keep_alive": "30m"}.
+    preload and pin load in the background; preload is refused with 409 if the
+    model is not loaded and does not fit in free RAM, unless "force" is set."""
+    data = request.json or {}
+    model, action = data.get('model'), data.get('action')
+    if not model or action not in ('preload', 'pin', 'unpin', 'unload', 'keep_alive'):
+        return jsonify({'error': 'model and action (preload|pin|unpin|unload|keep_alive) required'}), 400
+    with _lifecycle_lock:
+        st = _model_state(model)
+        if action == 'keep_alive':
+            st['keep_alive'] = _duration(data.get('keep_alive'))
+        elif action in ('pin', 'unpin', 'unload'):
+            st['pinned'] = action == 'pin'
+        loaded, loading = st['loaded'], st['loading']
+    if action == 'unload':
+        try:
+            ollama.generate(model=model, prompt='', keep_alive=0)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        with _lifecycle_lock:
+            st['loaded'] = False
+    elif action in ('preload', 'pin') or (action in ('unpin', 'keep_alive') and loaded):
+        # Loading again also resets the running model's keep_alive timer
+        if action == 'preload' and not loaded and not data.get('force') and not _model_fits_in_ram(model):
+            return jsonify({'error': f'{model} does not fit in free RAM'}), 409
+        if not loading:
+            with _lifecycle_lock:
+                st['loading'] = True
+                st['preloads'] += action in ('preload', 'pin')
+            Thread(target=_preload, args=(model,), daemon=True).start()
+    return jsonify({'model': model, 'action': action, **_lifecycle_summary()['models'][model]})
+
+@app.route('/embed', methods=['POST'])
+def embed():
+    """Embed text with a local embedding model (used by the frontend's semantic cache).
+    Runs inline rather than through the task queue: small embedding models answer in milliseconds."""
+    data = request.json or {}
+    try:
+        resp = ollama.embed(model=data.get('model', 'nomic-embed-text'), input=data.get('input', ''))
+        return jsonify({'embedding': resp.embeddings[0]})
     except Exception as e:
-        return jsonify({'models': [], 'error': str(e)})
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/generate', methods=['POST'])
 def generate():
     commands = request.json.get('commands', '')
     model = request.json.get('model', 'codellama:13b')
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
     summary = commands[:80].replace('\n', ' ')
-    task = {'id': task_id, 'commands': commands, 'model': model, 'event': event, 'force_cloud': request.json.get('force_cloud', False),
+    task = {'id': task_id, 'commands': commands, 'model': model, 'event': event, 'stream': Queue() if request.json.get('stream') else None, 'force_cloud': request.json.get('force_cloud', False),
             'client_ip': request.json.get('client_ip', request.remote_addr),
             'client_agent': request.json.get('client_agent', request.headers.get('User-Agent', '')),
             'summary': f'shell2ansible: {summary}'}
+    if task['stream'] is not None:
+        return stream_task(task)
     result = submit_and_wait(task)
     
     if result is None:
         return jsonify({'error': f'Task {task_id} completed but result was lost'}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -804,11 +1626,7 @@ def upload():
     commands = file.read().decode('utf-8')
     model = request.form.get('model', 'codellama:13b')
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
     task = {'id': task_id, 'commands': commands, 'model': model, 'event': event, 'force_cloud': request.json.get('force_cloud', False),
             'client_ip': request.remote_addr, 'client_agent': request.headers.get('User-Agent', ''),
@@ -818,8 +1636,6 @@ def upload():
     if result is None:
         return jsonify({"error": f"Task {task_id} completed but result was lost"}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -829,23 +1645,19 @@ def explain():
     playbook = request.json.get('playbook', '')
     model = request.json.get('model', 'codellama:13b')
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
-    task = {'id': task_id, 'playbook': playbook, 'model': model, 'event': event, 'force_cloud': request.json.get('force_cloud', False), 'type': 'explain',
+    task = {'id': task_id, 'playbook': playbook, 'model': model, 'event': event, 'stream': Queue() if request.json.get('stream') else None, 'force_cloud': request.json.get('force_cloud', False), 'type': 'explain',
             'client_ip': request.json.get('client_ip', request.remote_addr),
             'client_agent': request.json.get('client_agent', request.headers.get('User-Agent', '')),
             'summary': f'explain: {playbook[:80].replace(chr(10), " ")}'}
+    if task['stream'] is not None:
+        return stream_task(task)
     result = submit_and_wait(task)
     
     if result is None:
         return jsonify({"error": f"Task {task_id} completed but result was lost"}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -855,23 +1667,19 @@ def generate_code_endpoint():
     description = request.json.get('description', '')
     model = request.json.get('model', 'codellama:13b')
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
-    task = {'id': task_id, 'description': description, 'model': model, 'event': event, 'force_cloud': request.json.get('force_cloud', False), 'type': 'generate_code',
+    task = {'id': task_id, 'description': description, 'model': model, 'event': event, 'stream': Queue() if request.json.get('stream') else None, 'force_cloud': request.json.get('force_cloud', False), 'type': 'generate_code',
             'client_ip': request.json.get('client_ip', request.remote_addr),
             'client_agent': request.json.get('client_agent', request.headers.get('User-Agent', '')),
             'summary': f'codegen: {description[:80].replace(chr(10), " ")}'}
+    if task['stream'] is not None:
+        return stream_task(task)
     result = submit_and_wait(task)
     
     if result is None:
         return jsonify({"error": f"Task {task_id} completed but result was lost"}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -881,23 +1689,19 @@ def explain_code_endpoint():
     code = request.json.get('code', '')
     model = request.json.get('model', 'codellama:13b')
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
-    task = {'id': task_id, 'code': code, 'model': model, 'event': event, 'force_cloud': request.json.get('force_cloud', False), 'type': 'explain_code',
+    task = {'id': task_id, 'code': code, 'model': model, 'event': event, 'stream': Queue() if request.json.get('stream') else None, 'force_cloud': request.json.get('force_cloud', False), 'type': 'explain_code',
             'client_ip': request.json.get('client_ip', request.remote_addr),
             'client_agent': request.json.get('client_agent', request.headers.get('User-Agent', '')),
             'summary': f'explain-code: {code[:80].replace(chr(10), " ")}'}
+    if task['stream'] is not None:
+        return stream_task(task)
     result = submit_and_wait(task)
     
     if result is None:
         return jsonify({"error": f"Task {task_id} completed but result was lost"}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -907,23 +1711,19 @@ def chat_endpoint():
     message = request.json.get('message', '')
     model = request.json.get('model', 'codellama:13b')
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
-    task = {'id': task_id, 'message': message, 'messages': request.json.get('messages'), 'model': model, 'event': event, 'force_cloud': request.json.get('force_cloud', False), 'type': 'chat',
+    task = {'id': task_id, 'message': message, 'messages': request.json.get('messages'), 'model': model, 'event': event, 'stream': Queue() if request.json.get('stream') else None, 'force_cloud': request.json.get('force_cloud', False), 'type': 'chat',
             'client_ip': request.json.get('client_ip', request.remote_addr),
             'client_agent': request.json.get('client_agent', request.headers.get('User-Agent', '')),
             'summary': f'chat: {message[:80].replace(chr(10), " ")}'}
+    if task['stream'] is not None:
+        return stream_task(task)
     result = submit_and_wait(task)
     
     if result is None:
         return jsonify({"error": f"Task {task_id} completed but result was lost"}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -933,24 +1733,20 @@ def analyze_endpoint():
     files = request.json.get('files', [])
     model = request.json.get('model', 'codellama:13b')
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
     paths = ', '.join(f.get('path', '?') for f in files[:3])
-    task = {'id': task_id, 'files': files, 'model': model, 'event': event, 'force_cloud': request.json.get('force_cloud', False), 'type': 'analyze',
+    task = {'id': task_id, 'files': files, 'model': model, 'event': event, 'stream': Queue() if request.json.get('stream') else None, 'force_cloud': request.json.get('force_cloud', False), 'type': 'analyze',
             'client_ip': request.json.get('client_ip', request.remote_addr),
             'client_agent': request.json.get('client_agent', request.headers.get('User-Agent', '')),
             'summary': f'analyze: {paths}'}
+    if task['stream'] is not None:
+        return stream_task(task)
     result = submit_and_wait(task)
     
     if result is None:
         return jsonify({"error": f"Task {task_id} completed but result was lost"}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -963,11 +1759,7 @@ def generate_image_endpoint():
     width = request.json.get('width', 512)
     height = request.json.get('height', 512)
     
-    queue_size = task_queue.qsize()
-    if active_task is not None:
-        queue_size += 1
-    
-    task_id = str(uuid.uuid4())
+    task_id = _new_task_id()
     event = Event()
     task = {'id': task_id, 'prompt': prompt, 'image_model': image_model,
             'steps': steps, 'width': width, 'height': height,
@@ -980,8 +1772,6 @@ def generate_image_endpoint():
     if result is None:
         return jsonify({'error': f'Task {task_id} completed but result was lost'}), 500
     
-    if queue_size > 0:
-        result['queue_position'] = queue_size + 1
     result['task_id'] = task_id
     
     return jsonify(result)
@@ -504,16 +504,12 @@ GitHub: https://github.com/your-repo/shellama
                 data = {'code': input_content, 'model': model}
                 output_key = 'explanation'
             
-            json_data = json.dumps(data).encode('utf-8')
-            ssl_context = self.get_ssl_config()
-            req = urllib.request.Request(
-                f"{api_url}{endpoint}",
-                data=json_data,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            with urllib.request.urlopen(req, context=ssl_context) as response:
-                result = json.loads(response.read().decode())
+            if endpoint in self.STREAM_ENDPOINTS:
+                # Render tokens as they arrive
+                self.root.after(0, lambda: self.output_text.delete(1.0, tk.END))
+                result = self._api_stream(endpoint, data, self._stream_token)
+            else:
+                result = self._api_call(endpoint, data)
             
             if result.get('error'):
                 error_msg = f"Error: {result['error']}"
@@ -530,7 +526,9 @@ GitHub: https://github.com/your-repo/shellama
                 self.session_tokens += tokens
                 self.root.after(0, lambda: self.token_label.config(text=f"Session Tokens: {self.session_tokens:,}"))
                 
-                status_msg = f"Generated in {result['elapsed']}s | Tokens: {result['total_tokens']}"
+                status_msg = f"Generated in {result.get('elapsed', 0)}s | Tokens: {result.get('total_tokens', 0)}"
+                if result.get('ttft') is not None:
+                    status_msg += f" | First token: {result['ttft']}s"
                 if result.get('queue_position'):
                     status_msg += f" | Was #{result['queue_position']} in queue"
                 
@@ -543,6 +541,37 @@ GitHub: https://github.com/your-repo/shellama
             self.root.after(0, lambda: self.status_label.config(
                 text=error_msg, foreground="red"))
     
+    # Endpoints that accept "stream": true and answer with server-sent events
+    STREAM_ENDPOINTS = ('/generate', '/explain', '/generate-code', '/explain-code', '/chat')
+
+    def _api_stream(self, endpoint, data, on_token):
+        """Make a streaming API call, passing each token to on_token. Returns the final result dict."""
+        json_data = json.dumps(dict(data, stream=True)).encode('utf-8')
+        ssl_context = self.get_ssl_config()
+        req = urllib.request.Request(
+            f"{self.api_url.get()}{endpoint}",
+            data=json_data,
+            headers={'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
+        )
+        with urllib.request.urlopen(req, context=ssl_context) as response:
+            for raw in response:
+                line = raw.decode('utf-8').strip()
+                if not line.startswith('data: '):
+                    continue
+                event = json.loads(line[6:])
+                if event.get('done'):
+                    return event
+                if event.get('reset'):
+                    self.root.after(0, lambda: self.output_text.delete(1.0, tk.END))
+                elif event.get('token'):
+                    on_token(event['token'])
+        return {'error': 'Stream ended without a result'}
+
+    def _stream_token(self, token):
+        """Append a streamed token to the output pane."""
+        self.root.after(0, lambda: self.output_text.insert(tk.END, token))
+        self.root.after(0, lambda: self.output_text.see(tk.END))
+
     def _api_call(self, endpoint, data):
         """Make an API call and return the result dict."""
         json_data = json.dumps(data).encode('utf-8')
@@ -1,9 +1,13 @@
 #!/export/ollama/bin/python3
-from flask import Flask, request, jsonify, send_from_directory, redirect, session
+from flask import Flask, request, jsonify, send_from_directory, redirect, session, Response, stream_with_context, has_request_context
 import requests
 import json
-from queue import Queue, PriorityQueue
-from threading import Thread, Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as _wait_futures
+from urllib.parse import urlsplit
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from threading import Thread, Lock, Condition
+import math
 import time
 import uuid
 import os
@@ -16,7 +20,13 @@ app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'shellama-default-secret-cha
 _proj = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
 if _proj not in sys.path:
     sys.path.insert(0, _proj)
-from shared.auth import require_auth, require_admin, get_key_name, auth_enabled, init_sso, get_oauth, sso_enabled, require_sso, get_web_role, record_rate_tokens
+from shared.auth import require_auth, require_admin, get_key_name, get_key_id, auth_enabled, init_sso, get_oauth, sso_enabled, require_sso, get_web_role, record_rate_tokens
+from shared.cache import PromptCache, DiskCache, SemanticCache
+from shared.ratelimit import SlidingWindow
+from shared.audit import AuditLog
+from shared.webhooks import WebhookDispatcher
+from shared.history import HistoryStore, RingBuffer, AGGS, COST_RESOLUTIONS, aggregate
+from shared.constants import model_size
 
 # Backend TLS client cert config (for frontend→backend mTLS)
 _backend_cert = os.environ.get('SHELLAMA_BACKEND_CERT')
@@ -25,32 +35,155 @@ _backend_ca = os.environ.get('SHELLAMA_BACKEND_CA')
 BACKEND_TLS = (_backend_cert, _backend_key) if _backend_cert and _backend_key else None
 BACKEND_VERIFY = _backend_ca if _backend_ca else True  # True = default CA bundle, path = custom CA
 
+# Persistent keep-alive connection pool per backend (mTLS configured once), sized
+# to the backend's worker slots, with counters for reuse and handshake cost.
+_backend_pools = {}  # {'scheme://host:port': {'session', 'size', 'stats'}}
+_pool_lock = Lock()
+
+def _counting_pool_classes(stats):
+    """urllib3 pool classes whose connections record each connect (TCP + TLS handshake)."""
+    def timed(conn_cls):
+        class TimedConnection(conn_cls):
+            def connect(self):
+                t0 = time.time()
+                super().connect()
+                dt = time.time() - t0
+                with _pool_lock:
+                    stats['new_connections'] += 1
+                    stats['connect_time'] += dt
+                    stats['connect_max'] = max(stats['connect_max'], dt)
+        return TimedConnection
+    return {
+        'http': type('TimedHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': timed(HTTPConnectionPool.ConnectionCls)}),
+        'https': type('TimedHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': timed(HTTPSConnectionPool.ConnectionCls)}),
+    }
+
+class _BackendAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter for one backend that counts requests and new connections."""
+    def __init__(self, stats, pool_size):
+        self._stats = stats
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _counting_pool_classes(self._stats)
+
+    def send(self, request, **kwargs):
+        with _pool_lock:
+            self._stats['requests'] += 1
+        return super().send(request, **kwargs)
+
+def _pool_size(slots):
+    """Connections to keep per backend: its worker slots plus status/admin calls."""
+    return max(4, slots * 2 + 2)
+
+def _backend_pool(url, slots=None):
+    """Session for the backend serving url; grows its pool if slots increased."""
+    parts = urlsplit(url)
+    base = f"{parts.scheme}://{parts.netloc}"
+    with _pool_lock:
+        pool = _backend_pools.get(base)
+        size = _pool_size(slots or 1)
+        if pool is None:
+            session = requests.Session()
+            session.cert = BACKEND_TLS
+            session.verify = BACKEND_VERIFY
+            pool = {'session': session, 'size': 0,
+                    'stats': {'requests': 0, 'new_connections': 0, 'connect_time': 0.0, 'connect_max': 0.0}}
+            _backend_pools[base] = pool
+        if size > pool['size']:
+            pool['size'] = size
+            pool['session'].mount(f"{parts.scheme}://", _BackendAdapter(pool['stats'], size))
+        return pool['session']
+
+def _pool_metrics():
+    """Per-backend pool counters for the admin API."""
+    with _pool_lock:
+        out = {}
+        for base, pool in _backend_pools.items():
+            st = pool['stats']
+            reused = max(0, st['requests'] - st['new_connections'])
+            out[base] = {
+                'pool_size': pool['size'],
+                'requests': st['requests'],
+                'new_connections': st['new_connections'],
+                'reused': reused,
+                'hit_rate': round(reused / st['requests'], 3) if st['requests'] else None,
+                'handshake_avg_ms': round(st['connect_time'] / st['new_connections'] * 1000, 1) if st['new_connections'] else None,
+                'handshake_max_ms': round(st['connect_max'] * 1000, 1),
+            }
+    return out
+
 def _backend_get(url, **kwargs):
     """GET request to a backend with optional mTLS."""
-    return requests.get(url, cert=BACKEND_TLS, verify=BACKEND_VERIFY, **kwargs)
+    return _backend_pool(url).get(url, **kwargs)
 
 def _backend_post(url, **kwargs):
     """POST request to a backend with optional mTLS."""
-    return requests.post(url, cert=BACKEND_TLS, verify=BACKEND_VERIFY, **kwargs)
+    return _backend_pool(url).post(url, **kwargs)
+
+_fanout_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='fanout')
+
+def fan_out(path, method='GET', timeout=5, **kwargs):
+    """Call path on every backend concurrently.
 
-# Persistence file
+    Returns {url: {'ok', 'data', 'error', 'latency'}} in BACKENDS order. Waits
+    at most timeout for healthy backends; backends already marked unhealthy
+    are included only if they answered by then, so a dead host never adds
+    wall time to admin pages."""
+    def call(url):
+        t0 = time.time()
+        try:
+            resp = _backend_pool(url).request(method, f"{url}{path}", timeout=timeout, **kwargs)
+            return {'ok': True, 'data': resp.json(), 'error': None, 'latency': round(time.time() - t0, 3)}
+        except Exception as e:
+            return {'ok': False, 'data': None, 'error': str(e), 'latency': round(time.time() - t0, 3)}
+
+    futures = {b['url']: _fanout_pool.submit(call, b['url']) for b in BACKENDS}
+    healthy = [f for url, f in futures.items() if _health_status.get(url) != 'unhealthy']
+    _wait_futures(healthy or list(futures.values()), timeout=timeout + 1)
+    results = {}
+    for url, f in futures.items():
+        if f.done():
+            results[url] = f.result()
+        else:
+            results[url] = {'ok': False, 'data': None, 'error': 'no response', 'latency': None}
+    return results
+
+# Persistence: append-only SQLite store; the old JSON file is migrated once
 HISTORY_FILE = os.path.join(os.path.dirname(__file__), 'shellama-history.json')
+HISTORY_DB = os.environ.get('SHELLAMA_HISTORY_DB', os.path.join(os.path.dirname(__file__), 'shellama-history.db'))
+HISTORY_COMPACT_INTERVAL = 3600  # roll old points into minute/hour buckets hourly
+_history = HistoryStore(HISTORY_DB)
 
 # Conversation memory (in-memory, expires after inactivity)
 conversations = {}  # {conv_id: {'messages': [...], 'model': str, 'updated': timestamp}}
 CONV_MAX_AGE = 28800  # 8 hours
 
-# Per-IP token tracking
-ip_token_history = {}  # {ip: [{timestamp, tokens}]}
+# In-memory history for graphs: fixed-capacity ring buffers (see shared/history.py)
+HISTORY_POINTS = 500  # default max points per series served by /ip-tokens and /queue-history
+HISTORY_MAX_BUCKETS = 5000  # hard cap per series, whatever ?step= asks for
+
+# Per-IP token tracking; task is a code into _task_names, flags are FLAG_* bits
+ip_token_history = {}  # {ip: RingBuffer(tokens, prompt_tokens, response_tokens, task, flags)}
 ip_token_lock = Lock()
 IP_HISTORY_MAX = 8640  # ~1 day at 10s intervals
+IP_TOKEN_FIELDS = ('tokens', 'prompt_tokens', 'response_tokens', 'task', 'flags')
+FLAG_FALLBACK, FLAG_CACHED = 1, 2
+_task_names = []
+_task_codes = {}
+
+# Pre-aggregated client usage for /cost-history, maintained by record_ip_tokens
+# {resolution: {bucket_start: {(task, fallback, cached): [requests, prompt, response, tokens]}}}
+_cost_buckets = {res: {} for res in COST_RESOLUTIONS}
+COST_HOUR_MEMORY = 30 * 86400  # hour cost buckets kept in memory; older hours are read from the store
 
 # Per-backend token tracking (snapshots of cumulative totals)
-backend_token_history = {}  # {url: [{timestamp, tokens}]}
+backend_token_history = {}  # {url: RingBuffer(tokens)}
 last_backend_tokens = {}    # {url: last_known_total} for computing deltas
 
 # Queue history for graphs
-queue_history = {}  # {url: [{timestamp, queue_size}]}
+queue_history = {}  # {url: RingBuffer(queue_size)}
 QUEUE_HISTORY_MAX = 86400  # ~1 day at 1s intervals
 
 # Persisted cumulative totals (survive frontend+backend restarts)
@@ -63,45 +196,157 @@ last_backend_requests = {}  # {url: last_known_total} for computing deltas
 usage_stats = {'by_client': {}, 'by_task': {}}
 
 
-def load_history():
-    global ip_token_history, backend_token_history, queue_history, persisted_totals
-    global last_backend_tokens, last_backend_requests, usage_stats
+def _migrate_history_file():
+    """Import shellama-history.json into the store once, then rename it."""
     try:
         with open(HISTORY_FILE, 'r') as f:
             data = json.load(f)
-            ip_token_history = data.get('ip_tokens', {})
-            backend_token_history = data.get('backend_tokens', {})
-            queue_history = data.get('queue', {})
-            persisted_totals = data.get('totals', {'requests': 0, 'tokens': 0})
-            last_backend_tokens = data.get('last_backend_tokens', {})
-            last_backend_requests = data.get('last_backend_requests', {})
-            usage_stats = data.get('usage_stats', {'by_client': {}, 'by_task': {}})
     except (FileNotFoundError, json.JSONDecodeError):
-        pass
+        return
+    _history.import_points('ip_tokens', [
+        (ip, e.get('timestamp', 0), e.get('tokens', 0), e.get('task', 'unknown'), e.get('prompt_tokens', 0),
+         e.get('response_tokens', 0), int(bool(e.get('cloud_fallback'))), int(bool(e.get('cached'))))
+        for ip, entries in data.get('ip_tokens', {}).items() for e in entries])
+    _history.import_points('backend_tokens', [
+        (url, e.get('timestamp', 0), e.get('tokens', 0))
+        for url, entries in data.get('backend_tokens', {}).items() for e in entries])
+    _history.import_points('queue', [
+        (url, e.get('timestamp', 0), e.get('queue_size', 0))
+        for url, entries in data.get('queue', {}).items() for e in entries])
+    _history.set_state({key: json.dumps(data[src]) for key, src in (
+        ('totals', 'totals'), ('last_backend_tokens', 'last_backend_tokens'),
+        ('last_backend_requests', 'last_backend_requests'), ('usage_stats', 'usage_stats')) if src in data})
+    os.replace(HISTORY_FILE, HISTORY_FILE + '.migrated')
+    print(f"[history] migrated {HISTORY_FILE} into {HISTORY_DB}")
+
+
+def _task_code(task):
+    """Small integer standing in for a task type in the ip token ring buffers."""
+    code = _task_codes.get(task)
+    if code is None:
+        code = _task_codes[task] = len(_task_names)
+        _task_names.append(task)
+    return code
+
+
+def _ring(series, key, capacity, fields):
+    buf = series.get(key)
+    if buf is None:
+        buf = series[key] = RingBuffer(capacity, fields)
+    return buf
+
+
+def _add_cost(ts, task, fallback, cached, prompt_tokens, response_tokens, tokens):
+    """Count one request into its hour and day cost buckets. Caller holds ip_token_lock."""
+    hour = COST_RESOLUTIONS[0]
+    if int(ts // hour) * hour not in _cost_buckets[hour]:
+        # A new hour: drop the ones that left the in-memory window
+        floor = ts - COST_HOUR_MEMORY
+        for start in [b for b in _cost_buckets[hour] if b < floor]:
+            del _cost_buckets[hour][start]
+    for res, buckets in _cost_buckets.items():
+        cell = buckets.setdefault(int(ts // res) * res, {}).setdefault((task, fallback, cached), [0, 0, 0, 0])
+        cell[0] += 1
+        cell[1] += prompt_tokens
+        cell[2] += response_tokens
+        cell[3] += tokens
+    _history.add_cost(ts, task, fallback, cached, prompt_tokens, response_tokens, tokens)
+
+
+def load_history():
+    global persisted_totals, last_backend_tokens, last_backend_requests, usage_stats
+    try:
+        state = _history.get_state()
+        if not state:
+            _migrate_history_file()
+            state = _history.get_state()
+        _history.backfill_costs()
+        floor = time.time() - COST_HOUR_MEMORY
+        for res, bucket, task, fb, cached, reqs, pt, rt, tok in _history.cost_buckets():
+            if res == COST_RESOLUTIONS[0] and bucket < floor:
+                continue
+            _cost_buckets[res].setdefault(bucket, {})[(task, bool(fb), bool(cached))] = [reqs, pt, rt, tok]
+        persisted_totals = state.get('totals', {'requests': 0, 'tokens': 0})
+        last_backend_tokens = state.get('last_backend_tokens', {})
+        last_backend_requests = state.get('last_backend_requests', {})
+        usage_stats = state.get('usage_stats', {'by_client': {}, 'by_task': {}})
+    except Exception as e:
+        print(f"[history] load failed: {e}")
+
+
+# Stored points are not loaded at startup: each kind's ring buffers get their
+# stored tail on first use (_hydrate), and ranges older than the buffers are
+# aggregated in SQLite from raw points and rollups (_stored_buckets).
+_history_started = time.time()
+_hydrated = set()
+
+def _history_series(kind):
+    """(ring buffers, capacity, fields) holding a history kind in memory."""
+    if kind == 'ip_tokens':
+        return ip_token_history, IP_HISTORY_MAX, IP_TOKEN_FIELDS
+    if kind == 'backend_tokens':
+        return backend_token_history, IP_HISTORY_MAX, ('tokens',)
+    return queue_history, QUEUE_HISTORY_MAX, ('queue_size',)
+
+def _hydrate(kind):
+    """Put a kind's stored points from before startup in front of its live points, once.
+    Caller holds ip_token_lock."""
+    if kind in _hydrated:
+        return
+    _hydrated.add(kind)
+    series, capacity, fields = _history_series(kind)
+    try:
+        stored = _history.tail(kind, capacity, _history_started)
+    except Exception as e:
+        print(f"[history] loading {kind} failed: {e}")
+        return
+    for key, rows in stored.items():
+        live = list(series[key].rows()) if key in series else []
+        keep = capacity - len(live)
+        if keep <= 0:
+            continue
+        buf = series[key] = RingBuffer(capacity, fields)
+        for row in rows[max(0, len(rows) - keep):]:
+            if kind == 'ip_tokens':
+                ts, tokens, task, pt, rt, fallback, cached = row
+                flags = (FLAG_FALLBACK if fallback else 0) | (FLAG_CACHED if cached else 0)
+                buf.append(ts, tokens, pt, rt, _task_code(task), flags)
+            else:
+                buf.append(*row)
+        for row in live:
+            buf.append(*row)
 
 
 def save_history():
+    """Persist small state and append new points; O(new points), not O(history)."""
     with ip_token_lock:
-        data = {
-            'ip_tokens': ip_token_history,
-            'backend_tokens': backend_token_history,
-            'queue': queue_history,
-            'totals': persisted_totals,
-            'last_backend_tokens': last_backend_tokens,
-            'last_backend_requests': last_backend_requests,
-            'usage_stats': usage_stats
+        # Serialise under the lock so a concurrent update can't change a dict mid-dump
+        state = {
+            'totals': json.dumps(persisted_totals),
+            'last_backend_tokens': json.dumps(last_backend_tokens),
+            'last_backend_requests': json.dumps(last_backend_requests),
+            'usage_stats': json.dumps(usage_stats),
         }
+    with backend_lock:
+        state['demand_profile'] = json.dumps(_demand_profile)
     try:
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(data, f)
-    except Exception:
-        pass
+        _history.set_state(state)
+        _history.flush()
+    except Exception as e:
+        print(f"[history] save failed: {e}")
 
 
 def periodic_save():
+    last_compact = 0
     while True:
         time.sleep(60)
         save_history()
+        if time.time() - last_compact >= HISTORY_COMPACT_INTERVAL:
+            last_compact = time.time()
+            try:
+                _history.compact()
+            except Exception as e:
+                print(f"[history] compaction failed: {e}")
 
 
 load_history()
@@ -143,13 +388,13 @@ def record_ip_tokens(ip, tokens, task_type='unknown', prompt_tokens=0, response_
             persisted_totals['cached_tokens'] = persisted_totals.get('cached_tokens', 0) + tokens
         # Record time-series entry only if there were tokens
         if tokens > 0 or cached:
-            if ip not in ip_token_history:
-                ip_token_history[ip] = []
-            ip_token_history[ip].append({'timestamp': time.time(), 'tokens': tokens, 'task': task_type,
-                                          'prompt_tokens': prompt_tokens, 'response_tokens': response_tokens,
-                                          'cloud_fallback': cloud_fallback, 'cached': cached})
-            if len(ip_token_history[ip]) > IP_HISTORY_MAX:
-                ip_token_history[ip] = ip_token_history[ip][-IP_HISTORY_MAX:]
+            now = time.time()
+            flags = (FLAG_FALLBACK if cloud_fallback else 0) | (FLAG_CACHED if cached else 0)
+            _ring(ip_token_history, ip, IP_HISTORY_MAX, IP_TOKEN_FIELDS).append(
+                now, tokens, prompt_tokens, response_tokens, _task_code(task_type), flags)
+            _history.add('ip_tokens', (ip, now, tokens, task_type, prompt_tokens, response_tokens,
+                                       int(bool(cloud_fallback)), int(bool(cached))))
+            _add_cost(now, task_type, bool(cloud_fallback), bool(cached), prompt_tokens, response_tokens, tokens)
 
 # Load backends from config file
 def load_backends():
@@ -236,25 +481,18 @@ def _auto_route(prompt):
     # Long/complex → default model
     return AUTO_ROUTING['default_model']
 
-# Model size ordering for comparison
-MODEL_SIZES = {
-    'codellama:7b': 2,
-    'codellama:13b': 3,
-    'codellama:34b': 4,
-    'codellama:70b': 5,
-    'deepseek-coder:1.3b': 1,
-    'deepseek-coder:6.7b': 2,
-    'deepseek-coder:33b': 4,
-    'qwen2.5-coder:0.5b': 1,
-    'qwen2.5-coder:1.5b': 1,
-    'qwen2.5-coder:3b': 1,
-    'qwen2.5-coder:7b': 2,
-    'qwen2.5-coder:14b': 3,
-    'qwen2.5-coder:32b': 4
-}
+# Capacity index: each backend's installed models with their byte sizes and
+# metadata from its /models registry, refreshed every MODEL_INDEX_INTERVAL
+# seconds. Routing only sends a model to backends that have it and whose RAM
+# can hold it; a backend whose list isn't known yet falls back to comparing
+# parameter counts in the model names against its max_model.
+MODEL_INDEX_INTERVAL = 60
+MODEL_RAM_HEADROOM = 1.2  # model file size * headroom must fit, as on the backends
+_model_index = {}  # {url: {model: {'size', 'parameter_size', 'quantization', 'family', 'context_length'}}}
 
 # Track backend availability and queue size
-backend_status = {b['url']: {'available': True, 'queue_size': 0, 'weight': b['weight'], 'max_model': b['max_model'], 'tasks': b.get('tasks', ['all'])} for b in BACKENDS}
+# inflight = requests this frontend has routed to the backend; slots = backend worker pool size
+backend_status = {b['url']: {'inflight': 0, 'slots': 1, 'queue_size': 0, 'weight': b['weight'], 'max_model': b['max_model'], 'tasks': b.get('tasks', ['all'])} for b in BACKENDS}
 backend_lock = Lock()
 
 # Health check tracking
@@ -262,14 +500,51 @@ _health_failures = {b['url']: 0 for b in BACKENDS}  # consecutive failures
 _health_status = {b['url']: 'unknown' for b in BACKENDS}  # healthy/unhealthy/unknown
 _loaded_models = {b['url']: [] for b in BACKENDS}  # models currently in memory
 HEALTH_FAIL_THRESHOLD = 3  # mark unhealthy after N consecutive failures
+
+# Model affinity: each model gets a home set of backends sized to its share of recent
+# demand, so a model stays warm where it is instead of being swapped in everywhere
+AFFINITY_WINDOW = int(os.environ.get('SHELLAMA_AFFINITY_WINDOW', '600'))  # seconds of demand considered
+AFFINITY_PENALTY = float(os.environ.get('SHELLAMA_AFFINITY_PENALTY', '4'))  # score added off-home, 0 = disabled
+AFFINITY_REBALANCE = 30  # seconds between home set recomputations
+_model_demand = {}  # {model: SlidingWindow of requests over AFFINITY_WINDOW}
+_model_homes = {}   # {model: [url, ...]}
+_affinity_rebalanced = 0
+_model_swaps = {b['url']: {'loads': 0, 'unloads': 0} for b in BACKENDS}  # load/unload events seen per backend
+
+# Predictive warming: an hour-of-day request profile per model lets the frontend
+# preload a model on its home backends shortly before its usual busy hours
+WARM_MIN = float(os.environ.get('SHELLAMA_WARM_MIN', '2'))  # expected requests/hour to warm a model, 0 = disabled
+WARM_LOOKAHEAD = 900  # seconds ahead of the predicted hour
+WARM_INTERVAL = 300
+PROFILE_ALPHA = 0.3  # weight of the most recent day in each hour's average
+try:
+    _demand_profile = _history.get_state().get('demand_profile', {})  # {model: [24 requests/hour by local hour]}
+except Exception:
+    _demand_profile = {}
+_profile_hour = None  # absolute hour being counted
+_profile_counts = {}  # {model: requests so far in _profile_hour}
+_warm_stats = {'preloads': 0, 'failed': 0, 'last': None}
+
+# Latency-aware routing: EWMAs of prompt-eval and generation tokens/sec per
+# (backend, model) learned from results, and of prompt/output length per
+# (model, task type). Once a model has estimates, backends are ranked by
+# predicted completion time instead of the static hardware score.
+SPEED_ALPHA = 0.2  # weight of the newest result
+LOAD_GB_PER_SEC = 0.5  # assumed cold-load rate for a model that is not loaded
+_speed = {}  # {model: {url: {'prompt_tps', 'gen_tps', 'samples', 'updated'}}}
+_shape = {}  # {(model, task_type or '*'): {'prompt_tokens', 'response_tokens'}}
 HEALTH_CHECK_INTERVAL = 30  # seconds
 
 # Webhooks: POST JSON to configured URLs on events
 WEBHOOK_URL = os.environ.get('SHELLAMA_WEBHOOK_URL', '')  # single URL or loaded from config
+WEBHOOK_DEAD_LETTER = os.environ.get('SHELLAMA_WEBHOOK_DEAD_LETTER',
+                                     os.path.join(os.path.dirname(__file__), 'shellama-webhooks-dead.jsonl'))
 _webhook_sent = {}  # {event_key: timestamp} — dedup within 5 min
+_webhook_lock = Lock()
+_webhooks = WebhookDispatcher(WEBHOOK_DEAD_LETTER)
 
 def _fire_webhook(event, details):
-    """Send webhook notification. Deduplicates within 5 minutes."""
+    """Queue a webhook notification for background delivery. Deduplicates within 5 minutes."""
     urls = []
     if WEBHOOK_URL:
         urls.append(WEBHOOK_URL)
@@ -282,11 +557,13 @@ def _fire_webhook(event, details):
     # Dedup
     key = f"{event}:{details.get('url', details.get('key_name', ''))}"
     now = time.time()
-    if key in _webhook_sent and now - _webhook_sent[key] < 300:
-        return
-    _webhook_sent[key] = now
-    # Clean old entries
-    _webhook_sent.update({k: v for k, v in _webhook_sent.items() if now - v < 300})
+    with _webhook_lock:
+        if key in _webhook_sent and now - _webhook_sent[key] < 300:
+            return
+        # Clean old entries
+        for k in [k for k, v in _webhook_sent.items() if now - v >= 300]:
+            del _webhook_sent[k]
+        _webhook_sent[key] = now
 
     payload = {
         'event': event,
@@ -294,34 +571,22 @@ def _fire_webhook(event, details):
         'time': time.strftime('%Y-%m-%d %H:%M:%S'),
         **details,
     }
-    for url in urls:
-        try:
-            requests.post(url, json=payload, timeout=5)
-        except:
-            pass
+    _webhooks.send(urls, payload)
 
 def _health_check_loop():
-    """Background thread: ping backends periodically."""
+    """Background thread: mark backends healthy/unhealthy from their status snapshots."""
     while True:
         time.sleep(HEALTH_CHECK_INTERVAL)
         for backend in BACKENDS:
             url = backend['url']
-            try:
-                resp = _backend_get(f"{url}/queue-status", timeout=5)
-                if resp.status_code == 200:
-                    was_unhealthy = _health_status.get(url) == 'unhealthy'
-                    _health_failures[url] = 0
-                    _health_status[url] = 'healthy'
-                    # Cache loaded models
-                    try:
-                        _loaded_models[url] = resp.json().get('loaded_models', [])
-                    except:
-                        pass
-                    if was_unhealthy:
-                        _fire_webhook('backend_recovered', {'url': url})
-                    continue
-            except:
-                pass
+            # The status poller keeps snapshots fresh; a missing one means it failed
+            if _status_snapshot(url) is not None:
+                was_unhealthy = _health_status.get(url) == 'unhealthy'
+                _health_failures[url] = 0
+                _health_status[url] = 'healthy'
+                if was_unhealthy:
+                    _fire_webhook('backend_recovered', {'url': url})
+                continue
             _health_failures[url] = _health_failures.get(url, 0) + 1
             if _health_failures[url] >= HEALTH_FAIL_THRESHOLD:
                 _health_status[url] = 'unhealthy'
@@ -329,55 +594,314 @@ def _health_check_loop():
 
 Thread(target=_health_check_loop, daemon=True).start()
 
-def get_backend_queue_size(url):
-    """Check backend queue size and capacity stats"""
-    try:
-        resp = _backend_get(
-            f"{url}/queue-status", 
-            timeout=2
-        )
-        data = resp.json()
-        return data
-    except:
+# Backend status snapshots, refreshed by one poller thread per backend so routing
+# and /queue-status read from memory instead of probing every backend per request.
+STATUS_INTERVAL = float(os.environ.get('SHELLAMA_STATUS_INTERVAL', '1'))
+STATUS_MAX_AGE = max(5.0, STATUS_INTERVAL * 5)  # older snapshots count as offline
+_status_cache = {b['url']: {'data': None, 'updated': 0, 'latency': None} for b in BACKENDS}
+# Signalled when a snapshot arrives or a slot is released, to wake waiting requests
+_backend_changed = Condition(backend_lock)
+
+def _status_snapshot(url):
+    """Latest /queue-status of a backend, or None if offline or stale."""
+    entry = _status_cache.get(url)
+    if not entry or entry['data'] is None or time.time() - entry['updated'] > STATUS_MAX_AGE:
         return None
+    return entry['data']
 
-def get_available_backend(requested_model='codellama:13b', wait=True, timeout=300, task_type='unknown'):
+def _record_backend_status(url, data, now):
+    """Record per-backend token/request deltas and queue history from a snapshot."""
+    with ip_token_lock:
+        # Token deltas — detect backend restart (current < previous)
+        cur_tokens = data.get('total_tokens', 0)
+        prev_tokens = last_backend_tokens.get(url, 0)
+        if cur_tokens < prev_tokens:
+            # Backend restarted, treat entire current value as new
+            delta_tokens = cur_tokens
+        else:
+            delta_tokens = cur_tokens - prev_tokens
+        last_backend_tokens[url] = cur_tokens
+        if delta_tokens > 0:
+            persisted_totals['tokens'] += delta_tokens
+            _ring(backend_token_history, url, IP_HISTORY_MAX, ('tokens',)).append(now, delta_tokens)
+            _history.add('backend_tokens', (url, now, delta_tokens))
+        # Request deltas
+        cur_reqs = data.get('total_requests', 0)
+        prev_reqs = last_backend_requests.get(url, 0)
+        if cur_reqs < prev_reqs:
+            delta_reqs = cur_reqs
+        else:
+            delta_reqs = cur_reqs - prev_reqs
+        last_backend_requests[url] = cur_reqs
+        if delta_reqs > 0:
+            persisted_totals['requests'] += delta_reqs
+        # Queue history
+        _ring(queue_history, url, QUEUE_HISTORY_MAX, ('queue_size',)).append(now, data.get('queue_size', 0))
+        _history.add('queue', (url, now, data.get('queue_size', 0)))
+
+def _status_poll_loop(url):
+    """Background thread: keep one backend's status snapshot fresh."""
+    while True:
+        t0 = time.time()
+        try:
+            data = _backend_get(f"{url}/queue-status", timeout=max(2.0, STATUS_INTERVAL * 2)).json()
+        except Exception:
+            data = None
+        now = time.time()
+        with backend_lock:
+            st = backend_status[url]
+            if data is not None:
+                if _status_cache[url]['data'] is not None and 'loaded_models' in data:
+                    before, after = set(_loaded_models.get(url, [])), set(data['loaded_models'])
+                    swaps = _model_swaps.setdefault(url, {'loads': 0, 'unloads': 0})
+                    swaps['loads'] += len(after - before)
+                    swaps['unloads'] += len(before - after)
+                _status_cache[url] = {'data': data, 'updated': now, 'latency': round(now - t0, 3)}
+                st['queue_size'] = data.get('queue_size', 999)
+                st['cpu_percent'] = data.get('cpu_percent', 50)
+                st['ram_available_gb'] = data.get('ram_available_gb', 0)
+                st['ram_total_gb'] = data.get('ram_total_gb', 16)
+                st['cpu_arch'] = data.get('cpu_arch', 'x86_64')
+                st['cpu_count'] = data.get('cpu_count', 4)
+                st['cpu_freq_mhz'] = data.get('cpu_freq_mhz', 2000)
+                st['slots'] = data.get('slots', 1)
+                _backend_pool(url, st['slots'])
+                _loaded_models[url] = data.get('loaded_models', _loaded_models.get(url, []))
+            else:
+                st['queue_size'] = 999
+            _backend_changed.notify_all()
+        if data is not None:
+            _record_backend_status(url, data, now)
+        time.sleep(max(0, STATUS_INTERVAL - (time.time() - t0)))
+
+def _model_key(model):
+    return model if ':' in model else f'{model}:latest'
+
+def _update_model_index(replies):
+    """Store the model lists from a fan_out('/models'); failed replies keep the last known list."""
+    for url, r in replies.items():
+        if r['ok'] and 'models' in (r['data'] or {}) and not r['data'].get('error'):
+            _model_index[url] = {m['name']: {k: m.get(k) for k in
+                                             ('size', 'parameter_size', 'quantization', 'family', 'context_length')}
+                                 for m in r['data']['models']}
+
+def _model_index_loop():
+    while True:
+        _update_model_index(fan_out('/models', timeout=5))
+        time.sleep(MODEL_INDEX_INTERVAL)
+
+def _fits(url, model):
+    """Whether a backend can run a model: it has the model and the model's footprint fits its RAM.
+
+    Idle loaded models count as reclaimable, since Ollama unloads them to make
+    room; models the backend's last status shows in active_tasks do not.
+    Models no backend reports are allowed through so the backend can
+    answer with its own not-found error."""
+    if model == 'none':
+        return True
+    key = _model_key(model)
+    index = _model_index.get(url)
+    info = index.get(key) if index is not None else None
+    if info is None:
+        if index is not None and any(key in idx for idx in _model_index.values()):
+            return False
+        return model_size(model) <= (model_size(backend_status[url]['max_model']) or float('inf'))
+    need = (info.get('size') or 0) * MODEL_RAM_HEADROOM
+    loaded = _loaded_models.get(url, [])
+    if key in loaded or model in loaded:
+        return True
+    st = backend_status[url]
+    busy = {_model_key(t.get('model', '')) for t in (_status_cache[url]['data'] or {}).get('active_tasks', [])}
+    reclaimable = sum((index.get(_model_key(m)) or {}).get('size') or 0 for m in loaded if _model_key(m) not in busy)
+    return need <= min(st.get('ram_total_gb', 0), st.get('ram_available_gb', 0) + reclaimable / 1e9) * 1e9
+
+def _rebalance_affinity(now):
+    """Recompute model home sets from recent demand. Caller holds backend_lock.
+
+    Each model gets backends in proportion to its share of requests (at least
+    one). Current homes are kept while still eligible; new ones prefer
+    backends that already have the model loaded, then the least loaded."""
+    global _affinity_rebalanced
+    _affinity_rebalanced = now
+    demand = {}
+    for model, window in list(_model_demand.items()):
+        n = window.total(now)[0]
+        if n:
+            demand[model] = n
+        else:
+            del _model_demand[model]
+    total = sum(demand.values())
+    healthy = [u for u in backend_status if _health_status.get(u) != 'unhealthy']
+    load = {u: 0.0 for u in healthy}
+    homes = {}
+    for model, n in sorted(demand.items(), key=lambda kv: -kv[1]):
+        eligible = [u for u in healthy if _fits(u, model)]
+        if not eligible:
+            continue
+        want = max(1, min(len(eligible), round(n / total * len(healthy))))
+        keep = [u for u in _model_homes.get(model, []) if u in eligible][:want]
+        rest = sorted((u for u in eligible if u not in keep),
+                      key=lambda u: (model not in _loaded_models.get(u, []), load[u]))
+        homes[model] = keep + rest[:want - len(keep)]
+        for u in homes[model]:
+            load[u] += n / len(homes[model])
+    _model_homes.clear()
+    _model_homes.update(homes)
+
+def _count_profile(model, now):
+    """Count a request in the hour-of-day profile. Caller holds backend_lock."""
+    global _profile_hour
+    hour = int(now // 3600)
+    if _profile_hour is not None and hour != _profile_hour:
+        # Fold finished hours into the profile; hours without requests count as zero
+        for h in range(max(_profile_hour, hour - 24), hour):
+            slot = time.localtime(h * 3600).tm_hour
+            for m in set(_demand_profile) | set(_profile_counts):
+                prof = _demand_profile.setdefault(m, [0.0] * 24)
+                n = _profile_counts.get(m, 0) if h == _profile_hour else 0
+                prof[slot] = round((1 - PROFILE_ALPHA) * prof[slot] + PROFILE_ALPHA * n, 3)
+        _profile_counts.clear()
+    _profile_hour = hour
+    _profile_counts[model] = _profile_counts.get(model, 0) + 1
+
+def _warm_loop():
+    """Ask backends to preload models whose profile predicts demand in the coming hour."""
+    while True:
+        time.sleep(WARM_INTERVAL)
+        slot = time.localtime(time.time() + WARM_LOOKAHEAD).tm_hour
+        targets = []
+        with backend_lock:
+            for model, prof in _demand_profile.items():
+                if prof[slot] < WARM_MIN:
+                    continue
+                homes = _model_homes.get(model) or sorted(
+                    (u for u in backend_status if _health_status.get(u) != 'unhealthy' and _fits(u, model)),
+                    key=lambda u: -(_status_cache[u]['data'] or {}).get('ram_available_gb', 0))[:1]
+                targets += [(u, model) for u in homes if model not in _loaded_models.get(u, [])]
+        for url, model in targets:
+            try:
+                resp = _backend_post(f"{url}/model-lifecycle", json={'model': model, 'action': 'preload'}, timeout=5)
+                ok = resp.ok
+            except Exception:
+                ok = False
+            with backend_lock:
+                _warm_stats['preloads' if ok else 'failed'] += 1
+                _warm_stats['last'] = time.time()
+
+def _ewma(entry, key, value):
+    entry[key] = value if entry.get(key) is None else (1 - SPEED_ALPHA) * entry[key] + SPEED_ALPHA * value
+
+def _is_loaded(url, model):
+    loaded = _loaded_models.get(url, [])
+    return model in loaded or _model_key(model) in loaded
+
+def _record_speed(url, model, task_type, result, warm=True):
+    """Learn tokens/sec from a backend result: prompt eval until the first token, generation
+    from the backend's gen_time for the final attempt (elapsed also covers retries, e.g.
+    /generate re-asking for valid YAML).
+
+    The time to first token includes loading the model when it was cold
+    (warm=False), so those results don't update the prompt rate. Neither does
+    a result with no prompt tokens, which Ollama reports when the whole
+    prompt was already cached."""
+    if result.get('error') or result.get('cloud_fallback'):
+        return
+    ttft, gen_time = result.get('ttft'), result.get('gen_time')
+    prompt_tokens, response_tokens = result.get('prompt_tokens') or 0, result.get('response_tokens') or 0
+    if not ttft or not gen_time or not response_tokens:
+        return
+    with backend_lock:
+        s = _speed.setdefault(model, {}).setdefault(url, {'samples': 0, 'prompt_tps': None, 'gen_tps': None})
+        if warm and prompt_tokens:
+            _ewma(s, 'prompt_tps', prompt_tokens / ttft)
+        _ewma(s, 'gen_tps', response_tokens / gen_time)
+        s['samples'] += 1
+        s['updated'] = time.time()
+        for key in ((model, task_type), (model, '*')):
+            shape = _shape.setdefault(key, {})
+            _ewma(shape, 'prompt_tokens', prompt_tokens)
+            _ewma(shape, 'response_tokens', response_tokens)
+
+def _service_time(url, model, task_type):
+    """Expected seconds to serve one request for model on url, or None without estimates.
+
+    A backend with no estimate for a rate yet is given the best estimate any
+    backend has, so it gets tried. Until some backend has both rates the
+    model has no estimate anywhere, so backends are never ranked on mixed
+    scales. Caller holds backend_lock."""
+    speeds = _speed.get(model)
+    if not speeds:
+        return None
+    s = speeds.get(url, {})
+    rates = []
+    for key in ('prompt_tps', 'gen_tps'):
+        rate = s.get(key) or max((v[key] or 0 for v in speeds.values()), default=0)
+        if not rate:
+            return None
+        rates.append(rate)
+    shape = _shape.get((model, task_type)) or _shape[(model, '*')]
+    return shape['prompt_tokens'] / rates[0] + shape['response_tokens'] / rates[1]
+
+def _predicted_seconds(url, model, task_type, queued):
+    """Predicted completion time of a new request: the queue ahead of it and itself, plus a cold load."""
+    service = _service_time(url, model, task_type)
+    if service is None:
+        return None
+    load = 0 if _is_loaded(url, model) else \
+        (_model_index.get(url, {}).get(_model_key(model)) or {}).get('size', 0) / 1e9 / LOAD_GB_PER_SEC
+    return (queued + 1) * service + load
+
+def _speed_summary(url):
+    """Learned speeds on one backend and the predicted time for a request now, per model."""
+    with backend_lock:
+        queued = backend_status[url]['queue_size'] / max(backend_status[url].get('slots', 1), 1)
+        out = {}
+        for model, speeds in _speed.items():
+            s = speeds.get(url)
+            if s is None:
+                continue
+            predicted = _predicted_seconds(url, model, '*', queued)
+            out[model] = {**{k: round(s[k], 1) if s[k] else None for k in ('prompt_tps', 'gen_tps')},
+                          'samples': s['samples'], 'updated': s['updated'],
+                          'predicted_seconds': round(predicted, 1) if predicted is not None else None}
+    return out
+
+def _affinity_summary():
+    now = time.time()
+    with backend_lock:
+        return {
+            'window': AFFINITY_WINDOW,
+            'penalty': AFFINITY_PENALTY,
+            'demand': {m: w.total(now)[0] for m, w in _model_demand.items()},
+            'homes': {m: list(urls) for m, urls in _model_homes.items()},
+            'warming': dict(_warm_stats, min_per_hour=WARM_MIN),
+            'demand_profile': {m: list(p) for m, p in _demand_profile.items()},
+        }
+
+def get_available_backend(requested_model='codellama:13b', wait=True, timeout=300, task_type='unknown', count=True):
     """Get backend with lowest weighted queue score that supports the requested model.
-    Among same-weight backends, prefer those with more free RAM and lower CPU usage."""
-    import time
+    Among same-weight backends, prefer those with more free RAM and lower CPU usage.
+    Scores come from the cached status snapshots; no backend is contacted here.
+    Retries and fallbacks for a request already counted pass count=False."""
     start_time = time.time()
     
-    while True:
-        # Poll backends WITHOUT holding the lock
-        polled = {}
-        for backend in BACKENDS:
-            url = backend['url']
-            data = get_backend_queue_size(url)
-            if data:
-                polled[url] = data
-
-        with backend_lock:
-            # Update status from polled data
-            for backend in BACKENDS:
-                url = backend['url']
-                if url in polled:
-                    data = polled[url]
-                    backend_status[url]['queue_size'] = data.get('queue_size', 999)
-                    backend_status[url]['cpu_percent'] = data.get('cpu_percent', 50)
-                    backend_status[url]['ram_available_gb'] = data.get('ram_available_gb', 0)
-                    backend_status[url]['ram_total_gb'] = data.get('ram_total_gb', 16)
-                    backend_status[url]['cpu_arch'] = data.get('cpu_arch', 'x86_64')
-                    backend_status[url]['cpu_count'] = data.get('cpu_count', 4)
-                    backend_status[url]['cpu_freq_mhz'] = data.get('cpu_freq_mhz', 2000)
-                    _loaded_models[url] = data.get('loaded_models', _loaded_models.get(url, []))
-                else:
-                    backend_status[url]['queue_size'] = 999
-            
+    with backend_lock:
+        if count and requested_model != 'none':
+            _count_profile(requested_model, start_time)
+        if count and AFFINITY_PENALTY and requested_model != 'none':
+            window = _model_demand.get(requested_model)
+            if window is None:
+                window = _model_demand[requested_model] = SlidingWindow(AFFINITY_WINDOW, 60)
+            window.add(start_time, 1)
+            if requested_model not in _model_homes or start_time - _affinity_rebalanced >= AFFINITY_REBALANCE:
+                _rebalance_affinity(start_time)
+        homes = _model_homes.get(requested_model) if AFFINITY_PENALTY else None
+        while True:
+            now = time.time()
             # Filter backends that support the requested model
-            requested_size = MODEL_SIZES.get(requested_model, 2)
             available = []
             for url in backend_status.keys():
-                if backend_status[url]['available']:
+                if backend_status[url]['inflight'] < backend_status[url].get('slots', 1):
                     # Skip unhealthy backends
                     if _health_status.get(url) == 'unhealthy':
                         continue
@@ -385,10 +909,12 @@ def get_available_backend(requested_model='codellama:13b', wait=True, timeout=30
                     tasks = backend_status[url].get('tasks', ['all'])
                     if 'all' not in tasks and task_type not in tasks:
                         continue
-                    max_model = backend_status[url]['max_model']
-                    max_size = MODEL_SIZES.get(max_model, 4)
-                    if requested_model == 'none' or requested_size <= max_size:
-                        qs = backend_status[url]['queue_size']
+                    if _fits(url, requested_model):
+                        # Queue depth per worker slot, so multi-slot backends absorb more work
+                        queue_size = backend_status[url]['queue_size']
+                        if now - _status_cache[url]['updated'] > STATUS_MAX_AGE:
+                            queue_size = 999  # no fresh snapshot: last resort only
+                        qs = queue_size / max(backend_status[url].get('slots', 1), 1)
                         w = backend_status[url]['weight']
                         cpu = backend_status[url].get('cpu_percent', 50)
                         ram = backend_status[url].get('ram_available_gb', 0)
@@ -401,43 +927,133 @@ def get_available_backend(requested_model='codellama:13b', wait=True, timeout=30
                         arch = backend_status[url].get('cpu_arch', 'x86_64')
                         freq = backend_status[url].get('cpu_freq_mhz', 2000)
                         arch_multiplier = 3.0 if arch == 'arm64' else 1.0
-                        score = qs - (w * 0.1) + (cpu / 100.0) - (ram_total / 128.0) * arch_multiplier - (freq / 5000.0)
-                        # Big bonus if model is already loaded in memory (avoids cold start)
-                        if requested_model in _loaded_models.get(url, []):
-                            score -= 5.0
+                        predicted = _predicted_seconds(url, requested_model, task_type, qs)
+                        if predicted is not None:
+                            # Learned speeds: predicted seconds to completion, weight breaks ties,
+                            # and being off-home costs AFFINITY_PENALTY requests' worth of service
+                            score = predicted - w * 0.01
+                            if homes and url not in homes:
+                                score += AFFINITY_PENALTY * _service_time(url, requested_model, task_type)
+                        else:
+                            score = qs - (w * 0.1) + (cpu / 100.0) - (ram_total / 128.0) * arch_multiplier - (freq / 5000.0)
+                            # Big bonus if model is already loaded in memory (avoids cold start)
+                            if requested_model in _loaded_models.get(url, []):
+                                score -= 5.0
+                            # Off-home backends only take a model's overflow
+                            if homes and url not in homes:
+                                score += AFFINITY_PENALTY
                         available.append((url, score))
             
             if available:
                 best_backend = min(available, key=lambda x: x[1])[0]
-                backend_status[best_backend]['available'] = False
+                backend_status[best_backend]['inflight'] += 1
                 return best_backend
         
-        # If no backend available and not waiting, return None
-        if not wait:
-            return None
+            # If no backend available and not waiting, return None
+            if not wait:
+                return None
         
-        # Check timeout
-        if time.time() - start_time > timeout:
-            return None
+            # Check timeout
+            if now - start_time > timeout:
+                return None
         
-        # Wait a bit before retrying
-        time.sleep(0.5)
+            # Wait for a slot to be released or a new snapshot
+            _backend_changed.wait(timeout=0.5)
 
 def release_backend(url):
-    """Mark backend as available"""
+    """Free one in-flight slot on a backend"""
     with backend_lock:
-        backend_status[url]['available'] = True
+        backend_status[url]['inflight'] = max(0, backend_status[url]['inflight'] - 1)
+        _backend_changed.notify_all()
 
-# Prompt cache: {hash: {'result': {...}, 'time': timestamp}}
-_prompt_cache = {}
+for _b in BACKENDS:
+    Thread(target=_status_poll_loop, args=(_b['url'],), daemon=True).start()
+Thread(target=_model_index_loop, daemon=True).start()
+if WARM_MIN > 0:
+    Thread(target=_warm_loop, daemon=True).start()
+
+# Prompt cache: LRU keyed by _cache_key, bounded by entries and total result bytes
 CACHE_TTL = int(os.environ.get('SHELLAMA_CACHE_TTL', '300'))  # 5 min default, 0 = disabled
-CACHE_MAX = 500  # max entries
+CACHE_MAX = int(os.environ.get('SHELLAMA_CACHE_MAX', '500'))  # max entries
+CACHE_MAX_MB = float(os.environ.get('SHELLAMA_CACHE_MAX_MB', '64'))
+_prompt_cache = PromptCache(CACHE_TTL, CACHE_MAX, int(CACHE_MAX_MB * 1024 * 1024))
+# Optional on-disk tier shared across restarts (and frontends using the same file)
+DISK_CACHE = os.environ.get('SHELLAMA_DISK_CACHE', '')  # SQLite path, empty = disabled
+DISK_CACHE_TTL = int(os.environ.get('SHELLAMA_DISK_CACHE_TTL', '86400'))
+DISK_CACHE_MAX_MB = float(os.environ.get('SHELLAMA_DISK_CACHE_MAX_MB', '512'))
+_disk_cache = None
+if DISK_CACHE and DISK_CACHE_TTL > 0:
+    try:
+        _disk_cache = DiskCache(DISK_CACHE, DISK_CACHE_TTL, int(DISK_CACHE_MAX_MB * 1024 * 1024))
+    except Exception as e:
+        print(f"Disk cache disabled: {e}", file=sys.stderr)
+
+# Optional semantic tier: near-duplicate prompts (by embedding similarity) reuse an answer.
+# Only task types listed in SHELLAMA_SEMANTIC_THRESHOLDS are eligible, each with its own cutoff.
+SEMANTIC_CACHE = os.environ.get('SHELLAMA_SEMANTIC_CACHE', 'false').lower() == 'true'
+EMBED_MODEL = os.environ.get('SHELLAMA_EMBED_MODEL', 'nomic-embed-text')
+SEMANTIC_THRESHOLDS = {k.strip(): float(v) for k, v in
+                       (kv.split('=', 1) for kv in os.environ.get('SHELLAMA_SEMANTIC_THRESHOLDS', 'chat=0.95,generate-code=0.95').split(',') if '=' in kv)}
+_semantic_cache = SemanticCache(DISK_CACHE_TTL if _disk_cache is not None else max(CACHE_TTL, 300)) if SEMANTIC_CACHE else None
+
+def _embed(text):
+    """Embedding of text from a healthy backend (preferring one with the model loaded), or None."""
+    urls = [b['url'] for b in BACKENDS if _status_snapshot(b['url']) is not None and _health_status.get(b['url']) != 'unhealthy']
+    urls.sort(key=lambda u: EMBED_MODEL not in ' '.join(_loaded_models.get(u, [])))
+    for url in urls[:2]:
+        try:
+            vec = _backend_post(f"{url}/embed", json={'model': EMBED_MODEL, 'input': text[:8000]}, timeout=10).json().get('embedding')
+            if vec:
+                return vec
+        except Exception:
+            continue
+    return None
+
+def _semantic_get(ck, endpoint, data, task_type):
+    """Semantic tier lookup for eligible task types. Returns a result copy or None."""
+    threshold = SEMANTIC_THRESHOLDS.get(task_type)
+    if _semantic_cache is None or threshold is None:
+        return None
+    content = data.get('message', '') or data.get('description', '')
+    vec = _embed(content) if content else None
+    if vec is None:
+        return None
+    result, similarity = _semantic_cache.lookup(ck, (endpoint, data.get('model', '')), vec, threshold)
+    if result is not None:
+        result['semantic_similarity'] = similarity
+    return result
+
+def _cache_get(ck):
+    """Look up the memory tier, then the disk tier (promoting disk hits to memory).
+
+    Promotion writes the memory tier only: rewriting the disk row would reset
+    its stored time, so an entry that keeps getting hit would never expire."""
+    result = _prompt_cache.get(ck) if CACHE_TTL > 0 else None
+    if result is None and _disk_cache is not None:
+        result = _disk_cache.get(ck)
+        if result is not None and CACHE_TTL > 0:
+            _prompt_cache.put(ck, dict(result))
+    return result
+
+def _cache_put(ck, result):
+    """Store a fresh backend result in every enabled tier."""
+    if CACHE_TTL > 0:
+        _prompt_cache.put(ck, result)
+    if _semantic_cache is not None:
+        _semantic_cache.put(ck, result)
+    if _disk_cache is not None:
+        _disk_cache.put(ck, result)
+
+# Recent time-to-first-token samples (seconds)
+_ttft_samples = deque(maxlen=1000)
+_ttft_lock = Lock()
 
 # Audit log: optional request logging
 AUDIT_LOG = os.environ.get('SHELLAMA_AUDIT_LOG', '')  # path to log file, empty = disabled
 AUDIT_MAX_ENTRIES = 10000  # max in-memory entries for web view
-_audit_entries = []
-_audit_lock = Lock()
+AUDIT_MAX_MB = float(os.environ.get('SHELLAMA_AUDIT_MAX_MB', 100))  # rotate the file past this size
+AUDIT_ROTATE_HOURS = float(os.environ.get('SHELLAMA_AUDIT_ROTATE_HOURS', 24))  # ...or this age
+_audit_log = AuditLog(AUDIT_LOG or None, AUDIT_MAX_ENTRIES, int(AUDIT_MAX_MB * 1024 * 1024), AUDIT_ROTATE_HOURS * 3600)
 
 def _audit(client_ip, key_name, endpoint, model, prompt_preview, tokens, elapsed, cached=False, fallback=False):
     """Record an audit log entry."""
@@ -456,16 +1072,7 @@ def _audit(client_ip, key_name, endpoint, model, prompt_preview, tokens, elapsed
         'cached': cached,
         'fallback': fallback,
     }
-    with _audit_lock:
-        _audit_entries.append(entry)
-        if len(_audit_entries) > AUDIT_MAX_ENTRIES:
-            _audit_entries.pop(0)
-    if AUDIT_LOG:
-        try:
-            with open(AUDIT_LOG, 'a') as f:
-                f.write(json.dumps(entry) + '\n')
-        except Exception:
-            pass
+    _audit_log.record(entry)
 
 def _cache_key(endpoint, data):
     """Generate cache key from endpoint + model + content."""
@@ -485,38 +1092,137 @@ def _cache_key(endpoint, data):
     raw = f"{endpoint}:{model}:{content}"
     return hashlib.sha256(raw.encode()).hexdigest()[:16]
 
-def proxy_request(endpoint, data, client_ip=None, task_type='unknown'):
+# In-flight backend calls keyed by (API key id, client's task_id), so /cancel can reach
+# them and clients using the same task_id under different keys never share an entry
+_inflight = {}  # {(owner, task_id): {'cancelled': bool, 'calls': {backend_task_id: url}, 'updated': ts}}
+_inflight_lock = Lock()
+INFLIGHT_MAX_AGE = 3600
+
+def _client_task_id():
+    """(key id, task_id) for the task_id supplied by the client of the current request, if any."""
+    if not has_request_context() or not request.is_json:
+        return None
+    task_id = (request.get_json(silent=True) or {}).get('task_id')
+    return (get_key_id(), str(task_id)) if task_id else None
+
+def _start_call(client_task_id, backend, data):
+    """Give a backend call its own task_id, registered under the client's.
+    Returns False if the client already cancelled the task."""
+    if not client_task_id:
+        return True
+    data['task_id'] = str(uuid.uuid4())
+    now = time.time()
+    with _inflight_lock:
+        for k in [k for k, v in _inflight.items() if not v['calls'] and now - v['updated'] > INFLIGHT_MAX_AGE]:
+            del _inflight[k]
+        entry = _inflight.setdefault(client_task_id, {'cancelled': False, 'calls': {}, 'updated': now})
+        entry['updated'] = now
+        if entry['cancelled']:
+            return False
+        entry['calls'][data['task_id']] = backend
+    return True
+
+def _end_call(client_task_id, data):
+    if not client_task_id:
+        return
+    with _inflight_lock:
+        entry = _inflight.get(client_task_id)
+        if entry:
+            entry['calls'].pop(data.get('task_id'), None)
+
+def _record_result(endpoint, data, result, client_ip, task_type, ck):
+    """Bookkeeping for a completed backend result: usage, rate limits, audit, cache."""
+    # Record tokens for this client IP
+    if client_ip:
+        record_ip_tokens(client_ip, result.get('total_tokens', 0), task_type,
+                       prompt_tokens=result.get('prompt_tokens', 0),
+                       response_tokens=result.get('response_tokens', 0),
+                       cloud_fallback=result.get('cloud_fallback', False),
+                       key_name=get_key_name())
+    # Record tokens for rate limiting
+    rate_key = getattr(request, '_shellama_key', None)
+    if rate_key:
+        record_rate_tokens(rate_key, result.get('total_tokens', 0),
+                          prompt_tokens=result.get('prompt_tokens', 0),
+                          response_tokens=result.get('response_tokens', 0),
+                          cloud_fallback=result.get('cloud_fallback', False))
+
+    # Time to first token, the headline latency metric for streaming clients
+    if result.get('ttft') is not None:
+        with _ttft_lock:
+            _ttft_samples.append(result['ttft'])
+
+    # Audit log
+    prompt_preview = data.get('message', '') or data.get('commands', '') or data.get('description', '') or data.get('code', '') or data.get('playbook', '')
+    _audit(client_ip, get_key_name(), endpoint, data.get('model', ''),
+           prompt_preview, result.get('total_tokens', 0), result.get('elapsed', 0),
+           fallback=result.get('cloud_fallback', False))
+
+    # Store in the prompt cache tiers
+    if ck and not result.get('error') and not result.get('cloud_fallback'):
+        _cache_put(ck, result)
+
+def _ttft_summary():
+    """p50/p95 time-to-first-token over recent requests."""
+    with _ttft_lock:
+        samples = sorted(_ttft_samples)
+    if not samples:
+        return {'samples': 0, 'p50': None, 'p95': None}
+    return {
+        'samples': len(samples),
+        'p50': samples[len(samples) // 2],
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+# Task types the backend should schedule behind interactive work
+BATCH_TASK_TYPES = {'analyze', 'test'}
+
+def _set_priority(data, task_type):
+    """Tag a backend request with its fair-share client and priority class."""
+    if has_request_context() and get_key_name() not in ('anonymous', 'unknown'):
+        data['client_user'] = get_key_name()
+    if task_type in BATCH_TASK_TYPES:
+        data['priority'] = 'batch'
+
+def _cache_lookup(endpoint, data, client_ip, task_type):
+    """Return (cache key, cached result or None), recording usage and audit on a hit."""
+    ck = _cache_key(endpoint, data) if CACHE_TTL > 0 or _disk_cache is not None or _semantic_cache is not None else None
+    result = _cache_get(ck) if ck else None
+    if result is None and ck:
+        result = _semantic_get(ck, endpoint, data, task_type)
+    if result is None:
+        return ck, None
+    result['cached'] = True
+    if client_ip:
+        record_ip_tokens(client_ip, result.get('total_tokens', 0), task_type,
+                       prompt_tokens=result.get('prompt_tokens', 0),
+                       response_tokens=result.get('response_tokens', 0),
+                       key_name=get_key_name(), cached=True)
+    prompt_preview = data.get('message', '') or data.get('commands', '') or data.get('description', '') or data.get('code', '') or ''
+    _audit(client_ip, get_key_name(), endpoint, data.get('model', ''),
+           prompt_preview, result.get('total_tokens', 0), 0, cached=True)
+    return ck, result
+
+def proxy_request(endpoint, data, client_ip=None, task_type='unknown', client_task_id=None):
     """Send request to available backend with keepalive"""
+    client_task_id = client_task_id or _client_task_id()
     prompt_text = data.get('message', '') or data.get('commands', '') or data.get('description', '') or data.get('code', '') or data.get('playbook', '')
     model = resolve_model(data.get('model', 'codellama:13b'), prompt_text)
     data['model'] = model  # pass resolved name to backend
 
     # Check prompt cache
-    ck = _cache_key(endpoint, data) if CACHE_TTL > 0 else None
-    if ck and ck in _prompt_cache:
-        entry = _prompt_cache[ck]
-        if time.time() - entry['time'] < CACHE_TTL:
-            result = dict(entry['result'])
-            result['cached'] = True
-            if client_ip:
-                record_ip_tokens(client_ip, result.get('total_tokens', 0), task_type,
-                               prompt_tokens=result.get('prompt_tokens', 0),
-                               response_tokens=result.get('response_tokens', 0),
-                               key_name=get_key_name(), cached=True)
-            prompt_preview = data.get('message', '') or data.get('commands', '') or data.get('description', '') or data.get('code', '') or ''
-            _audit(client_ip, get_key_name(), endpoint, data.get('model', ''),
-                   prompt_preview, result.get('total_tokens', 0), 0, cached=True)
-            return result, 200
-        else:
-            del _prompt_cache[ck]
+    ck, result = _cache_lookup(endpoint, data, client_ip, task_type)
+    if result is not None:
+        return result, 200
 
     backend = get_available_backend(model, task_type=task_type)
     if not backend:
         return {'error': f'No backends available that support model {model}. Check backends.json configuration.'}, 200
     
-    # Forward client info to backend for tracking
+    # Forward client info to backend for tracking and fair-share scheduling
     if client_ip:
         data['client_ip'] = client_ip
+    _set_priority(data, task_type)
     
     max_retries = 2
     tried = set()
@@ -528,12 +1234,10 @@ def proxy_request(endpoint, data, client_ip=None, task_type='unknown'):
         tried.add(backend)
 
         try:
-            session = requests.Session()
-            session.headers.update({'Connection': 'keep-alive'})
-            if BACKEND_TLS:
-                session.cert = BACKEND_TLS
-                session.verify = BACKEND_VERIFY
-            
+            if not _start_call(client_task_id, backend, data):
+                return {'error': 'Task cancelled'}, 200
+            warm = _is_loaded(backend, model)
+            session = _backend_pool(backend)
             response = session.post(
                 f"{backend}{endpoint}", 
                 json=data, 
@@ -546,48 +1250,25 @@ def proxy_request(endpoint, data, client_ip=None, task_type='unknown'):
             if result.get('error') and 'result was lost' in result.get('error', ''):
                 last_error = f"Backend {backend} lost task result"
                 release_backend(backend)
-                backend = get_available_backend(model, task_type=task_type)
+                backend = get_available_backend(model, task_type=task_type, count=False)
                 continue
             
             # Auto-fallback: if backend suggests fallback and auto mode is on, retry with force_cloud
             if result.get('fallback_available') and persisted_totals.get('auto_fallback', False):
                 data['force_cloud'] = True
                 release_backend(backend)
-                backend2 = get_available_backend(model, task_type=task_type)
+                backend2 = get_available_backend(model, task_type=task_type, count=False)
                 if backend2:
                     try:
-                        resp2 = session.post(f"{backend2}{endpoint}", json=data, timeout=3600, stream=False)
-                        result = resp2.json()
+                        _end_call(client_task_id, data)
+                        if _start_call(client_task_id, backend2, data):
+                            resp2 = _backend_pool(backend2).post(f"{backend2}{endpoint}", json=data, timeout=3600, stream=False)
+                            result = resp2.json()
                     finally:
                         release_backend(backend2)
         
-            # Record tokens for this client IP
-            if client_ip:
-                record_ip_tokens(client_ip, result.get('total_tokens', 0), task_type,
-                               prompt_tokens=result.get('prompt_tokens', 0),
-                               response_tokens=result.get('response_tokens', 0),
-                               cloud_fallback=result.get('cloud_fallback', False),
-                               key_name=get_key_name())
-            # Record tokens for rate limiting
-            rate_key = getattr(request, '_shellama_key', None)
-            if rate_key:
-                record_rate_tokens(rate_key, result.get('total_tokens', 0),
-                                  prompt_tokens=result.get('prompt_tokens', 0),
-                                  response_tokens=result.get('response_tokens', 0),
-                                  cloud_fallback=result.get('cloud_fallback', False))
-
-            # Audit log
-            prompt_preview = data.get('message', '') or data.get('commands', '') or data.get('description', '') or data.get('code', '') or data.get('playbook', '')
-            _audit(client_ip, get_key_name(), endpoint, data.get('model', ''),
-                   prompt_preview, result.get('total_tokens', 0), result.get('elapsed', 0),
-                   fallback=result.get('cloud_fallback', False))
-            
-            # Store in prompt cache
-            if ck and not result.get('error') and not result.get('cloud_fallback'):
-                if len(_prompt_cache) >= CACHE_MAX:
-                    oldest = min(_prompt_cache, key=lambda k: _prompt_cache[k]['time'])
-                    del _prompt_cache[oldest]
-                _prompt_cache[ck] = {'result': result, 'time': time.time()}
+            _record_result(endpoint, data, result, client_ip, task_type, ck)
+            _record_speed(backend, model, task_type, result, warm)
 
             if attempt > 0:
                 result['retried'] = attempt
@@ -600,12 +1281,102 @@ def proxy_request(endpoint, data, client_ip=None, task_type='unknown'):
             last_error = f'Backend {backend}: {str(e)}'
             _health_failures[backend] = _health_failures.get(backend, 0) + 1
         finally:
+            _end_call(client_task_id, data)
             release_backend(backend)
 
-        backend = get_available_backend(model, task_type=task_type)
+        backend = get_available_backend(model, task_type=task_type, count=False)
 
     return {'error': f'All backends failed. Last error: {last_error}'}, 500
 
+# Result keys holding the generated text, per backend endpoint
+RESULT_KEYS = {'/chat': 'response', '/generate': 'playbook', '/explain': 'explanation',
+               '/generate-code': 'code', '/explain-code': 'explanation', '/analyze': 'analysis'}
+
+def _sse(event):
+    """Format one server-sent event."""
+    return f"data: {json.dumps(event)}\n\n"
+
+def proxy_stream(endpoint, data, client_ip=None, task_type='unknown', on_done=None):
+    """Stream a request through an available backend, yielding event dicts.
+
+    Yields {'token': ...} events as the backend produces them and finally the
+    full result with done=True. Retries on another backend only if the
+    connection fails before any event was received."""
+    prompt_text = data.get('message', '') or data.get('commands', '') or data.get('description', '') or data.get('code', '') or data.get('playbook', '')
+    model = resolve_model(data.get('model', 'codellama:13b'), prompt_text)
+    data['model'] = model
+    data['stream'] = True
+    client_task_id = _client_task_id()
+
+    # Cache hit: replay the stored answer as a single token
+    ck, result = _cache_lookup(endpoint, data, client_ip, task_type)
+    if result is not None:
+        yield {'token': result.get(RESULT_KEYS.get(endpoint, 'response'), '')}
+        result['done'] = True
+        if on_done:
+            on_done(result)
+        yield result
+        return
+
+    if client_ip:
+        data['client_ip'] = client_ip
+    _set_priority(data, task_type)
+
+    last_error = None
+    tried = set()
+    for attempt in range(3):
+        backend = get_available_backend(model, task_type=task_type, count=attempt == 0)
+        if not backend or backend in tried:
+            if backend:
+                release_backend(backend)
+            break
+        tried.add(backend)
+        received = False
+        resp = None
+        try:
+            if not _start_call(client_task_id, backend, data):
+                yield {'error': 'Task cancelled', 'done': True}
+                return
+            warm = _is_loaded(backend, model)
+            resp = _backend_pool(backend).post(f"{backend}{endpoint}", json=data, timeout=(10, 3600), stream=True)
+            result = None
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data: '):
+                    continue
+                ev = json.loads(line[6:])
+                received = True
+                if ev.get('done'):
+                    result = ev
+                    break
+                yield ev
+            if result is None:
+                result = {'error': f'Backend {backend} closed the stream without a result', 'done': True}
+            _record_result(endpoint, data, result, client_ip, task_type, ck)
+            _record_speed(backend, model, task_type, result, warm)
+            if on_done:
+                on_done(result)
+            yield result
+            return
+        except Exception as e:
+            last_error = f'Backend {backend}: {str(e)}'
+            _health_failures[backend] = _health_failures.get(backend, 0) + 1
+            if received:
+                yield {'error': last_error, 'done': True}
+                return
+        finally:
+            if resp is not None:
+                resp.close()
+            _end_call(client_task_id, data)
+            release_backend(backend)
+
+    yield {'error': f'All backends failed. Last error: {last_error}' if last_error else
+           f'No backends available that support model {model}. Check backends.json configuration.', 'done': True}
+
+def stream_response(events):
+    """Wrap an event generator as a text/event-stream response."""
+    return Response(stream_with_context(_sse(ev) for ev in events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 def split_and_process(commands, model, chunk_size=10):
     """Split commands into chunks and process in parallel"""
     lines = commands.strip().split('\n')
@@ -682,12 +1453,8 @@ def queue_status():
         url = backend['url']
         weight = backend['weight']
         max_model = backend.get('max_model', 'codellama:70b')
-        try:
-            resp = _backend_get(
-                f"{url}/queue-status", 
-                timeout=2
-            )
-            data = resp.json()
+        data = _status_snapshot(url)
+        if data is not None:
             queue_size = data.get('queue_size', 0)
             total_queue += queue_size
             is_active = data.get('active', False)
@@ -710,6 +1477,10 @@ def queue_status():
                 'active_client': data.get('active_client', ''),
                 'active_agent': data.get('active_agent', ''),
                 'active_summary': data.get('active_summary', ''),
+                'active_tasks': data.get('active_tasks', []),
+                'slots': data.get('slots', 1),
+                'slots_busy': data.get('slots_busy', 1 if is_active else 0),
+                'scheduler': data.get('scheduler', {}),
                 'backend_tokens': data.get('total_tokens', 0),
                 'backend_requests': data.get('total_requests', 0),
                 'cpu_percent': cpu_pct,
@@ -717,9 +1488,17 @@ def queue_status():
                 'ram_total_gb': ram_total,
                 'cpu_arch': data.get('cpu_arch', 'x86_64'),
                 'cpu_count': data.get('cpu_count', 0),
-                'cpu_freq_mhz': data.get('cpu_freq_mhz', 0)
+                'cpu_freq_mhz': data.get('cpu_freq_mhz', 0),
+                'status_age': round(time.time() - _status_cache[url]['updated'], 1),
+                'status_latency': _status_cache[url]['latency'],
+                'loaded_models': _loaded_models.get(url, []),
+                'home_models': sorted(m for m, homes in _model_homes.items() if url in homes),
+                'runnable_models': sorted(m for m in _model_index.get(url, {}) if _fits(url, m)),
+                'speed': _speed_summary(url),
+                'model_loads': _model_swaps.get(url, {}).get('loads', 0),
+                'model_unloads': _model_swaps.get(url, {}).get('unloads', 0),
             })
-        except:
+        else:
             backends_info.append({
                 'url': url,
                 'weight': weight,
@@ -739,44 +1518,6 @@ def queue_status():
                 'cpu_freq_mhz': 0
             })
     
-    # Record per-backend token/request deltas and queue history
-    now = time.time()
-    with ip_token_lock:
-        for b in backends_info:
-            url = b['url']
-            # Token deltas — detect backend restart (current < previous)
-            cur_tokens = b.get('backend_tokens', 0)
-            prev_tokens = last_backend_tokens.get(url, 0)
-            if cur_tokens < prev_tokens:
-                # Backend restarted, treat entire current value as new
-                delta_tokens = cur_tokens
-            else:
-                delta_tokens = cur_tokens - prev_tokens
-            last_backend_tokens[url] = cur_tokens
-            if delta_tokens > 0:
-                persisted_totals['tokens'] += delta_tokens
-                if url not in backend_token_history:
-                    backend_token_history[url] = []
-                backend_token_history[url].append({'timestamp': now, 'tokens': delta_tokens})
-                if len(backend_token_history[url]) > IP_HISTORY_MAX:
-                    backend_token_history[url] = backend_token_history[url][-IP_HISTORY_MAX:]
-            # Request deltas
-            cur_reqs = b.get('backend_requests', 0)
-            prev_reqs = last_backend_requests.get(url, 0)
-            if cur_reqs < prev_reqs:
-                delta_reqs = cur_reqs
-            else:
-                delta_reqs = cur_reqs - prev_reqs
-            last_backend_requests[url] = cur_reqs
-            if delta_reqs > 0:
-                persisted_totals['requests'] += delta_reqs
-            # Queue history
-            if url not in queue_history:
-                queue_history[url] = []
-            queue_history[url].append({'timestamp': now, 'queue_size': b.get('queue_size', 0)})
-            if len(queue_history[url]) > QUEUE_HISTORY_MAX:
-                queue_history[url] = queue_history[url][-QUEUE_HISTORY_MAX:]
-
     return jsonify({
         'queue_size': total_queue,
         'active': active_count > 0,
@@ -787,7 +1528,10 @@ def queue_status():
         'backends': backends_info,
         'timestamp': time.time(),
         'auto_fallback': persisted_totals.get('auto_fallback', False),
-        'model_aliases': MODEL_ALIASES
+        'model_aliases': MODEL_ALIASES,
+        'ttft': _ttft_summary(),
+        'history_store': _history.stats(),
+        'affinity': _affinity_summary(),
     })
 
 @app.route('/stop-all', methods=['POST'])
@@ -795,28 +1539,60 @@ def queue_status():
 def stop_all():
     """Stop processing on all backends"""
     results = {}
-    for backend in BACKENDS:
-        url = backend['url']
-        try:
-            resp = _backend_post(f"{url}/stop", timeout=10)
-            results[url] = resp.json()
-        except Exception as e:
-            results[url] = {'error': str(e)}
+    for url, r in fan_out('/stop', method='POST', timeout=10).items():
+        results[url] = dict(r['data'], latency=r['latency']) if r['ok'] else {'error': r['error']}
     return jsonify(results)
 
 @app.route('/stop-backend', methods=['POST'])
 @require_admin
 def stop_backend():
-    """Stop processing on a specific backend"""
+    """Stop processing on a specific backend. With task_id, cancel only that backend task
+    (via the backend's /cancel/<task_id>); other tasks and the queue are left alone."""
     url = request.json.get('url', '')
     if not url:
         return jsonify({'error': 'No backend URL provided'}), 400
+    task_id = request.json.get('task_id')
     try:
-        resp = _backend_post(f"{url}/stop", timeout=10)
+        if task_id:
+            resp = _backend_post(f"{url}/cancel/{task_id}", timeout=10)
+            return jsonify(resp.json()), resp.status_code
+        resp = _backend_post(f"{url}/stop", json={}, timeout=10)
         return jsonify(resp.json())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cancel/<task_id>', methods=['POST'])
+@require_auth
+def cancel_task(task_id):
+    """Cancel one client task (by the task_id it sent) on whichever backends run it.
+    Only the API key that started the task, or an admin key, may cancel it.
+    Unlike /stop-all, this leaves other tasks and the loaded models alone."""
+    owner = get_key_id()
+    key_info = getattr(request, '_shellama_key_info', None)
+    admin = not auth_enabled() or (key_info is not None and key_info.role == 'admin')
+    with _inflight_lock:
+        keys = [k for k in _inflight if k[1] == task_id]
+        if not keys:
+            return jsonify({'error': f'Unknown task_id {task_id}'}), 404
+        if not admin:
+            keys = [k for k in keys if k[0] == owner]
+            if not keys:
+                return jsonify({'error': f'Task {task_id} belongs to another API key'}), 403
+        calls = {}
+        for k in keys:
+            entry = _inflight[k]
+            entry['cancelled'] = True
+            entry['updated'] = time.time()
+            calls.update(entry['calls'])
+    results = {}
+    for backend_task_id, url in calls.items():
+        try:
+            resp = _backend_post(f"{url}/cancel/{backend_task_id}", timeout=5)
+            results[url] = resp.json()
+        except Exception as e:
+            results[url] = {'error': str(e)}
+    return jsonify({'task_id': task_id, 'cancelled': bool(calls), 'backends': results})
+
 @app.route('/generate', methods=['POST'])
 @require_auth
 def generate():
@@ -827,6 +1603,8 @@ def generate():
     
     if split:
         result, status = split_and_process(commands, model)
+    elif request.json.get('stream'):
+        return stream_response(proxy_stream('/generate', {'commands': commands, 'model': model}, client_ip, 'shell2ansible'))
     else:
         result, status = proxy_request('/generate', {'commands': commands, 'model': model}, client_ip, 'shell2ansible')
     
@@ -837,6 +1615,8 @@ def generate():
 def explain():
     playbook = request.json.get('playbook', '')
     model = request.json.get('model', 'codellama:13b')
+    if request.json.get('stream'):
+        return stream_response(proxy_stream('/explain', {'playbook': playbook, 'model': model}, request.remote_addr, 'explain'))
     result, status = proxy_request('/explain', {'playbook': playbook, 'model': model}, request.remote_addr, 'explain')
     return jsonify(result), status
 
@@ -845,6 +1625,8 @@ def explain():
 def generate_code_endpoint():
     description = request.json.get('description', '')
     model = request.json.get('model', 'codellama:13b')
+    if request.json.get('stream'):
+        return stream_response(proxy_stream('/generate-code', {'description': description, 'model': model}, request.remote_addr, 'generate-code'))
     result, status = proxy_request('/generate-code', {'description': description, 'model': model}, request.remote_addr, 'generate-code')
     return jsonify(result), status
 
@@ -853,6 +1635,8 @@ def generate_code_endpoint():
 def explain_code_endpoint():
     code = request.json.get('code', '')
     model = request.json.get('model', 'codellama:13b')
+    if request.json.get('stream'):
+        return stream_response(proxy_stream('/explain-code', {'code': code, 'model': model}, request.remote_addr, 'explain-code'))
     result, status = proxy_request('/explain-code', {'code': code, 'model': model}, request.remote_addr, 'explain-code')
     return jsonify(result), status
 
@@ -888,18 +1672,23 @@ def chat_endpoint():
     if messages:
         payload['messages'] = messages
 
-    result, status = proxy_request('/chat', payload, request.remote_addr, 'chat')
+    def remember(result):
+        """Store conversation if conv_id provided."""
+        if conv_id and not result.get('error'):
+            if conv_id not in conversations:
+                conversations[conv_id] = {'messages': [], 'model': model, 'updated': now}
+                if system_prompt:
+                    conversations[conv_id]['messages'].append({'role': 'system', 'content': system_prompt})
+            conversations[conv_id]['messages'].append({'role': 'user', 'content': message})
+            conversations[conv_id]['messages'].append({'role': 'assistant', 'content': result.get('response', '')})
+            conversations[conv_id]['updated'] = now
+            result['conversation_id'] = conv_id
+
+    if request.json.get('stream'):
+        return stream_response(proxy_stream('/chat', payload, request.remote_addr, 'chat', on_done=remember))
 
-    # Store conversation if conv_id provided
-    if conv_id and not result.get('error'):
-        if conv_id not in conversations:
-            conversations[conv_id] = {'messages': [], 'model': model, 'updated': now}
-            if system_prompt:
-                conversations[conv_id]['messages'].append({'role': 'system', 'content': system_prompt})
-        conversations[conv_id]['messages'].append({'role': 'user', 'content': message})
-        conversations[conv_id]['messages'].append({'role': 'assistant', 'content': result.get('response', '')})
-        conversations[conv_id]['updated'] = now
-        result['conversation_id'] = conv_id
+    result, status = proxy_request('/chat', payload, request.remote_addr, 'chat')
+    remember(result)
 
     return jsonify(result), status
 
@@ -909,16 +1698,12 @@ def analyze_endpoint():
     files = request.json.get('files', [])
     model = request.json.get('model', 'codellama:13b')
     client_ip = request.remote_addr
+    client_task_id = _client_task_id()
     
     # If we have multiple files, check if we should process in parallel or sequential
     if len(files) > 1:
-        # Count available backends that support this model
-        requested_size = MODEL_SIZES.get(model, 2)
-        available_backends = 0
-        for backend in BACKENDS:
-            max_size = MODEL_SIZES.get(backend.get('max_model', 'codellama:70b'), 4)
-            if requested_size <= max_size:
-                available_backends += 1
+        # Count available backends that can run this model
+        available_backends = sum(1 for backend in BACKENDS if _fits(backend['url'], model))
         
         # If only 1 backend, process sequentially to avoid timeout
         if available_backends <= 1:
@@ -954,7 +1739,8 @@ def analyze_endpoint():
             batch_results = []
 
             def process_file(file_data, idx, out):
-                result, status = proxy_request('/analyze', {'files': [file_data], 'model': model}, client_ip, 'analyze')
+                result, status = proxy_request('/analyze', {'files': [file_data], 'model': model}, client_ip, 'analyze',
+                                               client_task_id=client_task_id)
                 out.append((idx, result, status))
 
             for i, file_data in enumerate(batch):
@@ -997,20 +1783,137 @@ def analyze_endpoint():
         result, status = proxy_request('/analyze', {'files': files, 'model': model}, client_ip, 'analyze')
         return jsonify(result), status
 
+def _history_args():
+    """Parse ?since=&until=&step=&agg=&cursor= for the history endpoints; raises ValueError."""
+    since = float(request.args.get('since') or 0)
+    until = float(request.args.get('until') or math.inf)
+    step = float(request.args['step']) if request.args.get('step') else None
+    agg = request.args.get('agg') or None
+    if agg is not None and agg not in AGGS:
+        raise ValueError(f"agg must be one of {', '.join(AGGS)}")
+    if request.args.get('cursor'):
+        # Cursor is exclusive: only points recorded after the last one already served
+        since = max(since, math.nextafter(float(request.args['cursor']), math.inf))
+    return since, until, step, agg
+
+def _history_slices(series, since, until):
+    """Copy each series' points in [since, until] (cheap memcpy, so hold the lock only for this)."""
+    return {key: (buf.fields, buf.slice(since, until)) for key, buf in series.items()}
+
+def _history_buckets(fields, ts, cols, step, aggs):
+    """Aggregate one sliced series; step defaults to a width giving HISTORY_POINTS buckets."""
+    if not ts:
+        return []
+    span = ts[-1] - ts[0]
+    step = max(step or math.ceil(span / HISTORY_POINTS), math.ceil(span / HISTORY_MAX_BUCKETS), 1)
+    return aggregate(ts, cols, fields, step, aggs)
+
+def _history_split(*series):
+    """Earliest time from which the ring buffers hold every point: the newest first point of a
+    full (wrapping) buffer, else the oldest first point, else now."""
+    bufs = [buf for s in series for buf in s.values() if len(buf)]
+    full = [buf.first_ts() for buf in bufs if len(buf) == buf.capacity]
+    if full:
+        return max(full)
+    return min((buf.first_ts() for buf in bufs), default=time.time())
+
+def _long_range_step(since, until, step):
+    """Common bucket width when a range is served from both the store and memory (>= 1 minute)."""
+    if step:
+        return max(step, 60)
+    span = min(until, time.time()) - since
+    return max(math.ceil(span / HISTORY_POINTS), math.ceil(span / HISTORY_MAX_BUCKETS), 60)
+
+def _stored_buckets(kind, since, until, step, field, agg):
+    """Buckets of a kind's value column over [since, until) from the SQLite store, as aggregate() rows."""
+    _history.flush()
+    values = {'sum': lambda n, total, peak: total, 'max': lambda n, total, peak: peak,
+              'avg': lambda n, total, peak: total / n}[agg]
+    return {key: [(b, n, {field: values(n, total, peak)}) for b, n, total, peak in rows]
+            for key, rows in _history.buckets(kind, since, until, step).items()}
+
+def _merge_buckets(old, new, aggs):
+    """Concatenate stored and in-memory buckets, combining the bucket both sides share."""
+    if not (old and new and old[-1][0] == new[0][0]):
+        return old + new
+    (b, n1, v1), (_, n2, v2) = old[-1], new[0]
+    merged = dict(v2)
+    for field, value in v1.items():
+        agg = aggs[field]
+        merged[field] = (max(value, v2[field]) if agg == 'max' else
+                         (value * n1 + v2[field] * n2) / (n1 + n2) if agg == 'avg' else value + v2[field])
+    return old[:-1] + [(b, n1 + n2, merged)] + new[1:]
+
+def _history_response(result, slices, cursor):
+    """JSON response with X-Cursor set to the newest point served, for incremental polling."""
+    newest = max((ts[-1] for _, (ts, _) in slices if ts), default=None)
+    resp = jsonify(result)
+    if newest is not None or cursor:
+        resp.headers['X-Cursor'] = repr(newest) if newest is not None else cursor
+    return resp
+
 @app.route('/ip-tokens')
 def ip_tokens():
-    """Return token usage history per client IP and per backend"""
+    """Return token usage history per client IP and per backend, bucketed server-side.
+    ?since=&until= limit the range, ?step= sets bucket seconds, ?agg= sum|max|avg (default sum),
+    ?cursor= returns only points after the X-Cursor of a previous response."""
+    try:
+        since, until, step, agg = _history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    agg = agg or 'sum'
+    ip_aggs = {'tokens': agg, 'prompt_tokens': agg, 'response_tokens': agg, 'task': 'max', 'flags': 'max'}
     with ip_token_lock:
-        result = {ip: entries for ip, entries in ip_token_history.items()}
-        for url, entries in backend_token_history.items():
-            result[f"backend:{url}"] = entries
-        return jsonify(result)
+        _hydrate('ip_tokens')
+        _hydrate('backend_tokens')
+        split = _history_split(ip_token_history, backend_token_history)
+        # Only an explicit since reaching past the ring buffers goes to the store
+        stored = request.args.get('since') and since < split
+        if stored:
+            step = _long_range_step(since, until, step)
+        ip_slices = _history_slices(ip_token_history, max(since, split) if stored else since, until)
+        backend_slices = _history_slices(backend_token_history, max(since, split) if stored else since, until)
+    old_ip = _stored_buckets('ip_tokens', since, min(split, until), step, 'tokens', agg) if stored else {}
+    old_backend = _stored_buckets('backend_tokens', since, min(split, until), step, 'tokens', agg) if stored else {}
+    result = {}
+    for ip in {*ip_slices, *old_ip}:
+        fields, (ts, cols) = ip_slices.get(ip, (IP_TOKEN_FIELDS, ((), ())))
+        buckets = _merge_buckets(old_ip.get(ip, []), _history_buckets(fields, ts, cols, step, ip_aggs), ip_aggs)
+        if buckets:
+            result[ip] = [{'timestamp': b, 'tokens': v['tokens'], 'prompt_tokens': v.get('prompt_tokens'),
+                           'response_tokens': v.get('response_tokens'), 'requests': n} for b, n, v in buckets]
+    for url in {*backend_slices, *old_backend}:
+        fields, (ts, cols) = backend_slices.get(url, (('tokens',), ((), ())))
+        buckets = _merge_buckets(old_backend.get(url, []), _history_buckets(fields, ts, cols, step, {'tokens': agg}),
+                                 {'tokens': agg})
+        if buckets:
+            result[f"backend:{url}"] = [{'timestamp': b, 'tokens': v['tokens'], 'requests': n} for b, n, v in buckets]
+    return _history_response(result, [*ip_slices.values(), *backend_slices.values()], request.args.get('cursor'))
 
 @app.route('/queue-history')
 def get_queue_history():
-    """Return persisted queue history for graphs."""
+    """Return queue history for graphs, bucketed server-side: same parameters as /ip-tokens,
+    agg defaults to max (peak queue size per bucket)."""
+    try:
+        since, until, step, agg = _history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    aggs = {'queue_size': agg or 'max'}
     with ip_token_lock:
-        return jsonify(queue_history)
+        _hydrate('queue')
+        split = _history_split(queue_history)
+        stored = request.args.get('since') and since < split
+        if stored:
+            step = _long_range_step(since, until, step)
+        slices = _history_slices(queue_history, max(since, split) if stored else since, until)
+    old = _stored_buckets('queue', since, min(split, until), step, 'queue_size', aggs['queue_size']) if stored else {}
+    result = {}
+    for url in {*slices, *old}:
+        fields, (ts, cols) = slices.get(url, (('queue_size',), ((), ())))
+        buckets = _merge_buckets(old.get(url, []), _history_buckets(fields, ts, cols, step, aggs), aggs)
+        if buckets:
+            result[url] = [{'timestamp': b, 'queue_size': v['queue_size']} for b, n, v in buckets]
+    return _history_response(result, slices.values(), request.args.get('cursor'))
 
 @app.route('/usage-stats')
 def get_usage_stats():
@@ -1029,23 +1932,23 @@ def generate_image_endpoint():
     # Image generation is CPU-heavy — pick the single best backend (most RAM = fastest)
     candidates = []
     for b in BACKENDS:
-        try:
-            resp = _backend_get(f"{b['url']}/queue-status", timeout=2)
-            info = resp.json()
+        info = _status_snapshot(b['url'])
+        if info is not None:
             qs = info.get('queue_size', 999)
             active = info.get('active', False)
             ram = info.get('ram_total_gb', 0)
             busy_penalty = 1000 if (active or qs > 0) else 0
             score = busy_penalty - ram
             candidates.append((score, b))
-        except:
-            pass
     if not candidates:
         return jsonify({'error': 'No backends reachable'}), 200
     candidates.sort(key=lambda x: x[0])
 
     # Only try the best backend — don't cascade to slower ones
     b = candidates[0][1]
+    client_task_id = _client_task_id()
+    if not _start_call(client_task_id, b['url'], data):
+        return jsonify({'error': 'Task cancelled'}), 200
     try:
         resp = _backend_post(f"{b['url']}/generate-image", json=data, timeout=3600)
         result = resp.json()
@@ -1054,6 +1957,8 @@ def generate_image_endpoint():
         return jsonify(result), 200
     except Exception as e:
         return jsonify({'error': f"{b['url']}: {str(e)}"}), 200
+    finally:
+        _end_call(client_task_id, data)
 
 @app.route('/image-models')
 def image_models():
@@ -1070,14 +1975,13 @@ def image_models():
 def list_models():
     """Aggregate models from all backends, deduplicated."""
     seen = {}
-    for backend in BACKENDS:
-        try:
-            resp = _backend_get(f"{backend['url']}/models", timeout=5)
-            for m in resp.json().get('models', []):
-                seen[m['name']] = m
-        except:
-            continue
-    return jsonify({'models': sorted(seen.values(), key=lambda m: m['name'])})
+    replies = fan_out('/models', timeout=5)
+    _update_model_index(replies)
+    for r in replies.values():
+        for m in (r['data'] or {}).get('models', []):
+            seen[m['name']] = m
+    return jsonify({'models': sorted(seen.values(), key=lambda m: m['name']),
+                    'backends': {url: {'ok': r['ok'], 'latency': r['latency']} for url, r in replies.items()}})
 
 @app.route('/test', methods=['POST'])
 @require_auth
@@ -1086,38 +1990,29 @@ def test_models():
     _proj = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
     if _proj not in sys.path:
         sys.path.insert(0, _proj)
-    from shared.constants import TEST_PROMPT, model_size, cloud_cost_estimates, fetch_cloud_pricing
+    from shared.constants import TEST_PROMPT, cloud_cost_estimates, fetch_cloud_pricing
 
     data = request.json or {}
     prompt = data.get('prompt', TEST_PROMPT)
     model_filter = data.get('model', 'all')
     client_ip = request.remote_addr
 
-    # Get available models from any reachable backend
+    # Get available models from the first reachable backend
+    replies = fan_out('/models', timeout=5)
     all_models = []
-    for b in BACKENDS:
-        try:
-            resp = _backend_get(f"{b['url']}/models", timeout=5)
-            all_models = [m['name'] for m in resp.json().get('models', [])]
-            if all_models:
-                break
-        except:
-            continue
+    for r in replies.values():
+        all_models = [m['name'] for m in (r['data'] or {}).get('models', [])]
+        if all_models:
+            break
     if not all_models:
         return jsonify({'error': 'No models available'}), 200
 
     # Filter models
     if model_filter == 'all':
-        max_sizes = []
-        for b in BACKENDS:
-            try:
-                _backend_get(f"{b['url']}/queue-status", timeout=2)
-                max_sizes.append(model_size(b.get('max_model', '')))
-            except:
-                pass
-        max_avail = max(max_sizes) if max_sizes else 999
-        test_list = [m for m in all_models if model_size(m) <= max_avail]
-        skipped = [m for m in all_models if model_size(m) > max_avail]
+        _update_model_index(replies)
+        online = [b['url'] for b in BACKENDS if replies[b['url']]['ok']]
+        test_list = [m for m in all_models if any(_fits(url, m) for url in online)]
+        skipped = [m for m in all_models if m not in test_list]
     else:
         test_list = [m for m in all_models if model_filter in m]
         skipped = []
@@ -1130,6 +2025,8 @@ def test_models():
         result, status = proxy_request('/chat', {'message': prompt, 'model': m}, client_ip, 'test')
         if result.get('error'):
             results.append({'model': m, 'error': result['error']})
+            if result['error'] == 'Task cancelled':
+                break
             continue
         p = result.get('prompt_tokens', 0)
         r = result.get('response_tokens', 0)
@@ -1195,6 +2092,9 @@ def cloud_costs_tab():
         'cached': {
             'requests': c_reqs,
             'tokens_saved': c_tok,
+            'cache': _prompt_cache.stats(),
+            'disk_cache': _disk_cache.stats() if _disk_cache is not None else None,
+            'semantic_cache': dict(_semantic_cache.stats(), thresholds=SEMANTIC_THRESHOLDS, model=EMBED_MODEL) if _semantic_cache is not None else None,
         },
     })
 
@@ -1240,6 +2140,58 @@ def reset_all():
     save_history()
     return jsonify({'status': 'ok'})
 
+def _cost_cells(since, until):
+    """((task, fallback, cached), [requests, prompt, response, tokens]) pairs covering [since, until].
+
+    Whole day buckets, then whole hour buckets, then scans of the partial
+    hours at either edge (at most two). Hours older than COST_HOUR_MEMORY and
+    edge points older than the ring buffers are read from the store, after
+    releasing ip_token_lock; edges past the store's raw retention only exist
+    as whole hours and are left out."""
+    hour, day = COST_RESOLUTIONS
+    h_lo, h_hi = math.ceil(since / hour) * hour, math.floor(until / hour) * hour
+    cells = []
+    stored_hours = []  # [lo, hi) hour ranges to read from the store
+    stored_points = []  # [lo, hi] raw ranges to read from the store
+    with ip_token_lock:
+        _hydrate('ip_tokens')
+        if h_lo < h_hi:
+            d_lo, d_hi = math.ceil(h_lo / day) * day, math.floor(h_hi / day) * day
+            if d_lo < d_hi:
+                for start, bucket in _cost_buckets[day].items():
+                    if d_lo <= start < d_hi:
+                        cells.extend((k, tuple(v)) for k, v in bucket.items())
+                hour_ranges = [(h_lo, d_lo), (d_hi, h_hi)]
+            else:
+                hour_ranges = [(h_lo, h_hi)]
+            kept = math.ceil((time.time() - COST_HOUR_MEMORY) / hour) * hour
+            for lo, hi in hour_ranges:
+                if lo < min(hi, kept):
+                    stored_hours.append((lo, min(hi, kept)))
+                for start in range(int(max(lo, kept)), int(hi), hour):
+                    cells.extend((k, tuple(v)) for k, v in _cost_buckets[hour].get(start, {}).items())
+            edges = [(since, math.nextafter(h_lo, -math.inf)), (h_hi, until)]
+        else:
+            edges = [(since, until)]
+        split = _history_split(ip_token_history)
+        for lo, hi in edges:
+            if lo > hi:
+                continue
+            if lo < split:
+                stored_points.append((lo, min(hi, math.nextafter(split, -math.inf))))
+            for buf in ip_token_history.values():
+                for ts, tokens, pt, rt, task, flags in buf.rows(max(lo, split), hi):
+                    flags = int(flags)
+                    cells.append(((_task_names[int(task)], bool(flags & FLAG_FALLBACK), bool(flags & FLAG_CACHED)),
+                                  (1, int(pt), int(rt), int(tokens))))
+    if stored_points:
+        _history.flush()
+    for lo, hi in stored_hours:
+        cells.extend(_history.cost_cells(hour, lo, hi))
+    for lo, hi in stored_points:
+        cells.extend(_history.cost_points(lo, hi))
+    return cells
+
 @app.route('/cost-history')
 def cost_history():
     """Return token totals filtered by time range for cost calculations."""
@@ -1257,26 +2209,20 @@ def cost_history():
     until_ts = float(until) if until else time.time()
 
     p_tok = r_tok = fb_p = fb_r = fb_reqs = total_reqs = c_reqs = c_tok = 0
-    with ip_token_lock:
-        for ip, entries in ip_token_history.items():
-            for e in entries:
-                ts = e.get('timestamp', 0)
-                if ts < since_ts or ts > until_ts:
-                    continue
-                if e.get('task') == 'test':
-                    continue
-                pt = e.get('prompt_tokens', 0)
-                rt = e.get('response_tokens', 0)
-                p_tok += pt
-                r_tok += rt
-                total_reqs += 1
-                if e.get('cloud_fallback'):
-                    fb_p += pt
-                    fb_r += rt
-                    fb_reqs += 1
-                if e.get('cached'):
-                    c_reqs += 1
-                    c_tok += e.get('tokens', 0)
+    cells = _cost_cells(since_ts, until_ts)
+    for (task, fallback, cached), (reqs, pt, rt, tokens) in cells:
+        if task == 'test':
+            continue
+        p_tok += pt
+        r_tok += rt
+        total_reqs += reqs
+        if fallback:
+            fb_p += pt
+            fb_r += rt
+            fb_reqs += reqs
+        if cached:
+            c_reqs += reqs
+            c_tok += tokens
 
     hypothetical, source = cloud_cost_estimates(p_tok, r_tok)
     actual, _ = cloud_cost_estimates(fb_p, fb_r)
@@ -1317,9 +2263,8 @@ def api_audit_log():
         return err
     limit = int(request.args.get('limit', 100))
     since = float(request.args.get('since', 0))
-    with _audit_lock:
-        entries = [e for e in _audit_entries if e['timestamp'] > since]
-    return jsonify({'entries': entries[-limit:], 'total': len(entries)})
+    entries, total = _audit_log.query(since, limit)
+    return jsonify({'entries': entries, 'total': total})
 
 @app.route('/api/audit/toggle', methods=['POST'])
 @require_sso
@@ -1358,6 +2303,7 @@ def api_webhooks():
         'webhook_urls': persisted_totals.get('webhook_urls', []),
         'env_url': WEBHOOK_URL or None,
         'events': ['backend_down', 'backend_recovered', 'budget_warning'],
+        'delivery': _webhooks.stats(),
     })
 
 @app.route('/api/audit/status')
@@ -1366,7 +2312,7 @@ def api_audit_status():
     return jsonify({
         'audit_enabled': bool(AUDIT_LOG) or persisted_totals.get('audit_enabled', False),
         'file_log': AUDIT_LOG or None,
-        'entries_in_memory': len(_audit_entries),
+        **_audit_log.stats(),
     })
 
 @app.route('/api/keys', methods=['GET'])
@@ -1400,7 +2346,7 @@ def api_keys_create():
     if err:
         return err
     import secrets
-    from shared.auth import _load_config, AUTH_FILE
+    from shared.auth import _load_config, AUTH_FILE, reload_config
     data = request.json or {}
     name = data.get('name', '')
     role = data.get('role', 'user')
@@ -1417,6 +2363,7 @@ def api_keys_create():
         cfg['api_keys'][key]['cloud_fallback'] = data['cloud_fallback']
     with open(AUTH_FILE, 'w') as f:
         json.dump(cfg, f, indent=2)
+    reload_config()
     return jsonify({'key': key, 'name': name, 'role': role})
 
 @app.route('/api/keys/revoke', methods=['POST'])
@@ -1426,7 +2373,7 @@ def api_keys_revoke():
     err = _require_secure_admin()
     if err:
         return err
-    from shared.auth import _load_config, AUTH_FILE
+    from shared.auth import _load_config, AUTH_FILE, reload_config
     key_id = (request.json or {}).get('key_id', '')
     if not key_id:
         return jsonify({'error': 'key_id required'}), 400
@@ -1439,6 +2386,7 @@ def api_keys_revoke():
             del cfg['api_keys'][k]
             with open(AUTH_FILE, 'w') as f:
                 json.dump(cfg, f, indent=2)
+            reload_config()
             return jsonify({'status': 'ok', 'revoked': name})
     return jsonify({'error': 'Key not found'}), 404
 
@@ -1497,6 +2445,45 @@ def api_backends():
         return jsonify({'error': 'Backend not found'}), 404
     return jsonify({'backends': BACKENDS})
 
+@app.route('/api/backend-pools')
+@require_admin
+def api_backend_pools():
+    """Connection pool metrics per backend: reuse rate, new connections, handshake time."""
+    return jsonify(_pool_metrics())
+
+@app.route('/api/cache/clear', methods=['POST'])
+@require_admin
+def api_cache_clear():
+    """Empty prompt cache tiers: {"tier": "memory|disk|semantic|all"} (default all)."""
+    tier = (request.json or {}).get('tier', 'all')
+    tiers = {'memory': _prompt_cache, 'disk': _disk_cache, 'semantic': _semantic_cache}
+    if tier != 'all' and tier not in tiers:
+        return jsonify({'error': f"tier must be one of {', '.join(tiers)} or all"}), 400
+    cleared = []
+    for name, cache in tiers.items():
+        if cache is not None and tier in ('all', name):
+            cache.clear()
+            cleared.append(name)
+    return jsonify({'cleared': cleared})
+
+@app.route('/api/model-lifecycle', methods=['GET', 'POST'])
+@require_admin
+def api_model_lifecycle():
+    """GET: model lifecycle state of every backend. POST: forward a preload/pin/unpin/unload/keep_alive
+    action to one backend, {"url": "...", "model": "...", "action": "..."}."""
+    if request.method == 'GET':
+        return jsonify({url: r['data'] if r['ok'] else {'error': r['error']}
+                        for url, r in fan_out('/model-lifecycle').items()})
+    data = request.json or {}
+    url = data.pop('url', '')
+    if url not in backend_status:
+        return jsonify({'error': 'Unknown backend URL'}), 400
+    try:
+        resp = _backend_post(f"{url}/model-lifecycle", json=data, timeout=10)
+        return jsonify(resp.json()), resp.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/auto-fallback', methods=['GET', 'POST'])
 @require_admin
 def auto_fallback_setting():
@@ -1516,19 +2503,15 @@ def v1_models():
     """OpenAI-compatible model list."""
     models = []
     seen = set()
-    for backend in BACKENDS:
-        try:
-            resp = _backend_get(f"{backend['url']}/models", timeout=5)
-            for m in resp.json().get('models', []):
-                if m['name'] not in seen:
-                    seen.add(m['name'])
-                    models.append({
-                        'id': m['name'],
-                        'object': 'model',
-                        'owned_by': 'local',
-                    })
-        except:
-            continue
+    for r in fan_out('/models', timeout=5).values():
+        for m in (r['data'] or {}).get('models', []):
+            if m['name'] not in seen:
+                seen.add(m['name'])
+                models.append({
+                    'id': m['name'],
+                    'object': 'model',
+                    'owned_by': 'local',
+                })
     # Include aliases
     for alias, real in MODEL_ALIASES.items():
         if alias not in seen:
@@ -1554,23 +2537,45 @@ def v1_chat_completions():
     if not message:
         return jsonify({'error': {'message': 'No user message found', 'type': 'invalid_request_error'}}), 400
 
+    payload = {'message': message, 'model': model, 'messages': messages}
+    import uuid as _uuid
+    response_id = f"chatcmpl-{_uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+
+    if data.get('stream'):
+        def chunks():
+            def chunk(delta, finish=None, **extra):
+                return {'id': response_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}], **extra}
+            yield _sse(chunk({'role': 'assistant'}))
+            for ev in proxy_stream('/chat', payload, request.remote_addr, 'chat'):
+                if ev.get('done'):
+                    if ev.get('error'):
+                        yield _sse({'error': {'message': ev['error'], 'type': 'server_error'}})
+                    else:
+                        yield _sse(chunk({}, 'stop', usage={
+                            'prompt_tokens': ev.get('prompt_tokens', 0),
+                            'completion_tokens': ev.get('response_tokens', 0),
+                            'total_tokens': ev.get('total_tokens', 0),
+                        }))
+                    break
+                if ev.get('token'):
+                    yield _sse(chunk({'content': ev['token']}))
+            yield 'data: [DONE]\n\n'
+        return Response(stream_with_context(chunks()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     # Pass full messages array to backend
-    result, status = proxy_request('/chat', {
-        'message': message,
-        'model': model,
-        'messages': messages,
-    }, request.remote_addr, 'chat')
+    result, status = proxy_request('/chat', payload, request.remote_addr, 'chat')
 
     if result.get('error'):
         return jsonify({'error': {'message': result['error'], 'type': 'server_error'}}), 500
 
     # Convert to OpenAI format
-    import uuid as _uuid
-    response_id = f"chatcmpl-{_uuid.uuid4().hex[:12]}"
     return jsonify({
         'id': response_id,
         'object': 'chat.completion',
-        'created': int(time.time()),
+        'created': created,
         'model': model,
         'choices': [{
             'index': 0,
@@ -0,0 +1,209 @@
+"""sheLLaMa audit log — buffered background writer with rotation and a timestamp index."""
+
+import glob
+import gzip
+import json
+import os
+import shutil
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+
+
+class AuditLog:
+    """Audit entries kept in a bounded deque and appended to a JSON-lines file.
+
+    record() only appends to memory; a writer thread drains the pending lines
+    in batches, fsyncs every FSYNC_INTERVAL seconds, and rotates the file when
+    it exceeds max_bytes or max_age seconds (rotated files are gzipped, the
+    newest `keep` retained). A sparse (timestamp, offset) index of the current
+    file lets query() seek to entries older than the in-memory window."""
+
+    BATCH = 256
+    FLUSH_INTERVAL = 1.0
+    FSYNC_INTERVAL = 5.0
+    INDEX_EVERY = 256
+    PENDING_MAX = 50000
+
+    def __init__(self, path=None, max_entries=10000, max_bytes=100 * 1024 * 1024, max_age=86400, keep=10):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        self._entries = deque(maxlen=max_entries)
+        self._lock = Lock()
+        self._pending = deque()
+        self._cond = Condition()
+        self._index = []  # [(timestamp, byte offset)] every INDEX_EVERY lines of the current file
+        self._lines = 0
+        self._file = None
+        self._opened = time.time()
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.errors = 0
+        self.last_fsync = None
+        if path:
+            self._open()
+            Thread(target=self._run, daemon=True).start()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def record(self, entry, to_file=True):
+        """Add an entry; it is written to the file by the background writer."""
+        with self._lock:
+            self._entries.append(entry)
+        if self.path and to_file:
+            with self._cond:
+                if len(self._pending) >= self.PENDING_MAX:
+                    self.dropped += 1
+                    return
+                self._pending.append(entry)
+                if len(self._pending) >= self.BATCH:
+                    self._cond.notify()
+
+    def _first_after(self, since):
+        """Index of the first in-memory entry with timestamp > since (caller holds _lock)."""
+        lo, hi = 0, len(self._entries)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entries[mid]['timestamp'] > since:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def query(self, since=0, limit=100):
+        """(newest `limit` entries with timestamp > since, how many there are in total)."""
+        with self._lock:
+            i = self._first_after(since)
+            count = len(self._entries) - i
+            start = max(i, len(self._entries) - limit)
+            entries = [self._entries[j] for j in range(start, len(self._entries))]
+            oldest = self._entries[0]['timestamp'] if self._entries else None
+        if i == 0 and self.path and (oldest is None or since < oldest):
+            older = self._read_file(since, oldest)
+            count += len(older)
+            if len(entries) < limit:
+                entries = older[-(limit - len(entries)):] + entries
+        return entries, count
+
+    def _read_file(self, since, until):
+        """Entries in the current file with since < timestamp < until, seeking via the index."""
+        with self._cond:
+            offset = 0
+            for ts, off in self._index:
+                if ts > since:
+                    break
+                offset = off
+        out = []
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue
+                    ts = e.get('timestamp', 0)
+                    if until is not None and ts >= until:
+                        break
+                    if ts > since:
+                        out.append(e)
+        except OSError:
+            pass
+        return out
+
+    def _open(self):
+        """Open the current file, index what is already in it and load its tail into memory."""
+        self._index, self._lines = [], 0
+        tail = deque(maxlen=self._entries.maxlen)
+        try:
+            with open(self.path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        offset += len(line)
+                        continue
+                    if self._lines % self.INDEX_EVERY == 0:
+                        self._index.append((e.get('timestamp', 0), offset))
+                    self._lines += 1
+                    offset += len(line)
+                    tail.append(e)
+        except FileNotFoundError:
+            pass
+        self._opened = self._index[0][0] if self._index else time.time()
+        with self._lock:
+            self._entries.extendleft(reversed(tail))
+        self._file = open(self.path, 'ab')
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.FLUSH_INTERVAL)
+                batch = list(self._pending)
+                self._pending.clear()
+            try:
+                if batch:
+                    self._write(batch)
+                if self.last_fsync is None or time.time() - self.last_fsync >= self.FSYNC_INTERVAL:
+                    os.fsync(self._file.fileno())
+                    self.last_fsync = time.time()
+                if self._file.tell() >= self.max_bytes or time.time() - self._opened >= self.max_age:
+                    if self._file.tell():
+                        self._rotate()
+            except Exception as e:
+                self.errors += 1
+                print(f"[audit] write failed: {e}")
+
+    def _write(self, batch):
+        offset = self._file.tell()
+        index = []
+        chunks = []
+        for e in batch:
+            line = (json.dumps(e) + '\n').encode()
+            if self._lines % self.INDEX_EVERY == 0:
+                index.append((e['timestamp'], offset))
+            self._lines += 1
+            offset += len(line)
+            chunks.append(line)
+        self._file.write(b''.join(chunks))
+        self._file.flush()
+        self.written += len(batch)
+        if index:
+            with self._cond:
+                self._index.extend(index)
+
+    def _rotate(self):
+        """Move the current file aside, gzip it and start a new one."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        rotated = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+        os.replace(self.path, rotated)
+        with self._cond:
+            self._index, self._lines = [], 0
+        self._file = open(self.path, 'ab')
+        self._opened = time.time()
+        self.rotations += 1
+        with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        for old in sorted(glob.glob(glob.escape(self.path) + '.*.gz'))[:-self.keep]:
+            os.remove(old)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'entries_in_memory': len(self._entries),
+            'pending': pending,
+            'written': self.written,
+            'dropped': self.dropped,
+            'rotations': self.rotations,
+            'errors': self.errors,
+            'last_fsync': self.last_fsync,
+        }
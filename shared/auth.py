@@ -1,11 +1,17 @@
 """sheLLaMa authentication — API keys + SSO (OIDC) with roles and per-key tracking."""
+import hashlib
 import json
 import os
 import time
+from collections.abc import Mapping
 from functools import wraps
+from threading import Thread
 from flask import request, jsonify, redirect, session, url_for
 
+from shared.ratelimit import MemoryLimiter, LimiterUnavailable, make_limiter
+
 AUTH_FILE = os.environ.get('SHELLAMA_AUTH_FILE', '/etc/shellama/auth.json')
+AUTH_POLL_INTERVAL = float(os.environ.get('SHELLAMA_AUTH_POLL', 2))  # seconds between auth file mtime checks
 
 # Roles and their permissions
 ROLE_PERMISSIONS = {
@@ -17,7 +23,7 @@ ROLE_PERMISSIONS = {
     'user': {
         'endpoints': ['chat', 'generate', 'explain', 'generate-code', 'explain-code',
                       'analyze', 'generate-image', 'upload', 'test', 'models',
-                      'image-models', 'queue-status', 'cloud-costs', 'cost-history'],
+                      'image-models', 'queue-status', 'cloud-costs', 'cost-history', 'cancel'],
         'web_modify': False,
         'cloud_fallback': True,
     },
@@ -29,17 +35,37 @@ ROLE_PERMISSIONS = {
     },
 }
 
+# Endpoint names each role may call; None = all
+_ROLE_ENDPOINTS = {role: None if 'all' in perms['endpoints'] else frozenset(perms['endpoints'])
+                   for role, perms in ROLE_PERMISSIONS.items()}
+
 # Pages that serve HTML — SSO protects these, API keys protect API endpoints
 WEB_PAGES = ['/', '/status', '/backends', '/stats', '/costs']
 
-_config = None
-_config_mtime = 0
 _oauth = None
 _webhook_callback = None  # set by frontend to fire webhooks
 
-# Rate limiting: {key: [timestamp, timestamp, ...]}
-_rate_requests = {}
-_rate_tokens = {}
+# Rate limiting: per-key sliding-window counters (see shared/ratelimit.py).
+# SHELLAMA_RATE_BACKEND=sqlite:/path shares them between frontends on one host;
+# the memory backend can be saved to SHELLAMA_RATE_STATE so limits survive restarts
+RATE_BACKEND = os.environ.get('SHELLAMA_RATE_BACKEND', 'memory')
+RATE_STATE = os.environ.get('SHELLAMA_RATE_STATE', '')
+RATE_SAVE_INTERVAL = 30
+_limiter = make_limiter(RATE_BACKEND, RATE_STATE or None)
+_limiter.load()
+
+
+def _save_rate_state():
+    while True:
+        time.sleep(RATE_SAVE_INTERVAL)
+        try:
+            _limiter.save()
+        except OSError:
+            pass
+
+
+if RATE_STATE and isinstance(_limiter, MemoryLimiter):
+    Thread(target=_save_rate_state, daemon=True).start()
 
 
 def _check_rate_limit(key, key_info):
@@ -53,35 +79,23 @@ def _check_rate_limit(key, key_info):
 
     # Requests per minute
     rpm = limits.get('rpm')
-    if rpm:
-        window = [t for t in _rate_requests.get(key, []) if t > now - 60]
-        _rate_requests[key] = window
-        if len(window) >= rpm:
-            return f'Rate limit exceeded: {rpm} requests/minute'
-        window.append(now)
+    if rpm and not _limiter.hit(key, rpm, now):
+        return f'Rate limit exceeded: {rpm} requests/minute'
 
-    # Tokens per day
     tpd = limits.get('tpd')
-    if tpd:
-        day_start = now - 86400
-        day_tokens = sum(e[1] for e in _rate_tokens.get(key, []) if e[0] > day_start)
-        if day_tokens >= tpd:
-            return f'Rate limit exceeded: {tpd} tokens/day'
+    max_cost = budget.get('max_daily')
+    if not tpd and not max_cost:
+        return None
+    day_tokens, cloud_prompt, cloud_resp = _limiter.day_usage(key, now)
+
+    # Tokens per day
+    if tpd and day_tokens >= tpd:
+        return f'Rate limit exceeded: {tpd} tokens/day'
 
     # Budget per day (estimated cloud cost)
-    max_cost = budget.get('max_daily')
     if max_cost:
-        day_start = now - 86400
-        entries = [e for e in _rate_tokens.get(key, []) if e[0] > day_start]
-        # Actual cloud fallback cost (real spend)
-        cloud_prompt = sum(e[2] for e in entries if e[4])
-        cloud_resp = sum(e[3] for e in entries if e[4])
-        # Hypothetical cost for local usage (what it would cost on cloud)
-        local_prompt = sum(e[2] for e in entries if not e[4])
-        local_resp = sum(e[3] for e in entries if not e[4])
-        # Use GPT-4o rates as reference for local, actual rates for cloud
+        # Actual cloud fallback cost (real spend), at GPT-4o reference rates
         actual_cost = (cloud_prompt * 2.50 + cloud_resp * 10.00) / 1_000_000
-        hypothetical_cost = (local_prompt * 2.50 + local_resp * 10.00) / 1_000_000
         # Budget enforced on actual cloud spend only
         if actual_cost >= max_cost:
             return f'Budget exceeded: ${actual_cost:.4f} actual cloud spend of ${max_cost:.2f}/day limit'
@@ -100,38 +114,109 @@ def _check_rate_limit(key, key_info):
 def record_rate_tokens(key, tokens, prompt_tokens=0, response_tokens=0, cloud_fallback=False):
     """Record token usage for rate limiting and budget tracking."""
     if key:
-        if key not in _rate_tokens:
-            _rate_tokens[key] = []
-        _rate_tokens[key].append((time.time(), tokens, prompt_tokens, response_tokens, cloud_fallback))
-        # Trim old entries (keep 24h)
-        cutoff = time.time() - 86400
-        _rate_tokens[key] = [e for e in _rate_tokens[key] if e[0] > cutoff]
+        # Only cloud fallback tokens count towards the daily budget
+        cloud = (prompt_tokens, response_tokens) if cloud_fallback else (0, 0)
+        try:
+            _limiter.record(key, time.time(), tokens, *cloud)
+        except LimiterUnavailable as e:
+            # The request already ran; losing its count beats failing it
+            print(f"[ratelimit] {e}")
 
 
-def _load_config():
-    """Load auth config, reload if file changed."""
-    global _config, _config_mtime
+class KeyRecord(Mapping):
+    """Read-only API key config with its permissions precomputed.
+
+    Behaves like the key's dict from auth.json (key_info.get('name') etc.);
+    models is None when every model is allowed, else a frozenset."""
+
+    __slots__ = ('_info', 'role', 'models', 'endpoints', 'cloud_fallback')
+
+    def __init__(self, info):
+        self._info = dict(info)
+        self.role = info.get('role', 'viewer')
+        models = info.get('models', ['all'])
+        self.models = None if 'all' in models else frozenset(models)
+        self.endpoints = _ROLE_ENDPOINTS.get(self.role, frozenset())
+        if 'cloud_fallback' in info:
+            self.cloud_fallback = info['cloud_fallback']
+        else:
+            self.cloud_fallback = ROLE_PERMISSIONS.get(self.role, {}).get('cloud_fallback', False)
+
+    def __getitem__(self, name):
+        return self._info[name]
+
+    def __iter__(self):
+        return iter(self._info)
+
+    def __len__(self):
+        return len(self._info)
+
+
+def _key_hash(key):
+    return hashlib.sha256(key.encode()).digest()
+
+
+class _AuthState:
+    """One parsed auth.json: raw config plus the compiled key index, swapped in whole."""
+
+    __slots__ = ('config', 'mtime', 'keys', 'enabled', 'sso')
+
+    def __init__(self, config, mtime):
+        self.config = config
+        self.mtime = mtime
+        # Keyed by SHA-256 of the API key so lookups never compare secrets directly
+        self.keys = {_key_hash(k): KeyRecord(v) for k, v in (config or {}).get('api_keys', {}).items()}
+        self.enabled = config is not None and (bool(config.get('api_keys')) or bool(config.get('sso')))
+        self.sso = config is not None and bool(config.get('sso', {}).get('issuer'))
+
+
+_auth = _AuthState(None, 0)
+
+
+def reload_config():
+    """Re-read auth.json if its mtime changed (or it appeared/disappeared) and rebuild the index."""
+    global _auth
     try:
         mtime = os.path.getmtime(AUTH_FILE)
-        if _config is None or mtime > _config_mtime:
-            with open(AUTH_FILE, 'r') as f:
-                _config = json.load(f)
-            _config_mtime = mtime
-    except FileNotFoundError:
-        _config = None
-    return _config
+    except OSError:
+        if _auth.config is not None:
+            _auth = _AuthState(None, 0)
+        return
+    if _auth.config is not None and mtime == _auth.mtime:
+        return
+    try:
+        with open(AUTH_FILE, 'r') as f:
+            config = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[auth] keeping previous config, could not load {AUTH_FILE}: {e}")
+        return
+    _auth = _AuthState(config, mtime)
+
+
+def _watch_config():
+    """Background thread: pick up auth.json edits off the request path."""
+    while True:
+        time.sleep(AUTH_POLL_INTERVAL)
+        reload_config()
+
+
+reload_config()
+Thread(target=_watch_config, daemon=True).start()
+
+
+def _load_config():
+    """Current auth config (raw auth.json), or None if there is none."""
+    return _auth.config
 
 
 def auth_enabled():
     """Check if auth is configured."""
-    cfg = _load_config()
-    return cfg is not None and (bool(cfg.get('api_keys')) or bool(cfg.get('sso')))
+    return _auth.enabled
 
 
 def sso_enabled():
     """Check if SSO is configured."""
-    cfg = _load_config()
-    return cfg is not None and bool(cfg.get('sso', {}).get('issuer'))
+    return _auth.sso
 
 
 def init_sso(app):
@@ -191,37 +276,28 @@ def get_sso_role(userinfo):
 
 
 def get_api_key_info(key):
-    """Look up an API key, return its config or None."""
-    cfg = _load_config()
-    if not cfg:
-        return None
-    return cfg.get('api_keys', {}).get(key)
+    """Look up an API key, return its KeyRecord or None."""
+    return _auth.keys.get(_key_hash(key))
 
 
 def check_endpoint_access(role, endpoint):
     """Check if a role can access an endpoint."""
-    perms = ROLE_PERMISSIONS.get(role, {})
-    allowed = perms.get('endpoints', [])
-    if 'all' in allowed:
+    allowed = _ROLE_ENDPOINTS.get(role, frozenset())
+    if allowed is None:
         return True
     ep = endpoint.lstrip('/')
-    return ep in allowed
+    # Parameterised routes like /cancel/<task_id> match on their first segment
+    return ep in allowed or ep.split('/')[0] == 'cancel' and 'cancel' in allowed
 
 
 def check_model_access(key_info, model):
     """Check if an API key can use a specific model."""
-    models = key_info.get('models', ['all'])
-    if 'all' in models:
-        return True
-    return model in models
+    return key_info.models is None or model in key_info.models
 
 
 def check_cloud_fallback(key_info):
     """Check if an API key can trigger cloud fallback."""
-    role = key_info.get('role', 'viewer')
-    if 'cloud_fallback' in key_info:
-        return key_info['cloud_fallback']
-    return ROLE_PERMISSIONS.get(role, {}).get('cloud_fallback', False)
+    return key_info.cloud_fallback
 
 
 def require_auth(f):
@@ -241,7 +317,7 @@ def require_auth(f):
         if not key_info:
             return jsonify({'error': 'Invalid API key'}), 401
 
-        role = key_info.get('role', 'viewer')
+        role = key_info.role
         endpoint = request.path
 
         if not check_endpoint_access(role, endpoint):
@@ -252,7 +328,10 @@ def require_auth(f):
             return jsonify({'error': f'API key not authorized for model "{model}"'}), 403
 
         # Rate limiting
-        rate_err = _check_rate_limit(key, key_info)
+        try:
+            rate_err = _check_rate_limit(key, key_info)
+        except LimiterUnavailable as e:
+            return jsonify({'error': str(e)}), 503
         if rate_err:
             return jsonify({'error': rate_err}), 429
 
@@ -307,6 +386,13 @@ def get_key_name():
     return info.get('name', 'unknown') if info else 'anonymous'
 
 
+def get_key_id():
+    """Stable identity of the current API key (hex SHA-256 of the key), or 'anonymous'.
+    Unlike get_key_name(), two keys never share it."""
+    key = getattr(request, '_shellama_key', None)
+    return _key_hash(key).hex() if key else 'anonymous'
+
+
 def get_web_role():
     """Get the role for the current web session."""
     return getattr(request, '_shellama_sso_role', 'admin')
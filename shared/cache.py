@@ -0,0 +1,330 @@
+"""sheLLaMa prompt cache — thread-safe LRU with TTL and a byte budget."""
+
+import json
+import math
+import os
+import sqlite3
+import time
+from array import array
+from collections import OrderedDict, deque
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:  # optional: speeds up the semantic tier's brute-force search
+    np = None
+
+
+class PromptCache:
+    """In-memory LRU cache of backend results keyed by prompt hash.
+
+    Bounded by entry count and by total size (JSON bytes of the results), so
+    one large /analyze result weighs more than a one-line chat. Entries expire
+    ttl seconds after they were stored. All operations are O(1) except
+    eviction, which pops from the cold end until the cache fits."""
+
+    def __init__(self, ttl, max_entries=500, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (stored_at, size, result)
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key):
+        """Return a copy of the cached result, or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry[0] >= self.ttl:
+                self._drop(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[2])
+
+    def put(self, key, result):
+        """Store a result. Results larger than the whole budget are not cached."""
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time(), size, result)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+class DiskCache:
+    """SQLite-backed prompt cache tier that survives restarts.
+
+    Several frontends on one host (or a shared volume) can point at the same
+    file; WAL mode lets them read while one writes. Expired rows are removed
+    and the least recently used rows trimmed to max_bytes every
+    COMPACT_EVERY writes, reclaiming file space with incremental vacuum."""
+
+    COMPACT_EVERY = 100
+
+    def __init__(self, path, ttl, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS prompt_cache ('
+                         'key TEXT PRIMARY KEY, stored REAL, accessed REAL, size INTEGER, result TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS prompt_cache_accessed ON prompt_cache(accessed)')
+        self._db.commit()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.errors = 0
+        self.compact()
+
+    def get(self, key):
+        """Return the cached result, or None on miss/expiry."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._db.execute('SELECT stored, result FROM prompt_cache WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                if now - row[0] >= self.ttl:
+                    self._db.execute('DELETE FROM prompt_cache WHERE key = ?', (key,))
+                    self._db.commit()
+                    self.expired += 1
+                    self.misses += 1
+                    return None
+                self._db.execute('UPDATE prompt_cache SET accessed = ? WHERE key = ?', (now, key))
+                self._db.commit()
+                self.hits += 1
+                return json.loads(row[1])
+            except Exception:
+                self.errors += 1
+                return None
+
+    def put(self, key, result):
+        blob = json.dumps(result, default=str)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute('INSERT OR REPLACE INTO prompt_cache VALUES (?, ?, ?, ?, ?)',
+                                 (key, now, now, len(blob), blob))
+                self._db.commit()
+                self._writes += 1
+            except Exception:
+                self.errors += 1
+                return
+        if self._writes % self.COMPACT_EVERY == 0:
+            self.compact()
+
+    def clear(self):
+        with self._lock:
+            try:
+                self._db.execute('DELETE FROM prompt_cache')
+                self._db.commit()
+            except Exception:
+                self.errors += 1
+
+    def compact(self):
+        """Drop expired rows, trim least recently used rows to max_bytes, reclaim space."""
+        with self._lock:
+            try:
+                cur = self._db.execute('DELETE FROM prompt_cache WHERE stored < ?', (time.time() - self.ttl,))
+                self.expired += cur.rowcount
+                total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM prompt_cache').fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    doomed = []
+                    for key, size in self._db.execute('SELECT key, size FROM prompt_cache ORDER BY accessed'):
+                        if excess <= 0:
+                            break
+                        doomed.append((key,))
+                        excess -= size
+                    self._db.executemany('DELETE FROM prompt_cache WHERE key = ?', doomed)
+                    self.evictions += len(doomed)
+                self._db.commit()
+                self._db.execute('PRAGMA incremental_vacuum')
+                self._db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            except Exception:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            try:
+                entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prompt_cache').fetchone()
+            except Exception:
+                entries, size = 0, 0
+            lookups = self.hits + self.misses
+            on_disk = sum(os.path.getsize(p) for p in (self.path, self.path + '-wal') if os.path.exists(p))
+            return {
+                'path': self.path,
+                'entries': entries,
+                'bytes': size,
+                'bytes_on_disk': on_disk,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'errors': self.errors,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+class SemanticCache:
+    """Nearest-neighbour cache over prompt embeddings.
+
+    Entries are grouped by scope (endpoint + model) so answers never cross
+    models or task types. Search is brute force over unit vectors: one matrix
+    product with NumPy if installed, otherwise pure-Python dot products, which
+    is fine for the few thousand entries this holds. lookup() remembers the
+    vector of a miss so the following put() of the same key can index it."""
+
+    def __init__(self, ttl, max_entries=2000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (stored_at, scope, vector, result)
+        self._scopes = {}  # scope -> {'keys': [...], 'matrix': np.ndarray or None}
+        self._pending = OrderedDict()  # key -> (scope, vector) of recent misses
+        self._sims = deque(maxlen=1000)  # best similarity of recent lookups
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vec):
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return array('f', (x / norm for x in vec))
+
+    def _scope_matrix(self, scope):
+        idx = self._scopes.get(scope)
+        if idx is None:
+            return [], None
+        if np is not None and idx['matrix'] is None and idx['keys']:
+            idx['matrix'] = np.array([self._entries[k][2] for k in idx['keys']], dtype=np.float32)
+        return idx['keys'], idx['matrix']
+
+    def lookup(self, key, scope, vec, threshold):
+        """Return (result copy or None, best similarity) for the closest prompt in scope."""
+        vec = self._unit(vec)
+        now = time.time()
+        with self._lock:
+            keys, matrix = self._scope_matrix(scope)
+            best_key, best = None, 0.0
+            if keys:
+                if matrix is not None:
+                    sims = matrix @ np.frombuffer(vec, dtype=np.float32)
+                    i = int(sims.argmax())
+                    best_key, best = keys[i], float(sims[i])
+                else:
+                    for k in keys:
+                        sim = sum(a * b for a, b in zip(self._entries[k][2], vec))
+                        if sim > best:
+                            best_key, best = k, sim
+            if keys:
+                self._sims.append(best)
+            if best_key is not None and best >= threshold:
+                stored, _, _, result = self._entries[best_key]
+                if now - stored < self.ttl:
+                    self.hits += 1
+                    return dict(result), round(best, 4)
+                self._remove(best_key)
+            self.misses += 1
+            self._pending[key] = (scope, vec)
+            while len(self._pending) > 256:
+                self._pending.popitem(last=False)
+            return None, round(best, 4)
+
+    def put(self, key, result):
+        """Index a result under the vector remembered from its missed lookup."""
+        with self._lock:
+            pending = self._pending.pop(key, None)
+            if pending is None:
+                return
+            scope, vec = pending
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), scope, vec, result)
+            idx = self._scopes.setdefault(scope, {'keys': [], 'matrix': None})
+            idx['keys'].append(key)
+            idx['matrix'] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._pending.clear()
+
+    def _remove(self, key):
+        _, scope, _, _ = self._entries.pop(key)
+        idx = self._scopes[scope]
+        idx['keys'].remove(key)
+        idx['matrix'] = None
+        if not idx['keys']:
+            del self._scopes[scope]
+
+    def stats(self):
+        with self._lock:
+            sims = sorted(self._sims)
+            lookups = self.hits + self.misses
+            pct = lambda q: round(sims[min(len(sims) - 1, int(len(sims) * q))], 4) if sims else None
+            # Histogram of best similarity per lookup in 0.05 buckets; "0.50" also holds anything lower
+            hist = {}
+            for sim in sims:
+                b = max(0.5, min(0.95, math.floor(sim * 20) / 20))
+                hist[f"{b:.2f}"] = hist.get(f"{b:.2f}", 0) + 1
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'similarity': {'p50': pct(0.5), 'p90': pct(0.9), 'p99': pct(0.99), 'histogram': hist},
+                'vector_backend': 'numpy' if np is not None else 'python',
+            }
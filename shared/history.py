@@ -0,0 +1,357 @@
+"""sheLLaMa usage history — in-memory ring buffers and an append-only SQLite (WAL) store."""
+
+import json
+import math
+import os
+import sqlite3
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:  # optional: vectorises downsampling
+    np = None
+
+# Raw tables: kind -> (series column, value column, all columns)
+KINDS = {
+    'ip_tokens': ('ip', 'tokens', ('ip', 'ts', 'tokens', 'task', 'prompt_tokens', 'response_tokens', 'cloud_fallback', 'cached')),
+    'backend_tokens': ('url', 'tokens', ('url', 'ts', 'tokens')),
+    'queue': ('url', 'queue_size', ('url', 'ts', 'queue_size')),
+}
+
+# Raw points older than this are rolled up into minute buckets, minute buckets
+# older than MINUTE_RETENTION into hour buckets.
+RAW_RETENTION = {'ip_tokens': 7 * 86400, 'backend_tokens': 86400, 'queue': 86400}
+MINUTE_RETENTION = 30 * 86400
+
+# Cost buckets (hour, day) of client token usage, keyed by task and fallback/cached flags
+COST_RESOLUTIONS = (3600, 86400)
+
+
+AGGS = ('sum', 'max', 'avg')
+
+
+class RingBuffer:
+    """Fixed-capacity time series: a timestamp column plus value columns, all array('d').
+
+    Appends are O(1) and overwrite the oldest point once full. Points must be
+    appended in time order, so a time range is two bisects per stored segment.
+    Not thread-safe; callers hold their own lock."""
+
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._ts = array('d')
+        self._cols = [array('d') for _ in self.fields]
+        self._next = 0  # slot overwritten by the next append once full
+
+    def __len__(self):
+        return len(self._ts)
+
+    def append(self, ts, *values):
+        if len(self._ts) < self.capacity:
+            self._ts.append(ts)
+            for col, v in zip(self._cols, values):
+                col.append(v)
+        else:
+            i = self._next
+            self._ts[i] = ts
+            for col, v in zip(self._cols, values):
+                col[i] = v
+            self._next = (i + 1) % self.capacity
+
+    def first_ts(self):
+        return self._ts[self._next] if self._ts else None
+
+    def last_ts(self):
+        return self._ts[self._next - 1] if self._ts else None
+
+    def _spans(self, since, until):
+        """Physical (start, stop) index ranges holding since <= ts <= until, oldest first."""
+        n = len(self._ts)
+        segments = [(self._next, n), (0, self._next)] if self._next else [(0, n)]
+        spans = []
+        for lo, hi in segments:
+            a = bisect_left(self._ts, since, lo, hi)
+            b = bisect_right(self._ts, until, lo, hi)
+            if a < b:
+                spans.append((a, b))
+        return spans
+
+    def slice(self, since=0, until=math.inf):
+        """Copy of the points in [since, until]: (timestamps, [column, ...]) as arrays."""
+        ts = array('d')
+        cols = [array('d') for _ in self.fields]
+        for a, b in self._spans(since, until):
+            ts.extend(self._ts[a:b])
+            for out, col in zip(cols, self._cols):
+                out.extend(col[a:b])
+        return ts, cols
+
+    def rows(self, since=0, until=math.inf):
+        """Points in [since, until] as (ts, value, ...) tuples."""
+        ts, cols = self.slice(since, until)
+        return zip(ts, *cols)
+
+    def downsample(self, since, until, step, aggs):
+        """Aggregate the points in [since, until]; see aggregate()."""
+        ts, cols = self.slice(since, until)
+        return aggregate(ts, cols, self.fields, step, aggs)
+
+
+def aggregate(ts, cols, fields, step, aggs):
+    """Bucket a time-ordered slice into step-second buckets aligned to multiples of step.
+
+    aggs maps each field to 'sum', 'max' or 'avg'. Returns a list of
+    (bucket_start, count, {field: value}) for non-empty buckets only."""
+    if not ts:
+        return []
+    if np is not None:
+        t = np.frombuffer(ts, dtype=np.float64)
+        idx = np.floor(t / step).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(idx)) + 1))
+        counts = np.diff(np.append(starts, len(t)))
+        values = {}
+        for field, col in zip(fields, cols):
+            v = np.frombuffer(col, dtype=np.float64)
+            agg = aggs[field]
+            if agg == 'max':
+                values[field] = np.maximum.reduceat(v, starts).tolist()
+            else:
+                sums = np.add.reduceat(v, starts)
+                values[field] = (sums / counts if agg == 'avg' else sums).tolist()
+        buckets = (idx[starts] * step).tolist()
+        counts = counts.tolist()
+        return [(buckets[i], counts[i], {f: values[f][i] for f in fields}) for i in range(len(buckets))]
+    out = []
+    cur, count, acc = None, 0, None
+    for i, t in enumerate(ts):
+        b = math.floor(t / step)
+        if b != cur:
+            if cur is not None:
+                out.append((cur * step, count, acc))
+            cur, count, acc = b, 0, {f: (-math.inf if aggs[f] == 'max' else 0.0) for f in fields}
+        count += 1
+        for field, col in zip(fields, cols):
+            acc[field] = max(acc[field], col[i]) if aggs[field] == 'max' else acc[field] + col[i]
+    out.append((cur * step, count, acc))
+    for _, count, acc in out:
+        for field in fields:
+            if aggs[field] == 'avg':
+                acc[field] /= count
+    return out
+
+
+class HistoryStore:
+    """Append-only store for the frontend's token and queue history.
+
+    Points are buffered by add() and written by flush() in one transaction, so
+    persisting costs O(new points) instead of rewriting the whole history.
+    Small state (totals, usage stats) lives in a key/value table. compact()
+    rolls old raw points up into minute and hour buckets (count/sum/max).
+    Cost buckets are kept forever and upserted by flush()."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._pending = {kind: [] for kind in KINDS}
+        self._pending_costs = {}  # (resolution, bucket, task, fallback, cached) -> [requests, prompt, response, tokens]
+        self.written = 0
+        self.last_flush = None
+        self.last_compact = None
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS ip_tokens (ip TEXT, ts REAL, tokens INTEGER, task TEXT, '
+                         'prompt_tokens INTEGER, response_tokens INTEGER, cloud_fallback INTEGER, cached INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS backend_tokens (url TEXT, ts REAL, tokens INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS queue (url TEXT, ts REAL, queue_size REAL)')
+        for kind, (series, _, _) in KINDS.items():
+            self._db.execute(f'CREATE INDEX IF NOT EXISTS {kind}_series_ts ON {kind}({series}, ts)')
+            self._db.execute(f'CREATE INDEX IF NOT EXISTS {kind}_ts ON {kind}(ts)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS rollup (kind TEXT, series TEXT, resolution INTEGER, bucket REAL, '
+                         'count INTEGER, sum REAL, max REAL, PRIMARY KEY (kind, series, resolution, bucket))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cost_buckets (resolution INTEGER, bucket INTEGER, task TEXT, '
+                         'cloud_fallback INTEGER, cached INTEGER, requests INTEGER, prompt_tokens INTEGER, '
+                         'response_tokens INTEGER, tokens INTEGER, '
+                         'PRIMARY KEY (resolution, bucket, task, cloud_fallback, cached))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+        self._db.commit()
+
+    def add(self, kind, row):
+        """Buffer one raw point; row is a tuple in KINDS[kind] column order."""
+        with self._lock:
+            self._pending[kind].append(row)
+
+    def add_cost(self, ts, task, fallback, cached, prompt_tokens, response_tokens, tokens):
+        """Count one client request into its hour and day cost buckets."""
+        with self._lock:
+            for res in COST_RESOLUTIONS:
+                key = (res, int(ts // res) * res, task, int(bool(fallback)), int(bool(cached)))
+                c = self._pending_costs.setdefault(key, [0, 0, 0, 0])
+                c[0] += 1
+                c[1] += prompt_tokens
+                c[2] += response_tokens
+                c[3] += tokens
+
+    def flush(self):
+        """Write buffered points and cost increments. Returns the number of points written."""
+        with self._lock:
+            pending, self._pending = self._pending, {kind: [] for kind in KINDS}
+            costs, self._pending_costs = self._pending_costs, {}
+            written = 0
+            for kind, rows in pending.items():
+                if rows:
+                    cols = KINDS[kind][2]
+                    self._db.executemany(f'INSERT INTO {kind} VALUES ({", ".join("?" * len(cols))})', rows)
+                    written += len(rows)
+            if costs:
+                self._db.executemany(
+                    'INSERT INTO cost_buckets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (resolution, bucket, task, cloud_fallback, cached) DO UPDATE SET '
+                    'requests = requests + excluded.requests, prompt_tokens = prompt_tokens + excluded.prompt_tokens, '
+                    'response_tokens = response_tokens + excluded.response_tokens, tokens = tokens + excluded.tokens',
+                    [key + tuple(c) for key, c in costs.items()])
+            self._db.commit()
+            self.written += written
+            self.last_flush = time.time()
+        return written
+
+    def get_state(self):
+        with self._lock:
+            return {k: json.loads(v) for k, v in self._db.execute('SELECT key, value FROM state')}
+
+    def set_state(self, items):
+        """Store already-serialised JSON values: {key: json_text}."""
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)', items.items())
+            self._db.commit()
+
+    def tail(self, kind, limit, before):
+        """Latest `limit` raw points per series with ts < before, oldest first: {series: [row tuple]}.
+
+        Rows are in KINDS[kind] column order without the series column."""
+        series_col, _, cols = KINDS[kind]
+        out = {}
+        with self._lock:
+            names = [r[0] for r in self._db.execute(f'SELECT DISTINCT {series_col} FROM {kind}')]
+            for name in names:
+                rows = self._db.execute(f'SELECT {", ".join(cols[1:])} FROM {kind} WHERE {series_col} = ? AND ts < ? '
+                                        f'ORDER BY ts DESC LIMIT ?', (name, before, limit)).fetchall()
+                rows.reverse()
+                out[name] = rows
+        return out
+
+    def buckets(self, kind, since, until, step):
+        """Step-aligned buckets of a kind's value column over [since, until), from raw points and rollups.
+
+        Returns {series: [(bucket_start, count, sum, max)]} in time order. Rollup
+        buckets count whole, so their resolution should not exceed step."""
+        series_col, value_col, _ = KINDS[kind]
+        out = {}
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT series, b, SUM(c), SUM(s), MAX(m) FROM ('
+                f'SELECT {series_col} AS series, CAST(ts / ? AS INTEGER) AS b, COUNT(*) AS c, '
+                f'SUM({value_col}) AS s, MAX({value_col}) AS m FROM {kind} WHERE ts >= ? AND ts < ? '
+                f'GROUP BY {series_col}, b '
+                'UNION ALL SELECT series, CAST(bucket / ? AS INTEGER), count, sum, max FROM rollup '
+                'WHERE kind = ? AND bucket >= ? AND bucket < ?'
+                ') GROUP BY series, b ORDER BY series, b',
+                (step, since, until, step, kind, since, until)).fetchall()
+        for series, b, count, total, peak in rows:
+            out.setdefault(series, []).append((b * step, count, total, peak))
+        return out
+
+    def cost_buckets(self):
+        """All cost buckets as (resolution, bucket, task, fallback, cached, requests, prompt, response, tokens)."""
+        with self._lock:
+            return self._db.execute('SELECT * FROM cost_buckets').fetchall()
+
+    def cost_cells(self, resolution, since, until):
+        """Stored cost buckets of one resolution starting in [since, until), summed per cell:
+        [((task, fallback, cached), (requests, prompt, response, tokens))]."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT task, cloud_fallback, cached, SUM(requests), SUM(prompt_tokens), SUM(response_tokens), '
+                'SUM(tokens) FROM cost_buckets WHERE resolution = ? AND bucket >= ? AND bucket < ? '
+                'GROUP BY task, cloud_fallback, cached', (resolution, since, until)).fetchall()
+        return [((task, bool(fb), bool(cached)), tuple(v)) for task, fb, cached, *v in rows]
+
+    def cost_points(self, since, until):
+        """Raw client points in [since, until] summed per cost cell, same shape as cost_cells().
+        Only covers RAW_RETENTION['ip_tokens']; older points exist only as rollups."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT task, cloud_fallback, cached, COUNT(*), SUM(prompt_tokens), SUM(response_tokens), '
+                'SUM(tokens) FROM ip_tokens WHERE ts >= ? AND ts <= ? '
+                'GROUP BY task, cloud_fallback, cached', (since, until)).fetchall()
+        return [((task, bool(fb), bool(cached)), tuple(v)) for task, fb, cached, *v in rows]
+
+    def backfill_costs(self):
+        """Build cost buckets from raw client points if there are none yet. Returns True if it did."""
+        with self._lock:
+            if self._db.execute('SELECT 1 FROM cost_buckets LIMIT 1').fetchone():
+                return False
+            for res in COST_RESOLUTIONS:
+                self._db.execute(
+                    'INSERT INTO cost_buckets SELECT ?, CAST(ts / ? AS INTEGER) * ?, task, cloud_fallback, cached, '
+                    'COUNT(*), SUM(prompt_tokens), SUM(response_tokens), SUM(tokens) FROM ip_tokens '
+                    'GROUP BY CAST(ts / ? AS INTEGER), task, cloud_fallback, cached', (res, res, res, res))
+            self._db.commit()
+            return True
+
+    def import_points(self, kind, rows):
+        """Bulk-insert historical points (used to migrate the old JSON history file)."""
+        with self._lock:
+            self._db.executemany(f'INSERT INTO {kind} VALUES ({", ".join("?" * len(KINDS[kind][2]))})', rows)
+            self._db.commit()
+
+    def compact(self, now=None):
+        """Roll raw points past retention into minute buckets, old minutes into hours."""
+        now = now or time.time()
+        with self._lock:
+            for kind, (series_col, value_col, _) in KINDS.items():
+                cutoff = now - RAW_RETENTION[kind]
+                self._db.execute(
+                    f'INSERT INTO rollup SELECT ?, {series_col}, 60, CAST(ts / 60 AS INTEGER) * 60, '
+                    f'COUNT(*), SUM({value_col}), MAX({value_col}) FROM {kind} WHERE ts < ? '
+                    f'GROUP BY {series_col}, CAST(ts / 60 AS INTEGER) '
+                    'ON CONFLICT (kind, series, resolution, bucket) DO UPDATE SET '
+                    'count = count + excluded.count, sum = sum + excluded.sum, max = MAX(max, excluded.max)',
+                    (kind, cutoff))
+                self._db.execute(f'DELETE FROM {kind} WHERE ts < ?', (cutoff,))
+            cutoff = now - MINUTE_RETENTION
+            self._db.execute(
+                'INSERT INTO rollup SELECT kind, series, 3600, CAST(bucket / 3600 AS INTEGER) * 3600, '
+                'SUM(count), SUM(sum), MAX(max) FROM rollup WHERE resolution = 60 AND bucket < ? '
+                'GROUP BY kind, series, CAST(bucket / 3600 AS INTEGER) '
+                'ON CONFLICT (kind, series, resolution, bucket) DO UPDATE SET '
+                'count = count + excluded.count, sum = sum + excluded.sum, max = MAX(max, excluded.max)',
+                (cutoff,))
+            self._db.execute('DELETE FROM rollup WHERE resolution = 60 AND bucket < ?', (cutoff,))
+            self._db.commit()
+            self._db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            self.last_compact = now
+
+    def stats(self):
+        with self._lock:
+            rows = {kind: self._db.execute(f'SELECT COUNT(*) FROM {kind}').fetchone()[0] for kind in KINDS}
+            rollups = dict(self._db.execute('SELECT resolution, COUNT(*) FROM rollup GROUP BY resolution').fetchall())
+            costs = self._db.execute('SELECT COUNT(*) FROM cost_buckets').fetchone()[0]
+            pending = sum(len(r) for r in self._pending.values())
+        on_disk = sum(os.path.getsize(p) for p in (self.path, self.path + '-wal') if os.path.exists(p))
+        return {
+            'path': self.path,
+            'rows': rows,
+            'minute_buckets': rollups.get(60, 0),
+            'hour_buckets': rollups.get(3600, 0),
+            'cost_buckets': costs,
+            'pending': pending,
+            'written': self.written,
+            'bytes_on_disk': on_disk,
+            'last_flush': self.last_flush,
+            'last_compact': self.last_compact,
+        }
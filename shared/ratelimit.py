@@ -0,0 +1,248 @@
+"""sheLLaMa rate limiter state — bucketed sliding windows, in memory or shared via SQLite."""
+
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from array import array
+from threading import Lock
+
+# Windows kept per API key: requests over a minute in 1s buckets, and
+# (tokens, cloud prompt tokens, cloud response tokens) over a day in 1min buckets
+RPM_SPAN, RPM_SLOTS = 60, 60
+DAY_SPAN, DAY_SLOTS = 86400, 1440
+DAY_FIELDS = 3
+
+
+class SlidingWindow:
+    """Sums of one or more counters over the last `span` seconds.
+
+    The span is split into `slots` buckets in a flat array; running totals are
+    updated on add and when buckets fall out of the window, so reads and
+    writes are O(1) amortised however many events the window holds. The
+    window slides a bucket at a time."""
+
+    __slots__ = ('width', 'slots', 'fields', 'head', 'values', 'totals')
+
+    def __init__(self, span, slots, fields=1):
+        self.width = span / slots
+        self.slots = slots
+        self.fields = fields
+        self.head = None  # newest bucket number seen
+        self.values = array('q', bytes(8 * slots * fields))
+        self.totals = [0] * fields
+
+    def _advance(self, now):
+        cur = int(now // self.width)
+        if self.head is None or cur - self.head >= self.slots:
+            self.values = array('q', bytes(8 * self.slots * self.fields))
+            self.totals = [0] * self.fields
+        elif cur > self.head:
+            for b in range(self.head + 1, cur + 1):
+                base = (b % self.slots) * self.fields
+                for f in range(self.fields):
+                    self.totals[f] -= self.values[base + f]
+                    self.values[base + f] = 0
+        if self.head is None or cur > self.head:
+            self.head = cur
+        return cur
+
+    def add(self, now, *amounts):
+        base = (self._advance(now) % self.slots) * self.fields
+        for f, a in enumerate(amounts):
+            self.values[base + f] += a
+            self.totals[f] += a
+
+    def total(self, now):
+        self._advance(now)
+        return list(self.totals)
+
+    def dump(self):
+        return {'head': self.head, 'values': self.values.tolist()}
+
+    def restore(self, state):
+        values = state.get('values', [])
+        if len(values) == self.slots * self.fields:
+            self.head = state.get('head')
+            self.values = array('q', values)
+            self.totals = [sum(values[f::self.fields]) for f in range(self.fields)]
+
+
+class LimiterUnavailable(Exception):
+    """Shared rate limit state could not be read or updated (e.g. the database stayed locked)."""
+
+
+class Limiter(ABC):
+    """Interface for rate limit state shared by require_auth.
+
+    hit() must check and count atomically across every frontend using the
+    same state, or horizontal scaling multiplies each key's limit. A
+    networked store (e.g. Redis with a Lua script or INCR on per-bucket keys)
+    would implement these same three methods, raising LimiterUnavailable
+    when the store can't be reached."""
+
+    @abstractmethod
+    def hit(self, key, rpm, now):
+        """Count a request against `rpm` per minute. Returns False if it is over the limit."""
+
+    @abstractmethod
+    def day_usage(self, key, now):
+        """(tokens, cloud prompt tokens, cloud response tokens) over the last day."""
+
+    @abstractmethod
+    def record(self, key, now, tokens, cloud_prompt, cloud_response):
+        """Count tokens (and cloud fallback tokens) used by a key's request."""
+
+    def save(self):
+        pass
+
+    def load(self):
+        pass
+
+
+class MemoryLimiter(Limiter):
+    """Per-key rate limit counters in process memory.
+
+    Optionally persisted to a JSON file (save()/load()) so limits survive a
+    restart of a single frontend."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = Lock()
+        self._requests = {}  # key -> SlidingWindow(RPM)
+        self._day = {}       # key -> SlidingWindow(DAY, DAY_FIELDS)
+
+    def hit(self, key, rpm, now):
+        with self._lock:
+            w = self._requests.get(key)
+            if w is None:
+                w = self._requests[key] = SlidingWindow(RPM_SPAN, RPM_SLOTS)
+            if w.total(now)[0] >= rpm:
+                return False
+            w.add(now, 1)
+            return True
+
+    def day_usage(self, key, now):
+        with self._lock:
+            w = self._day.get(key)
+            return tuple(w.total(now)) if w is not None else (0,) * DAY_FIELDS
+
+    def record(self, key, now, tokens, cloud_prompt, cloud_response):
+        with self._lock:
+            w = self._day.get(key)
+            if w is None:
+                w = self._day[key] = SlidingWindow(DAY_SPAN, DAY_SLOTS, DAY_FIELDS)
+            w.add(now, tokens, cloud_prompt, cloud_response)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {'requests': {k: w.dump() for k, w in self._requests.items()},
+                     'day': {k: w.dump() for k, w in self._day.items()}}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        with self._lock:
+            for key, s in state.get('requests', {}).items():
+                w = self._requests[key] = SlidingWindow(RPM_SPAN, RPM_SLOTS)
+                w.restore(s)
+            for key, s in state.get('day', {}).items():
+                w = self._day[key] = SlidingWindow(DAY_SPAN, DAY_SLOTS, DAY_FIELDS)
+                w.restore(s)
+
+
+class SQLiteLimiter(Limiter):
+    """Rate limit counters in a SQLite file shared by co-located frontends.
+
+    Same buckets as MemoryLimiter, one row per (key, bucket). hit() runs its
+    check and increment in one BEGIN IMMEDIATE transaction, so concurrent
+    frontends can't both take the last request of a minute. Reads sum at most
+    RPM_SLOTS or DAY_SLOTS rows through the primary key. Expired buckets are
+    deleted every PRUNE_EVERY writes. A database still locked after the
+    connection timeout raises LimiterUnavailable."""
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS rate_requests (key TEXT, bucket INTEGER, count INTEGER, '
+                         'PRIMARY KEY (key, bucket))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS rate_day (key TEXT, bucket INTEGER, tokens INTEGER, '
+                         'cloud_prompt INTEGER, cloud_response INTEGER, PRIMARY KEY (key, bucket))')
+
+    def hit(self, key, rpm, now):
+        bucket = int(now // (RPM_SPAN / RPM_SLOTS))
+        with self._lock:
+            try:
+                self._db.execute('BEGIN IMMEDIATE')
+                try:
+                    count = self._db.execute('SELECT COALESCE(SUM(count), 0) FROM rate_requests '
+                                             'WHERE key = ? AND bucket > ?', (key, bucket - RPM_SLOTS)).fetchone()[0]
+                    allowed = count < rpm
+                    if allowed:
+                        self._db.execute('INSERT INTO rate_requests VALUES (?, ?, 1) '
+                                         'ON CONFLICT (key, bucket) DO UPDATE SET count = count + 1', (key, bucket))
+                    self._db.execute('COMMIT')
+                except BaseException:
+                    self._db.execute('ROLLBACK')
+                    raise
+                self._wrote(now)
+            except sqlite3.OperationalError as e:
+                raise LimiterUnavailable(f'rate limit state unavailable: {e}') from e
+            return allowed
+
+    def day_usage(self, key, now):
+        bucket = int(now // (DAY_SPAN / DAY_SLOTS))
+        with self._lock:
+            try:
+                return tuple(self._db.execute(
+                    'SELECT COALESCE(SUM(tokens), 0), COALESCE(SUM(cloud_prompt), 0), COALESCE(SUM(cloud_response), 0) '
+                    'FROM rate_day WHERE key = ? AND bucket > ?', (key, bucket - DAY_SLOTS)).fetchone())
+            except sqlite3.OperationalError as e:
+                raise LimiterUnavailable(f'rate limit state unavailable: {e}') from e
+
+    def record(self, key, now, tokens, cloud_prompt, cloud_response):
+        bucket = int(now // (DAY_SPAN / DAY_SLOTS))
+        with self._lock:
+            try:
+                self._db.execute('INSERT INTO rate_day VALUES (?, ?, ?, ?, ?) ON CONFLICT (key, bucket) DO UPDATE SET '
+                                 'tokens = tokens + excluded.tokens, cloud_prompt = cloud_prompt + excluded.cloud_prompt, '
+                                 'cloud_response = cloud_response + excluded.cloud_response',
+                                 (key, bucket, tokens, cloud_prompt, cloud_response))
+                self._wrote(now)
+            except sqlite3.OperationalError as e:
+                raise LimiterUnavailable(f'rate limit state unavailable: {e}') from e
+
+    def _wrote(self, now):
+        """Count a write; every PRUNE_EVERY writes delete buckets that left their window."""
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._db.execute('DELETE FROM rate_requests WHERE bucket <= ?',
+                             (int(now // (RPM_SPAN / RPM_SLOTS)) - RPM_SLOTS,))
+            self._db.execute('DELETE FROM rate_day WHERE bucket <= ?',
+                             (int(now // (DAY_SPAN / DAY_SLOTS)) - DAY_SLOTS,))
+
+
+def make_limiter(spec, state_path=None):
+    """Limiter for SHELLAMA_RATE_BACKEND: 'memory' (default) or 'sqlite:/path/to/file.db'."""
+    if spec.startswith('sqlite:'):
+        return SQLiteLimiter(spec[len('sqlite:'):])
+    if spec not in ('', 'memory'):
+        raise ValueError(f"unknown rate limit backend {spec!r}")
+    return MemoryLimiter(state_path)
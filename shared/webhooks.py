@@ -0,0 +1,124 @@
+"""sheLLaMa webhook delivery — background dispatcher with retries and a dead-letter file."""
+
+import heapq
+import itertools
+import json
+import time
+from collections import deque
+from queue import Queue, Full
+from threading import Condition, Lock, Thread
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class WebhookDispatcher:
+    """Delivers webhook payloads off the caller's thread.
+
+    send() enqueues one delivery per URL on a bounded queue and returns at
+    once. `workers` threads POST concurrently; a failed delivery (error or
+    non-2xx) is retried after backoff * 2**attempt seconds up to `retries`
+    times, then appended to the dead-letter file as a JSON line, as are
+    deliveries dropped because the queue is full."""
+
+    def __init__(self, dead_letter=None, workers=4, max_queue=1000, retries=5, backoff=2.0, timeout=5):
+        self.dead_letter = dead_letter
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._queue = Queue(maxsize=max_queue)
+        self._retry = []  # heap of (due, seq, url, payload, attempt)
+        self._retry_cond = Condition()
+        self._seq = itertools.count()
+        self._stats = {}
+        self._lock = Lock()
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+        self._session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+        for _ in range(workers):
+            Thread(target=self._worker, daemon=True).start()
+        Thread(target=self._retry_loop, daemon=True).start()
+
+    def send(self, urls, payload):
+        for url in urls:
+            try:
+                self._queue.put_nowait((url, payload, 0))
+            except Full:
+                self._dead(url, payload, 0, 'queue full')
+
+    def _url_stats(self, url):
+        st = self._stats.get(url)
+        if st is None:
+            st = self._stats[url] = {'delivered': 0, 'failed': 0, 'retried': 0, 'dead': 0,
+                                     'last_status': None, 'last_error': None, 'latency': deque(maxlen=100)}
+        return st
+
+    def _worker(self):
+        while True:
+            url, payload, attempt = self._queue.get()
+            t0 = time.time()
+            try:
+                r = self._session.post(url, json=payload, timeout=self.timeout)
+                error = None if r.ok else f'HTTP {r.status_code}'
+                status = r.status_code
+            except Exception as e:
+                error, status = str(e), None
+            latency = time.time() - t0
+            with self._lock:
+                st = self._url_stats(url)
+                st['latency'].append(latency)
+                st['last_status'] = status
+                if error is None:
+                    st['delivered'] += 1
+                else:
+                    st['failed'] += 1
+                    st['last_error'] = error
+            if error is None:
+                continue
+            if attempt < self.retries:
+                with self._lock:
+                    st['retried'] += 1
+                with self._retry_cond:
+                    due = time.time() + self.backoff * 2 ** attempt
+                    heapq.heappush(self._retry, (due, next(self._seq), url, payload, attempt + 1))
+                    self._retry_cond.notify()
+            else:
+                self._dead(url, payload, attempt + 1, error)
+
+    def _retry_loop(self):
+        """Move retries whose backoff has elapsed back onto the delivery queue."""
+        while True:
+            with self._retry_cond:
+                while not self._retry or self._retry[0][0] > time.time():
+                    self._retry_cond.wait(self._retry[0][0] - time.time() if self._retry else None)
+                _, _, url, payload, attempt = heapq.heappop(self._retry)
+            try:
+                self._queue.put_nowait((url, payload, attempt))
+            except Full:
+                self._dead(url, payload, attempt, 'queue full')
+
+    def _dead(self, url, payload, attempts, error):
+        with self._lock:
+            self._url_stats(url)['dead'] += 1
+            if not self.dead_letter:
+                return
+            try:
+                with open(self.dead_letter, 'a') as f:
+                    f.write(json.dumps({'time': time.time(), 'url': url, 'attempts': attempts,
+                                        'error': error, 'payload': payload}) + '\n')
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            per_url = {}
+            for url, st in self._stats.items():
+                lat = sorted(st['latency'])
+                per_url[url] = {
+                    **{k: st[k] for k in ('delivered', 'failed', 'retried', 'dead', 'last_status', 'last_error')},
+                    'latency_avg': round(sum(lat) / len(lat), 3) if lat else None,
+                    'latency_p95': round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 3) if lat else None,
+                }
+        with self._retry_cond:
+            retrying = len(self._retry)
+        return {'queued': self._queue.qsize(), 'retrying': retrying, 'dead_letter': self.dead_letter, 'urls': per_url}
@@ -79,6 +79,41 @@ def test_backend_queue_status(base):
     assert "active" in d, "missing active"
     ok("queue-status returns valid JSON", f"queue={d['queue_size']}")
 
+@test("Backend: /queue-status worker slots", tags=["backend", "status"])
+def test_backend_worker_slots(base):
+    d = get(f"{base}/queue-status").json()
+    assert d.get("slots", 0) >= 1, "missing slots"
+    assert isinstance(d.get("active_tasks"), list), "missing active_tasks"
+    assert d.get("slots_busy", 0) == len(d["active_tasks"]), "slots_busy mismatch"
+    ok("worker slots", f"{d['slots_busy']}/{d['slots']} busy")
+
+@test("Backend: /queue-status scheduler", tags=["backend", "status"])
+def test_backend_scheduler(base):
+    d = get(f"{base}/queue-status").json()
+    sched = d.get("scheduler")
+    if sched is None and "backends" in d:
+        skip("scheduler", "not a direct backend")
+        return
+    assert set(sched.get("wait", {})) == {"interactive", "codegen", "batch"}, f"unexpected classes: {sched}"
+    assert sum(sched["queued"].values()) <= d["queue_size"], "queued count exceeds queue_size"
+    ok("scheduler", f"queued={sched['queued']}")
+
+@test("Backend: /host-stats", tags=["backend", "status"])
+def test_backend_host_stats(base):
+    t0 = time.time()
+    get(f"{base}/queue-status")
+    elapsed = time.time() - t0
+    r = get(f"{base}/host-stats")
+    if r.status_code == 404:
+        skip("host-stats", "not a direct backend")
+        return
+    d = r.json()
+    assert isinstance(d.get("samples"), list), "missing samples"
+    if d["samples"]:
+        assert "cpu_percent" in d["samples"][-1] and "per_core" in d["samples"][-1], "incomplete sample"
+    assert elapsed < 0.5, f"/queue-status took {elapsed:.2f}s, should not block on CPU sampling"
+    ok("host-stats", f"{len(d['samples'])} samples, status in {elapsed * 1000:.0f}ms")
+
 @test("Backend: /models", tags=["backend", "models"])
 def test_backend_models(base):
     r = get(f"{base}/models")
@@ -88,6 +123,20 @@ def test_backend_models(base):
     names = [m.get("name", m.get("model", "")) for m in d["models"]]
     ok("models endpoint", f"{len(names)} models")
 
+@test("Backend: model registry metadata", tags=["backend", "models"])
+def test_backend_model_registry(base):
+    d = get(f"{base}/models").json()
+    if "refreshed" not in d:
+        skip("model registry", "not a backend")
+        return
+    for m in d["models"]:
+        for key in ("size", "family", "quantization", "context_length"):
+            assert key in m, f"{m.get('name')}: missing {key}"
+    r = post(f"{base}/models/refresh", {})
+    assert r.status_code == 200, f"refresh: HTTP {r.status_code}"
+    assert r.json()["refreshed"] >= d["refreshed"], "refresh did not update the registry"
+    ok("model registry", f"{len(d['models'])} models, refreshed {time.time() - d['refreshed']:.0f}s ago")
+
 @test("Backend: /chat", tags=["backend", "chat"])
 def test_backend_chat(base):
     r = post(f"{base}/chat", {"message": "Reply with only the word PONG", "model": DEFAULT_MODEL})
@@ -143,6 +192,15 @@ def test_backend_heartbeat(base):
     assert r.status_code == 404, f"expected 404, got {r.status_code}"
     ok("heartbeat rejects unknown task_id")
 
+@test("Backend: /cancel/<task_id>", tags=["backend", "cancel"])
+def test_backend_cancel(base):
+    r = post(f"{base}/cancel/nonexistent", {})
+    if r.status_code == 200 and "backends" in r.json():
+        skip("cancel endpoint", "not a direct backend")
+        return
+    assert r.status_code == 404, f"expected 404, got {r.status_code}"
+    ok("cancel rejects unknown task_id")
+
 @test("Backend: /stop", tags=["backend", "admin"])
 def test_backend_stop(base):
     r = post(f"{base}/stop", {})
@@ -155,6 +213,19 @@ def test_backend_stop(base):
     assert "queue_cleared" in d, f"unexpected response: {d}"
     ok("stop endpoint", f"cleared={d['queue_cleared']}")
 
+@test("Backend: /model-lifecycle", tags=["backend", "models"])
+def test_model_lifecycle(base):
+    r = get(f"{base}/model-lifecycle")
+    if r.status_code == 404:
+        skip("model lifecycle", "not a backend")
+        return
+    d = r.json()
+    assert "models" in d and "default_keep_alive" in d, f"unexpected response: {d}"
+    r = post(f"{base}/model-lifecycle", {"model": "test-model", "action": "bogus"})
+    assert r.status_code == 400, f"bad action should be rejected, got HTTP {r.status_code}"
+    loaded = [m for m, st in d["models"].items() if st["loaded"]]
+    ok("model lifecycle", f"{len(d['models'])} models tracked, {len(loaded)} loaded")
+
 # ── Frontend routing tests ──────────────────────────────────────────────────
 
 @test("Frontend: /queue-status (aggregate)", tags=["frontend", "status"])
@@ -167,6 +238,71 @@ def test_frontend_queue_status(base):
     healthy = sum(1 for b in d["backends"] if b.get("health") == "healthy")
     ok("frontend queue-status", f"{healthy}/{d['total_backends']} healthy")
 
+@test("Frontend: /cancel/<task_id>", tags=["frontend", "cancel"])
+def test_frontend_cancel(base):
+    r = post(f"{base}/cancel/test-unknown-task", {})
+    assert r.status_code == 404, f"expected 404, got {r.status_code}"
+    again = post(f"{base}/cancel/test-unknown-task", {})
+    assert again.status_code == 404, "cancelling an unknown task registered it"
+    ok("cancel rejects unknown task_id")
+
+@test("Frontend: /queue-status snapshot freshness", tags=["frontend", "status"])
+def test_frontend_status_snapshot(base):
+    d = get(f"{base}/queue-status").json()
+    online = [b for b in d.get("backends", []) if b.get("status") == "online"]
+    if not online:
+        skip("status snapshot", "no online backends")
+        return
+    for b in online:
+        assert b.get("status_age") is not None and b["status_age"] < 30, f"stale snapshot: {b.get('url')}"
+    t0 = time.time()
+    get(f"{base}/queue-status")
+    ok("status snapshot", f"{len(online)} online, served in {time.time() - t0:.2f}s")
+
+@test("Frontend: model affinity", tags=["frontend", "status"])
+def test_frontend_affinity(base):
+    d = get(f"{base}/queue-status").json()
+    aff = d.get("affinity")
+    if aff is None:
+        skip("model affinity", "not a frontend")
+        return
+    urls = {b["url"] for b in d["backends"]}
+    for model, homes in aff["homes"].items():
+        assert homes and set(homes) <= urls, f"bad home set for {model}: {homes}"
+    for b in d["backends"]:
+        assert b["model_loads"] >= 0 and b["model_unloads"] >= 0, f"bad swap counts: {b['url']}"
+    swaps = sum(b["model_loads"] + b["model_unloads"] for b in d["backends"])
+    ok("model affinity", f"{len(aff['homes'])} models homed, {swaps} load/unload events")
+
+@test("Frontend: capacity index", tags=["frontend", "models"])
+def test_frontend_capacity(base):
+    d = get(f"{base}/queue-status").json()
+    online = [b for b in d.get("backends", []) if b.get("status") == "online"]
+    if not online or "runnable_models" not in online[0]:
+        skip("capacity index", "no online backends")
+        return
+    models = {m["name"]: m for m in get(f"{base}/models").json()["models"]}
+    for b in online:
+        for name in b["runnable_models"]:
+            size = models.get(name, {}).get("size") or 0
+            assert size <= b["ram_total_gb"] * 1e9, f"{name} ({size / 1e9:.1f} GB) routed to {b['url']} with {b['ram_total_gb']} GB"
+    ok("capacity index", ", ".join(f"{b['url']}: {len(b['runnable_models'])}" for b in online))
+
+@test("Frontend: learned backend speeds", tags=["frontend", "status"])
+def test_frontend_speed(base):
+    d = get(f"{base}/queue-status").json()
+    online = [b for b in d.get("backends", []) if b.get("status") == "online"]
+    if not online or "speed" not in online[0]:
+        skip("learned speeds", "no online backends")
+        return
+    learned = 0
+    for b in online:
+        for model, sp in b["speed"].items():
+            assert sp["gen_tps"] > 0 and (sp["prompt_tps"] is None or sp["prompt_tps"] > 0), f"{b['url']} {model}: {sp}"
+            assert sp["predicted_seconds"] is None or sp["predicted_seconds"] > 0, f"{b['url']} {model}: {sp}"
+            learned += 1
+    ok("learned speeds", f"{learned} (backend, model) estimates")
+
 @test("Frontend: /models", tags=["frontend", "models"])
 def test_frontend_models(base):
     r = get(f"{base}/models")
@@ -174,6 +310,29 @@ def test_frontend_models(base):
     assert "models" in d, "missing models"
     ok("frontend models", f"{len(d['models'])} models")
 
+@test("Frontend: /models fan-out latency", tags=["frontend", "models"])
+def test_frontend_models_fanout(base):
+    d = get(f"{base}/models").json()
+    backends = d.get("backends")
+    if backends is None:
+        skip("models fan-out", "not a frontend")
+        return
+    latencies = [b["latency"] for b in backends.values() if b.get("ok")]
+    assert latencies, f"no backend answered: {backends}"
+    ok("models fan-out", f"{len(latencies)}/{len(backends)} backends, slowest {max(latencies):.2f}s")
+
+@test("Frontend: /api/backend-pools connection reuse", tags=["frontend", "admin"])
+def test_backend_pools(base):
+    r = get(f"{base}/api/backend-pools")
+    if r.status_code in (401, 403, 404):
+        skip("backend pools", f"HTTP {r.status_code}")
+        return
+    pools = r.json()
+    assert pools, "no backend pools yet"
+    busiest = max(pools.values(), key=lambda p: p["requests"])
+    assert busiest["new_connections"] <= busiest["requests"], f"bad counters: {busiest}"
+    ok("backend pools", f"{len(pools)} pools, reuse {busiest['hit_rate']}")
+
 @test("Frontend: /chat routed", tags=["frontend", "chat"])
 def test_frontend_chat(base):
     r = post(f"{base}/chat", {"message": "Reply PONG only", "model": DEFAULT_MODEL})
@@ -239,6 +398,43 @@ def test_openai_compat(base):
     assert d["choices"][0].get("message", {}).get("content"), "empty content"
     ok("OpenAI /v1/chat/completions", f"{d.get('usage', {}).get('total_tokens', '?')} tok")
 
+@test("Frontend: /chat streaming", tags=["frontend", "chat", "stream"])
+def test_frontend_chat_stream(base):
+    r = requests.post(f"{base}/chat", json={"message": "Reply PONG only", "model": DEFAULT_MODEL, "stream": True},
+                      timeout=TIMEOUT, stream=True)
+    assert r.headers.get("Content-Type", "").startswith("text/event-stream"), "not an event stream"
+    tokens, final = [], None
+    for line in r.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data: "):
+            continue
+        ev = json.loads(line[6:])
+        if ev.get("done"):
+            final = ev
+            break
+        if ev.get("token"):
+            tokens.append(ev["token"])
+    assert final is not None, "no final event"
+    assert not final.get("error"), f"error: {final.get('error')}"
+    assert tokens, "no tokens streamed"
+    ok("chat streaming", f"{len(tokens)} chunks, ttft={final.get('ttft')}s")
+
+@test("Frontend: /v1/chat/completions streaming", tags=["frontend", "openai", "stream"])
+def test_openai_stream(base):
+    r = requests.post(f"{base}/v1/chat/completions", json={
+        "model": DEFAULT_MODEL, "stream": True,
+        "messages": [{"role": "user", "content": "Say hi"}]
+    }, timeout=TIMEOUT, stream=True)
+    chunks, done = [], False
+    for line in r.iter_lines(decode_unicode=True):
+        if line == "data: [DONE]":
+            done = True
+            break
+        if line.startswith("data: "):
+            chunks.append(json.loads(line[6:]))
+    assert done, "missing [DONE]"
+    assert chunks and chunks[0].get("object") == "chat.completion.chunk", "bad chunk format"
+    ok("OpenAI streaming", f"{len(chunks)} chunks")
+
 @test("Frontend: /v1/models", tags=["frontend", "openai"])
 def test_openai_models(base):
     r = get(f"{base}/v1/models")
@@ -258,6 +454,65 @@ def test_cloud_costs(base):
     bedrock = [p for p in providers if p.startswith("Bedrock")]
     ok("cloud-costs", f"{len(providers)} providers, {len(bedrock)} Bedrock")
 
+@test("Frontend: prompt cache hit", tags=["frontend", "costs", "cache"])
+def test_prompt_cache_stats(base):
+    before = get(f"{base}/cloud-costs").json().get("cached", {}).get("cache")
+    if before is None:
+        skip("prompt cache", "no cache stats")
+        return
+    payload = {"description": f"print hello world in python ({uuid.uuid4().hex[:8]})", "model": DEFAULT_MODEL}
+    first = post(f"{base}/generate-code", payload).json()
+    assert not first.get("error"), f"error: {first.get('error')}"
+    second = post(f"{base}/generate-code", payload).json()
+    assert second.get("cached"), "repeat request was not served from cache"
+    after = get(f"{base}/cloud-costs").json()["cached"]["cache"]
+    assert after["hits"] > before["hits"], "cache hits did not increase"
+    ok("prompt cache", f"{after['entries']} entries, {after['bytes']} bytes, hit rate {after['hit_rate']}")
+
+@test("Frontend: disk cache tier", tags=["frontend", "costs", "cache"])
+def test_disk_cache(base):
+    before = get(f"{base}/cloud-costs").json().get("cached", {}).get("disk_cache")
+    if not before:
+        skip("disk cache", "SHELLAMA_DISK_CACHE not set")
+        return
+    payload = {"description": f"print hello world in go ({uuid.uuid4().hex[:8]})", "model": DEFAULT_MODEL}
+    first = post(f"{base}/generate-code", payload).json()
+    assert not first.get("error"), f"error: {first.get('error')}"
+    r = post(f"{base}/api/cache/clear", {"tier": "memory"})
+    assert r.status_code == 200, f"clear memory tier: HTTP {r.status_code}"
+    second = post(f"{base}/generate-code", payload).json()
+    assert second.get("cached"), "repeat request was not served from the disk tier"
+    disk = get(f"{base}/cloud-costs").json()["cached"]["disk_cache"]
+    assert disk["hits"] > before["hits"], "disk cache hits did not increase"
+    assert disk["bytes"] <= disk["max_bytes"], "disk cache over its size cap"
+    ok("disk cache", f"{disk['entries']} entries, {disk['bytes_on_disk']} bytes on disk, hit rate {disk['hit_rate']}")
+
+@test("Frontend: semantic cache stats", tags=["frontend", "costs", "cache"])
+def test_semantic_cache(base):
+    sem = get(f"{base}/cloud-costs").json().get("cached", {}).get("semantic_cache")
+    if not sem:
+        skip("semantic cache", "SHELLAMA_SEMANTIC_CACHE not enabled")
+        return
+    assert sem["thresholds"], "no task types eligible"
+    assert set(sem["similarity"]) >= {"p50", "p90", "histogram"}, "missing similarity distribution"
+    ok("semantic cache", f"{sem['entries']} entries via {sem['vector_backend']}, hit rate {sem['hit_rate']}")
+
+@test("Frontend: semantic cache hit", tags=["frontend", "costs", "cache"])
+def test_semantic_cache_hit(base):
+    sem = get(f"{base}/cloud-costs").json().get("cached", {}).get("semantic_cache")
+    if not sem or "chat" not in sem["thresholds"]:
+        skip("semantic cache hit", "semantic cache not enabled for chat")
+        return
+    tag = uuid.uuid4().hex[:8]
+    first = post(f"{base}/chat", {"message": f"In one sentence, what is a Python list? (ref {tag})", "model": DEFAULT_MODEL}).json()
+    assert not first.get("error"), f"error: {first.get('error')}"
+    second = post(f"{base}/chat", {"message": f"In one sentence, what is a Python list?  (ref {tag})", "model": DEFAULT_MODEL}).json()
+    assert second.get("cached"), "near-duplicate prompt was not served from the semantic cache"
+    assert second.get("semantic_similarity", 0) >= sem["thresholds"]["chat"], f"similarity {second.get('semantic_similarity')}"
+    after = get(f"{base}/cloud-costs").json()["cached"]["semantic_cache"]
+    assert after["hits"] > sem["hits"], "semantic hits did not increase"
+    ok("semantic cache hit", f"similarity {second['semantic_similarity']}, {after['entries']} entries")
+
 @test("Frontend: /cloud-costs has Bedrock models", tags=["frontend", "costs", "bedrock"])
 def test_bedrock_costs(base):
     r = get(f"{base}/cloud-costs")
@@ -276,6 +531,17 @@ def test_cost_history(base):
     assert "prompt_tokens" in d, "missing prompt_tokens"
     ok("cost-history", f"{d['prompt_tokens']} prompt tok")
 
+@test("Frontend: /cost-history buckets add up", tags=["frontend", "costs"])
+def test_cost_history_split(base):
+    now = time.time()
+    mid = now - 5400  # splits an hour bucket, so both halves need partial scans
+    whole = get(f"{base}/cost-history?since=0&until={now}").json()
+    first = get(f"{base}/cost-history?since=0&until={mid}").json()
+    second = get(f"{base}/cost-history?since={mid + 0.000001}&until={now}").json()
+    for key in ("requests", "prompt_tokens", "response_tokens"):
+        assert whole[key] == first[key] + second[key], f"{key}: {whole[key]} != {first[key]} + {second[key]}"
+    ok("cost-history buckets", f"{whole['requests']} requests = {first['requests']} + {second['requests']}")
+
 @test("Frontend: /ip-tokens", tags=["frontend", "stats"])
 def test_ip_tokens(base):
     r = get(f"{base}/ip-tokens")
@@ -296,8 +562,78 @@ def test_queue_history(base):
     assert isinstance(d, (list, dict)), "expected list or dict"
     ok("queue-history", f"{len(d)} entries")
 
+@test("Frontend: history downsampled", tags=["frontend", "stats"])
+def test_history_downsampled(base):
+    series = {**get(f"{base}/ip-tokens").json(), **get(f"{base}/queue-history").json()}
+    for key, points in series.items():
+        assert len(points) <= 500, f"{key}: {len(points)} points, expected at most 500"
+        ts = [p["timestamp"] for p in points]
+        assert ts == sorted(ts), f"{key}: points out of order"
+    ok("history downsampled", f"{len(series)} series, max {max((len(p) for p in series.values()), default=0)} points")
+
+@test("Frontend: history range queries", tags=["frontend", "stats"])
+def test_history_range(base):
+    r = get(f"{base}/queue-history?since={time.time() - 3600}&step=60&agg=avg")
+    assert r.status_code == 200, f"HTTP {r.status_code}"
+    for url, points in r.json().items():
+        assert all(p["timestamp"] % 60 == 0 for p in points), f"{url}: buckets not aligned to step"
+        assert len(points) <= 61, f"{url}: {len(points)} buckets for one hour at step=60"
+    assert get(f"{base}/queue-history?agg=median").status_code == 400, "bad agg accepted"
+    cursor = r.headers.get("X-Cursor")
+    if not cursor:
+        skip("history range queries", "no queue history yet")
+        return
+    newer = get(f"{base}/queue-history?cursor={cursor}").json()
+    assert all(p["timestamp"] >= float(cursor) // 1 for points in newer.values() for p in points), "cursor returned old points"
+    ok("history range queries", f"{len(r.json())} series, cursor {cursor}")
+
+@test("Frontend: history long range", tags=["frontend", "stats"])
+def test_history_long_range(base):
+    since = time.time() - 40 * 86400
+    for path in ("ip-tokens", "queue-history"):
+        r = get(f"{base}/{path}?since={since}&step=86400")
+        assert r.status_code == 200, f"{path}: HTTP {r.status_code}"
+        for key, points in r.json().items():
+            ts = [p["timestamp"] for p in points]
+            assert ts == sorted(ts) and len(set(ts)) == len(ts), f"{path} {key}: buckets out of order or repeated"
+            assert all(t % 86400 == 0 for t in ts), f"{path} {key}: buckets not aligned to step"
+    ok("history long range", "40 days at step=86400")
+
+@test("Frontend: history store", tags=["frontend", "stats"])
+def test_history_store(base):
+    h = get(f"{base}/queue-status").json().get("history_store")
+    if h is None:
+        skip("history store", "not a frontend")
+        return
+    assert set(h["rows"]) == {"ip_tokens", "backend_tokens", "queue"}, f"unexpected tables {h['rows']}"
+    assert h["bytes_on_disk"] > 0, "history database is empty"
+    ok("history store", f"{sum(h['rows'].values())} raw rows, {h['pending']} pending, {h['bytes_on_disk']} bytes")
+
 # ── Admin endpoints ─────────────────────────────────────────────────────────
 
+@test("Frontend: /api/audit/status", tags=["frontend", "admin"])
+def test_audit_status(base):
+    r = get(f"{base}/api/audit/status")
+    if r.status_code == 404:
+        skip("audit status", "not a frontend")
+        return
+    d = r.json()
+    for key in ("audit_enabled", "entries_in_memory", "pending", "written", "dropped"):
+        assert key in d, f"missing {key}"
+    ok("audit status", f"{d['entries_in_memory']} in memory, {d['written']} written, {d['pending']} pending")
+
+@test("Frontend: /api/webhooks delivery stats", tags=["frontend", "admin"])
+def test_webhook_stats(base):
+    r = get(f"{base}/api/webhooks")
+    if r.status_code in (401, 403, 404):
+        skip("webhook stats", f"HTTP {r.status_code}")
+        return
+    d = r.json().get("delivery")
+    assert d is not None, "missing delivery stats"
+    for url, st in d["urls"].items():
+        assert st["delivered"] + st["failed"] >= st["dead"], f"{url}: inconsistent counters {st}"
+    ok("webhook stats", f"{len(d['urls'])} urls, {d['queued']} queued, {d['retrying']} retrying")
+
 @test("Frontend: /auto-fallback GET", tags=["frontend", "admin"])
 def test_auto_fallback(base):
     r = get(f"{base}/auto-fallback")